@@ -3,12 +3,13 @@
 
 from marshmallow_sqlalchemy import ModelSchema
 
-from sqlalchemy import create_engine, event, MetaData
+from sqlalchemy import create_engine, event, inspect, text, MetaData
 from sqlalchemy.engine import Engine
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.pool import NullPool
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy_utils import database_exists, create_database
 
 import api_gateway.config
@@ -39,6 +40,7 @@ class ExecutionDatabase(object):
         from api_gateway.executiondb.branch import Branch
         from api_gateway.executiondb.condition import Condition
         from api_gateway.executiondb.transform import Transform
+        from api_gateway.executiondb.reducer import Reducer
         # from api_gateway.executiondb.trigger import Trigger
         from api_gateway.executiondb.global_variable import GlobalVariable
         from api_gateway.executiondb.workflow_variable import WorkflowVariable
@@ -70,6 +72,7 @@ class ExecutionDatabase(object):
 
         Base.metadata.bind = self.engine
         Base.metadata.create_all(self.engine)
+        self.add_missing_columns()
 
         # alembic_cfg = Config(api_gateway.config.Config.ALEMBIC_CONFIG, ini_section="execution",
         #                      attributes={'configure_logger': False})
@@ -80,6 +83,19 @@ class ExecutionDatabase(object):
             cls.instance = super(ExecutionDatabase, cls).__new__(cls)
         return cls.instance
 
+    def add_missing_columns(self):
+        """Adds columns which models gained after their tables were created, as create_all only creates whole tables.
+        Columns which can't be null need a server default to be added to tables which already have rows.
+        """
+        inspector = inspect(self.engine)
+        with self.engine.begin() as connection:
+            for table in Base.metadata.sorted_tables:
+                existing = {column["name"] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name not in existing:
+                        column_ddl = CreateColumn(column).compile(dialect=self.engine.dialect)
+                        connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column_ddl}"))
+
     def tear_down(self):
         """Clean up the database
         """
@@ -4,6 +4,7 @@ from uuid import uuid4
 from sqlalchemy import Column, Boolean, ForeignKey, String, Integer, JSON, event
 from sqlalchemy.dialects.postgresql import UUID, ARRAY
 from sqlalchemy.orm import relationship
+from sqlalchemy.sql import false
 
 from marshmallow import fields, EXCLUDE
 from marshmallow_sqlalchemy import field_for
@@ -27,6 +28,8 @@ class ActionApi(Base):
     node_type = Column(String(), nullable=False, default="ACTION")
     location = Column(String(), nullable=False)
     description = Column(String(), default="")
+    cacheable = Column(Boolean(), nullable=False, default=False, server_default=false())
+    cache_ttl = Column(Integer)
     returns = relationship("ReturnApi", uselist=False, cascade="all, delete-orphan", passive_deletes=True)
     parameters = relationship("ParameterApi", cascade="all, delete-orphan", passive_deletes=True)
 
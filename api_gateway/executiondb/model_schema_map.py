@@ -10,6 +10,7 @@ from api_gateway.executiondb.dashboard import (Dashboard, DashboardSchema,
 from api_gateway.executiondb.global_variable import GlobalVariable, GlobalVariableSchema
 from api_gateway.executiondb.parameter import (Parameter, ParameterSchema,
                                                ParameterApi, ParameterApiSchema)
+from api_gateway.executiondb.reducer import Reducer, ReducerSchema
 from api_gateway.executiondb.returns import ReturnApi, ReturnApiSchema
 from api_gateway.executiondb.transform import Transform, TransformSchema
 from api_gateway.executiondb.trigger import Trigger, TriggerSchema
@@ -30,6 +31,7 @@ _schema_lookup = {
     GlobalVariable: GlobalVariableSchema,
     Parameter: ParameterSchema,
     ParameterApi: ParameterApiSchema,
+    Reducer: ReducerSchema,
     ReturnApi: ReturnApiSchema,
     Transform: TransformSchema,
     Trigger: TriggerSchema,
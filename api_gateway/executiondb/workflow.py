@@ -10,12 +10,13 @@ from jsonschema import Draft4Validator, ValidationError as JSONSchemaValidationE
 
 from flask import current_app
 
-from common.workflow_types import ParameterVariant
+from common.workflow_types import ParameterVariant, REDUCERS
 
 from api_gateway.helpers import validate_uuid
 from api_gateway.executiondb.global_variable import GlobalVariable
 from api_gateway.executiondb.condition import ConditionSchema
 from api_gateway.executiondb.transform import TransformSchema
+from api_gateway.executiondb.reducer import ReducerSchema
 from api_gateway.executiondb.branch import BranchSchema
 from api_gateway.executiondb.workflow_variable import WorkflowVariableSchema
 from api_gateway.executiondb import Base, BaseSchema
@@ -44,10 +45,11 @@ class Workflow(Base):
     branches = relationship("Branch", cascade="all, delete-orphan", passive_deletes=True)
     conditions = relationship("Condition", cascade="all, delete-orphan", passive_deletes=True)
     transforms = relationship("Transform", cascade="all, delete-orphan", passive_deletes=True)
+    reducers = relationship("Reducer", cascade="all, delete-orphan", passive_deletes=True)
     workflow_variables = relationship("WorkflowVariable", cascade="save-update")
     triggers = relationship("Trigger", cascade="all, delete-orphan", passive_deletes=True)
 
-    children = ['actions', 'conditions', 'transforms', 'triggers']
+    children = ['actions', 'conditions', 'transforms', 'reducers', 'triggers']
 
     def __init__(self, **kwargs):
         super(Workflow, self).__init__(**kwargs)
@@ -55,7 +57,8 @@ class Workflow(Base):
 
     def validate(self):
         """Validates the object"""
-        node_ids = {node.id_ for node in self.actions + self.conditions + self.transforms + self.triggers}
+        node_ids = {node.id_ for node in
+                    self.actions + self.conditions + self.transforms + self.reducers + self.triggers}
         wfv_ids = {workflow_var.id_ for workflow_var in self.workflow_variables}
         global_ids = set(id_ for id_, in current_app.running_context.execution_db.session.query(GlobalVariable.id_))
 
@@ -141,6 +144,20 @@ class Workflow(Base):
             action.errors = errors
             action.is_valid = action.is_valid_rec()
 
+        for reducer in self.reducers:
+            reducer.errors = []
+
+            if reducer.reducer not in REDUCERS:
+                reducer.errors.append(f"Reducer '{reducer.reducer}' does not exist. Available reducers are: "
+                                      f"{', '.join(REDUCERS)}.")
+            elif reducer.reducer == "group_by" and reducer.parameter is None:
+                reducer.errors.append("The group_by reducer requires the key to group by as its parameter.")
+
+            if len([branch for branch in self.branches if branch.destination_id == reducer.id_]) != 1:
+                reducer.errors.append("Reducers must have exactly one incoming connection.")
+
+            reducer.is_valid = reducer.is_valid_rec()
+
         self.is_valid = self.is_valid_rec()
 
     def is_valid_rec(self):
@@ -165,6 +182,7 @@ class WorkflowSchema(BaseSchema):
     branches = fields.Nested(BranchSchema, many=True)
     conditions = fields.Nested(ConditionSchema, many=True)
     transforms = fields.Nested(TransformSchema, many=True)
+    reducers = fields.Nested(ReducerSchema, many=True)
     triggers = fields.Nested(TriggerSchema, many=True)
     workflow_variables = fields.Nested(WorkflowVariableSchema, many=True)
 
@@ -218,6 +218,13 @@ def regenerate_workflow_ids(workflow):
         id_mapping[prev_id] = transform['id_']
         transform['position']['id_'] = str(uuid4())
 
+    reducers = workflow.get('reducers', [])
+    for reducer in reducers:
+        prev_id = reducer['id_']
+        reducer['id_'] = str(uuid4())
+        id_mapping[prev_id] = reducer['id_']
+        reducer['position']['id_'] = str(uuid4())
+
     workflow_variables = workflow.get('workflow_variables', [])
     for workflow_variable in workflow_variables:
         prev_id = workflow_variable["id_"]
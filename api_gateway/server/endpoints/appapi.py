@@ -1,5 +1,6 @@
 from copy import deepcopy
 import json
+import time
 import yaml
 from http import HTTPStatus
 
@@ -52,6 +53,29 @@ def remove_locations(app_api):
     return app_api
 
 
+def result_cache_fields(app_api):
+    return [f"{app_api.name}:{app_api.app_version}:{action.name}" for action in app_api.actions]
+
+
+def publish_result_cache_ttls(app_api, stale_fields=()):
+    """
+        Publishes the TTLs of an app's cacheable actions to the hash the workers check before dispatching actions, and
+        removes the fields of actions which are no longer cacheable.
+    """
+    key = Config.common_config.REDIS_RESULT_CACHE_POLICIES
+    default_ttl = Config.common_config.get_int("RESULT_CACHE_TTL", 3600)
+    ttls = {f"{app_api.name}:{app_api.app_version}:{action.name}": action.cache_ttl or default_ttl
+            for action in app_api.actions if action.cacheable}
+    stale = [field for field in {*stale_fields, *result_cache_fields(app_api)} if field not in ttls]
+
+    pipe = current_app.running_context.cache.pipeline()
+    if stale:
+        pipe.hdel(key, *stale)
+    if ttls:
+        pipe.hmset(key, ttls)
+    pipe.execute()
+
+
 @jwt_required
 @permissions_accepted_for_resources(ResourcePermissions('app_apis', ['read']))
 def read_all_app_names():
@@ -77,6 +101,7 @@ def create_app_api():
         current_app.running_context.execution_db.session.add(app_api)
         current_app.running_context.execution_db.session.commit()
         current_app.logger.info(f"Created App API {app_api.name} ({app_api.id_})")
+        publish_result_cache_ttls(app_api)
         return app_api_schema.dump(app_api), HTTPStatus.CREATED
     except ValidationError as e:
         current_app.running_context.execution_db.session.rollback()
@@ -108,10 +133,12 @@ def read_app_api(app):
 def update_app_api(app):
     data = request.get_json()
     add_locations(data)
+    stale_fields = result_cache_fields(app)
     try:
         app_api_schema.load(data, instance=app)
         current_app.running_context.execution_db.session.commit()
         current_app.logger.info(f"Updated app_api {app.name} ({app.id_})")
+        publish_result_cache_ttls(app, stale_fields)
         return app_api_schema.dump(app), HTTPStatus.OK
     except IntegrityError:
         current_app.running_context.execution_db.session.rollback()
@@ -122,7 +149,35 @@ def update_app_api(app):
 @permissions_accepted_for_resources(ResourcePermissions('app_apis', ['delete']))
 @with_app_api('delete', 'app')
 def delete_app_api(app):
+    stale_fields = result_cache_fields(app)
     current_app.running_context.execution_db.session.delete(app)
     current_app.logger.info(f"Removed app_api {app.name} ({app.id_})")
     current_app.running_context.execution_db.session.commit()
+    if stale_fields:
+        current_app.running_context.cache.hdel(Config.common_config.REDIS_RESULT_CACHE_POLICIES, *stale_fields)
     return None, HTTPStatus.NO_CONTENT
+
+
+@jwt_required
+@permissions_accepted_for_resources(ResourcePermissions('app_apis', ['read']))
+def read_result_cache_stats():
+    cache = current_app.running_context.cache
+    prefix = Config.common_config.REDIS_RESULT_CACHE
+    stats = {key.decode(): int(value) for key, value in cache.hgetall(f"{prefix}:stats").items()}
+
+    # Results which expired since the workers last used the cache are still in its index, but aren't counted
+    size = cache.zcard(f"{prefix}:index") - cache.zcount(f"{prefix}:expiries", "-inf", time.time())
+    return {"hits": stats.get("hits", 0), "misses": stats.get("misses", 0), "evictions": stats.get("evictions", 0),
+            "size": max(size, 0), "capacity": Config.common_config.get_int("RESULT_CACHE_SIZE", 10000)}, HTTPStatus.OK
+
+
+@jwt_required
+@permissions_accepted_for_resources(ResourcePermissions('app_apis', ['read']))
+def read_autoscaler_status():
+    cache = current_app.running_context.cache
+    limit = request.args.get("limit", 100, type=int)
+    services = [json.loads(metrics) for metrics in
+                cache.hgetall(Config.common_config.REDIS_AUTOSCALER_METRICS).values()]
+    decisions = [json.loads(fields[b"decision"]) for _, fields in
+                 cache.xrevrange(Config.common_config.REDIS_AUTOSCALER_LOG, count=limit)]
+    return {"services": services, "decisions": decisions}, HTTPStatus.OK
@@ -11,6 +11,7 @@ from api_gateway.server.decorators import with_resource_factory, paginate
 from api_gateway.server.problem import unique_constraint_problem
 from http import HTTPStatus
 from api_gateway.executiondb.global_variable import GlobalCipher
+from api_gateway.config import Config
 
 import logging
 logger = logging.getLogger(__name__)
@@ -34,6 +35,11 @@ def global_variable_template_getter(global_template):
             name=global_template).first()
 
 
+def publish_global_change(global_var):
+    """ Tells the workers to drop any copy of this global they have cached """
+    current_app.running_context.cache.publish(Config.common_config.REDIS_GLOBALS_CHANNEL, str(global_var.id_))
+
+
 with_global_variable = with_resource_factory("global_variable", global_variable_getter)
 global_variable_schema = GlobalVariableSchema()
 
@@ -63,6 +69,27 @@ def read_all_globals():
 
         return ret, HTTPStatus.OK
 
+#TODO: only allow decrypted read for permissible users
+@jwt_required
+@permissions_accepted_for_resources(ResourcePermissions("global_variables", ["read"]))
+def read_globals_by_id(ids):
+    valid_ids = [id_ for id_ in ids if helpers.validate_uuid(id_)]
+    query = current_app.running_context.execution_db.session.query(GlobalVariable).filter(
+        GlobalVariable.id_.in_(valid_ids)).all()
+    globals_json = [global_variable_schema.dump(global_var) for global_var in query]
+
+    if request.args.get('to_decrypt') == "false":
+        return jsonify(globals_json), HTTPStatus.OK
+    else:
+        f = open('/run/secrets/encryption_key')
+        key = f.read()
+        my_cipher = GlobalCipher(key)
+
+        for global_json in globals_json:
+            global_json['value'] = my_cipher.decrypt(global_json['value'])
+        return jsonify(globals_json), HTTPStatus.OK
+
+
 #TODO: only allow decrypted read for permissible users
 @jwt_required
 @permissions_accepted_for_resources(ResourcePermissions("global_variables", ["read"]))
@@ -88,6 +115,7 @@ def delete_global(global_var):
     current_app.running_context.execution_db.session.delete(global_var)
     current_app.logger.info(f"Global_variable removed {global_var.name}")
     current_app.running_context.execution_db.session.commit()
+    publish_global_change(global_var)
     return None, HTTPStatus.NO_CONTENT
 
 
@@ -113,6 +141,7 @@ def update_global(global_var):
     try:
         global_variable_schema.load(data, instance=global_var)
         current_app.running_context.execution_db.session.commit()
+        publish_global_change(global_var)
         return global_variable_schema.dump(global_var), HTTPStatus.OK
     except (IntegrityError, StatementError):
         current_app.running_context.execution_db.session.rollback()
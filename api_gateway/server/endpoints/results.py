@@ -8,9 +8,11 @@ from gevent.queue import Queue
 from flask import Blueprint, Response, current_app, request
 from flask_jwt_extended import jwt_required
 from sqlalchemy.exc import IntegrityError
+from marshmallow import ValidationError
 
 import jsonpatch
 
+from common.message_types import find_result_refs, replace_result_refs
 from api_gateway.helpers import sse_format
 from api_gateway.server.decorators import with_resource_factory, paginate, is_valid_uid
 from api_gateway.executiondb.workflowresults import (WorkflowStatus, NodeStatus, WorkflowStatusSchema,
@@ -52,11 +54,26 @@ def push_to_workflow_stream_queue(workflow_status, event):
         workflow_stream_subs['all'].put(sse_event_text)
 
 
-def push_to_action_stream_queue(node_statuses, event):
+def load_results(cache, value):
+    """
+        Large results are stored by apps and workers under a claim check, which is what gets saved on the NodeStatus.
+        They're only fetched, with a single MGET, when they're about to be handed out.
+    """
+    keys = list(dict.fromkeys(find_result_refs(value)))
+    if len(keys) < 1:
+        return value
+
+    return replace_result_refs(value, {key: json.loads(result) for key, result in zip(keys, cache.mget(keys))
+                                       if result is not None})
+
+
+def push_to_action_stream_queue(node_statuses, event, cache=None):
+    """ Pushes already dumped node statuses, so that subscribers see them as they were when they were updated """
 
     event_id = 0
-    for node_status in node_statuses:
-        node_status_json = node_status_schema.dump(node_status)
+    for node_status_json in node_statuses:
+        if cache is not None:
+            node_status_json["result"] = load_results(cache, node_status_json["result"])
         node_status_json["execution_id"] = str(node_status_json["execution_id"])
         execution_id = str(node_status_json["execution_id"])
         sse_event_text = sse_format(data=node_status_json, event=event, event_id=event_id)
@@ -98,13 +115,9 @@ def push_to_action_stream_queue(node_statuses, event):
 #         current_app.running_context.execution_db.session.rollback()
 #         return unique_constraint_problem('workflow_status', 'create', workflow.name)
 
-# TODO: maybe make an internal user for the worker/umpire?
-@jwt_required
-@permissions_accepted_for_resources(ResourcePermissions("workflowstatus", ["create"]))
-@with_workflow_status('update', 'execution_id')
-def update_workflow_status(execution_id):
-    old_workflow_status = workflow_status_schema.dump(execution_id)
-    data = request.get_json()
+def apply_status_patches(workflow_status, patches):
+    """ Applies a list of JSON patches to a WorkflowStatus model and returns the patched status as a dict """
+    old_workflow_status = workflow_status_schema.dump(workflow_status)
 
     # TODO: change these on the db model to be keyed by ID
     if "node_statuses" in old_workflow_status:
@@ -113,7 +126,7 @@ def update_workflow_status(execution_id):
     else:
         old_workflow_status["node_statuses"] = {}
 
-    patch = jsonpatch.JsonPatch.from_string(json.dumps(data))
+    patch = jsonpatch.JsonPatch(patches)
 
     logger.debug(f"Patch: {patch}")
     logger.debug(f"Old Workflow Status: {old_workflow_status}")
@@ -121,17 +134,26 @@ def update_workflow_status(execution_id):
     new_workflow_status = patch.apply(old_workflow_status)
 
     new_workflow_status["node_statuses"] = list(new_workflow_status["node_statuses"].values())
+    workflow_status_schema.load(new_workflow_status, instance=workflow_status)
+    return new_workflow_status
 
+
+# TODO: maybe make an internal user for the worker/umpire?
+@jwt_required
+@permissions_accepted_for_resources(ResourcePermissions("workflowstatus", ["create"]))
+@with_workflow_status('update', 'execution_id')
+def update_workflow_status(execution_id):
+    data = request.get_json()
     event = request.args.get("event")
 
     try:
-        execution_id = workflow_status_schema.load(new_workflow_status, instance=execution_id)
+        new_workflow_status = apply_status_patches(execution_id, data)
         current_app.running_context.execution_db.session.commit()
 
         node_statuses = []
         for patch in data:
             if "node_statuses" in patch["path"]:
-                node_statuses.append(node_status_getter(patch["value"]["combined_id"]))
+                node_statuses.append(node_status_schema.dump(node_status_getter(patch["value"]["combined_id"])))
 
         # TODo: Replace this when moving to sanic
         current_app.logger.info(f"Workflow Status update: {new_workflow_status}")
@@ -139,7 +161,7 @@ def update_workflow_status(execution_id):
 
         if node_statuses:
             current_app.logger.info(f"Action Status update:{node_statuses}")
-            gevent.spawn(push_to_action_stream_queue, node_statuses, event)
+            gevent.spawn(push_to_action_stream_queue, node_statuses, event, current_app.running_context.cache)
 
         current_app.logger.info(f"Updated workflow status {execution_id.execution_id} ({execution_id.name})")
         return workflow_status_schema.dump(execution_id), HTTPStatus.OK
@@ -148,6 +170,62 @@ def update_workflow_status(execution_id):
         return unique_constraint_problem('workflow status', 'update', execution_id.id_)
 
 
+@jwt_required
+@permissions_accepted_for_resources(ResourcePermissions("workflowstatus", ["create"]))
+def update_workflow_statuses():
+    data = request.get_json()
+    session = current_app.running_context.execution_db.session
+
+    # Group the updates by execution so each WorkflowStatus is loaded and committed only once
+    updates_by_execution = {}
+    for index, update in enumerate(data):
+        updates_by_execution.setdefault(update["execution_id"], []).append((index, update))
+
+    events = []
+    updated = []
+    missing = []
+    failed = []
+    for execution_id, updates in updates_by_execution.items():
+        workflow_status = workflow_status_getter(execution_id) if is_valid_uid(execution_id) else None
+        if workflow_status is None:
+            logger.error(f"Could not update workflow status {execution_id}. Workflow status does not exist")
+            missing.append(execution_id)
+            continue
+
+        # Each update is applied in its own savepoint so that a bad patch only loses the update it was sent in
+        applied = 0
+        for index, update in updates:
+            try:
+                with session.begin_nested():
+                    new_workflow_status = apply_status_patches(workflow_status, update["patches"])
+            except (jsonpatch.JsonPatchException, jsonpatch.JsonPointerException, ValidationError, IntegrityError):
+                logger.exception(f"Could not apply update {index} ({update['event']}) to workflow status "
+                                 f"{execution_id}")
+                failed.append({"index": index, "execution_id": execution_id, "event": update["event"]})
+                continue
+
+            # The statuses are dumped now, as later updates in the batch change the same rows
+            combined_ids = {patch["value"]["combined_id"] for patch in update["patches"]
+                            if "node_statuses" in patch["path"]}
+            node_statuses = [node_status_schema.dump(node_status) for node_status in workflow_status.node_statuses
+                             if node_status.combined_id in combined_ids]
+            events.append((index, new_workflow_status, node_statuses, update["event"]))
+            applied += 1
+
+        session.commit()
+        if applied:
+            updated.append(execution_id)
+
+    # Replay the events in the order they were sent so stream subscribers see the same sequence as individual patches
+    for _, new_workflow_status, node_statuses, event in sorted(events, key=lambda e: e[0]):
+        gevent.spawn(push_to_workflow_stream_queue, new_workflow_status, event)
+        if node_statuses:
+            gevent.spawn(push_to_action_stream_queue, node_statuses, event, current_app.running_context.cache)
+
+    current_app.logger.info(f"Applied {len(events)} of {len(data)} updates to {len(updated)} workflow statuses")
+    return {"updated": updated, "missing": missing, "failed": failed}, HTTPStatus.OK
+
+
 @results_stream.route('/workflow_status')
 def workflow_stream():
     execution_id = request.args.get('workflow_execution_id', 'all')
@@ -13,14 +13,16 @@ import gevent
 
 from marshmallow import ValidationError
 
+from common.compression import compress_payload
 from common.message_types import StatusEnum, message_dumps
+from common.workflow_types import ExecutionPlan, workflow_loads
 from api_gateway.executiondb.workflow import Workflow, WorkflowSchema
 from api_gateway.executiondb.workflowresults import WorkflowStatus, WorkflowStatusSchema
 from api_gateway.security import permissions_accepted_for_resources, ResourcePermissions
 from api_gateway.server.decorators import with_resource_factory, validate_resource_exists_factory, is_valid_uid, \
     paginate
 from api_gateway.server.problem import dne_problem, invalid_input_problem, improper_json_problem
-from api_gateway.server.endpoints.results import push_to_workflow_stream_queue
+from api_gateway.server.endpoints.results import push_to_workflow_stream_queue, load_results
 from http import HTTPStatus
 from api_gateway.config import Config
 
@@ -39,6 +41,29 @@ def workflow_getter(workflow_id):
 workflow_schema = WorkflowSchema()
 workflow_status_schema = WorkflowStatusSchema()
 
+
+def execution_plan_key(workflow_id, digest):
+    """ Plans are keyed by workflow id and the digest of the version of the workflow they were compiled from """
+    return f"{Config.common_config.REDIS_EXECUTION_PLANS}:{workflow_id}:{digest}"
+
+
+def get_execution_plan(workflow):
+    """
+        Returns the serialized workflow along with the digest of its execution plan. The workflow is serialized for
+        every execution so that no change to it is missed, but each version of it is only compiled once, then cached
+        in redis where the workers look up the plan by the same digest.
+    """
+    workflow_json = workflow_schema.dump(workflow)
+    digest = ExecutionPlan.digest(workflow_json)
+
+    cache = current_app.running_context.cache
+    key = execution_plan_key(workflow.id_, digest)
+    ttl = Config.common_config.get_int("EXECUTION_PLAN_TTL", 86400)
+    if not cache.expire(key, ttl):
+        plan = ExecutionPlan.compile(workflow_loads(json.dumps(workflow_json)))
+        cache.set(key, plan.dumps(), ex=ttl)
+    return workflow_json, digest
+
 with_workflow = with_resource_factory('workflow', workflow_getter, validator=is_valid_uid)
 with_workflow_status = with_resource_factory('workflow', workflow_status_getter, validator=is_valid_uid)
 
@@ -64,6 +89,8 @@ def get_all_workflow_status():
 @with_workflow_status('control', 'execution')
 def get_workflow_status(execution):
     workflow_status = workflow_status_schema.dump(execution)
+    workflow_status["node_statuses"] = load_results(current_app.running_context.cache,
+                                                    workflow_status.get("node_statuses", []))
     return workflow_status, HTTPStatus.OK
 
 @jwt_required
@@ -80,7 +107,7 @@ def execute_workflow():
     if not workflow.is_valid:
         return invalid_input_problem("workflow", "execute", workflow.id_, errors=workflow.errors)
 
-    workflow = workflow_schema.dump(workflow)
+    workflow, plan_digest = get_execution_plan(workflow)
 
     actions_by_id = {a['id_']: a for a in workflow["actions"]}
     triggers_by_id = {t['id_']: t for t in workflow["triggers"]}
@@ -116,6 +143,9 @@ def execute_workflow():
             return invalid_input_problem("workflow", "execute", workflow.id_,
                                          errors=["Cannot override starting parameters for anything but an action."])
 
+    # The cached plan was compiled from the stored workflow, so it no longer applies once the graph is overridden
+    workflow["plan_digest"] = plan_digest if "start" not in data and "parameters" not in data else None
+
     try:
         execution_id = execute_workflow_helper(workflow_id, execution_id, workflow)
         return jsonify({'execution_id': execution_id}), HTTPStatus.ACCEPTED
@@ -128,7 +158,8 @@ def execute_workflow_helper(workflow_id, execution_id=None, workflow=None):
     if not execution_id:
         execution_id = str(uuid.uuid4())
     if not workflow:
-        workflow = workflow_schema.dump(workflow_getter(workflow_id))
+        workflow, plan_digest = get_execution_plan(workflow_getter(workflow_id))
+        workflow["plan_digest"] = plan_digest
     workflow_status_json = {  # ToDo: Probably load this directly into db model?
         "execution_id": execution_id,
         "workflow_id": workflow_id,
@@ -146,9 +177,11 @@ def execute_workflow_helper(workflow_id, execution_id=None, workflow=None):
     # Assign the execution id to the workflow so the worker knows it
     workflow["execution_id"] = execution_id
     # ToDo: self.__box.encrypt(message))
-    current_app.running_context.cache.sadd(Config.common_config.REDIS_PENDING_WORKFLOWS, execution_id)
-    current_app.running_context.cache.xadd(Config.common_config.REDIS_WORKFLOW_QUEUE,
-                                           {execution_id: json.dumps(workflow)})
+    pipe = current_app.running_context.cache.pipeline()
+    pipe.sadd(Config.common_config.REDIS_PENDING_WORKFLOWS, execution_id)
+    pipe.xadd(Config.common_config.REDIS_WORKFLOW_QUEUE, {execution_id: compress_payload(json.dumps(workflow))})
+    pipe.hincrby(Config.common_config.REDIS_AUTOSCALER_ARRIVALS, "worker", 1)  # for the umpire's autoscaler
+    pipe.execute()
     gevent.spawn(push_to_workflow_stream_queue, workflow_status_json, "PENDING")
     current_app.logger.info(f"Created Workflow Status {workflow['name']} ({execution_id})")
 
@@ -116,6 +116,7 @@ def update_workflow(workflow):
 
     try:
         workflow_schema.load(data, instance=workflow)
+        workflow.validate()
         current_app.running_context.execution_db.session.commit()
         current_app.logger.info(f"Updated workflow {workflow.name} ({workflow.id_})")
         return workflow_schema.dump(workflow), HTTPStatus.OK
@@ -1,6 +1,9 @@
+import asyncio
 import logging
 import os
+import signal
 import sys
+from contextvars import ContextVar
 
 import aioredis
 import aiohttp
@@ -8,8 +11,10 @@ import aiohttp
 from walkoff_app_sdk.common.message_types import NodeStatusMessage, message_dumps
 from walkoff_app_sdk.common.workflow_types import workflow_loads, Action, ParameterVariant
 from walkoff_app_sdk.common.async_logger import AsyncLogger, AsyncHandler
-from walkoff_app_sdk.common.helpers import UUID_GLOB
-from walkoff_app_sdk.common.redis_helpers import connect_to_redis_pool, xlen, xdel, deref_stream_message
+from walkoff_app_sdk.common.helpers import sint
+from walkoff_app_sdk.common.redis_helpers import (connect_to_redis_pool, xlen, xack_del, deref_stream_message,
+                                                  app_streams_key, app_stream_announcements_key, app_retirements_key,
+                                                  take_token, store_result, load_results)
 from walkoff_app_sdk.common.global_cipher import GlobalCipher
 
 
@@ -19,18 +24,30 @@ REDIS_ACTION_RESULTS_GROUP = os.getenv("REDIS_ACTION_RESULTS_GROUP", "actions-in
 REDIS_ABORTING_WORKFLOWS = os.getenv("REDIS_ABORTING_WORKFLOWS", "aborting-workflows")
 API_GATEWAY_URI = os.getenv("API_GATEWAY_URI", "http://api_gateway:8080")
 APP_TIMEOUT = os.getenv("APP_TIMEOUT", 30)
+APP_CONCURRENCY = os.getenv("APP_CONCURRENCY", 1)
+APP_BLOCK_TIMEOUT = os.getenv("APP_BLOCK_TIMEOUT", 1000)
+APP_IDLE_TIMEOUT = os.getenv("APP_IDLE_TIMEOUT", 60)
 CONTAINER_ID = os.getenv("HOSTNAME")
 
+# The ID to read announcements from when none have been made, which comes before any ID redis hands out
+NO_ANNOUNCEMENTS = b"0-0"
+
+# Actions run concurrently in their own tasks so anything tied to the action being executed must be task local
+execution_id_var = ContextVar("execution_id", default=None)
+
 
 class HTTPStream:
     """ Thin wrapper around an HTTP stream that plugs into the async logger """
     def __init__(self, session=None):
         super().__init__()
         self.session = session
-        self.execution_id = None
+
+    @property
+    def execution_id(self):
+        return execution_id_var.get()
 
     def set_execution_id(self, channel):
-        self.execution_id = channel
+        execution_id_var.set(channel)
 
     async def flush(self):
         pass
@@ -68,45 +85,160 @@ class AppBase:
         self.logger = logger if logger is not None else logging.getLogger("AppBaseLogger")
         self.console_logger = console_logger if console_logger is not None else logging.getLogger("ConsoleBaseLogger")
         self.current_execution_id = None
+        self.concurrency = max(sint(APP_CONCURRENCY, 1), 1)  # Handed to us by the umpire, which scales the app by it
+        self.in_flight = {}  # Executing action tasks and the executions they belong to
+        self.running = True
+
+    @property
+    def current_execution_id(self):
+        return execution_id_var.get()
+
+    @current_execution_id.setter
+    def current_execution_id(self, execution_id):
+        execution_id_var.set(execution_id)
+
+    def stop(self):
+        """ Stops reading new actions. Actions that are already executing are allowed to finish. """
+        self.logger.info("Stopping app...")
+        self.running = False
 
     async def get_actions(self):
-        """ Continuously monitors the action queue and asynchronously executes actions """
+        """
+            Continuously monitors the action queue and asynchronously executes up to self.concurrency actions. Once
+            there's been no work for APP_IDLE_TIMEOUT seconds, exits if the umpire has retired an idle replica.
+        """
         self.logger.debug("Waiting for actions...")
         app_group = f"{self.app_name}:{self.__version__}"
-
-        while True:
-            streams = await self.redis.keys(f"{UUID_GLOB}:{app_group}", encoding='utf-8')
-            aborted = await self.redis.smembers(REDIS_ABORTING_WORKFLOWS, encoding="utf-8")
-            streams = [s for s in streams if s.split(':')[0] not in aborted]
+        streams_key = app_streams_key(self.app_name, self.__version__)
+        announcements_key = app_stream_announcements_key(self.app_name, self.__version__)
+        retirements_key = app_retirements_key(self.app_name, self.__version__)
+        block_timeout = sint(APP_BLOCK_TIMEOUT, 1000)
+        idle_timeout = sint(APP_IDLE_TIMEOUT, 60)
+        idle_since = None
+        slots = asyncio.Semaphore(self.concurrency)
+        loop = asyncio.get_running_loop()
+
+        # The worker indexes each execution's stream for us, so we never have to scan the keyspace for work. The index
+        # is read once, then kept up to date from the streams the workers announce as they add them.
+        indexed, last_announced = await self.read_stream_index(streams_key, announcements_key)
+
+        while self.running:
+            await slots.acquire()
+            if not self.running:
+                slots.release()
+                break
+
+            pipe: aioredis.commands.Pipeline = self.redis.pipeline()
+            pipe.xrange(announcements_key, start=last_announced)
+            pipe.smembers(REDIS_ABORTING_WORKFLOWS, encoding="utf-8")
+            announced, aborted = await pipe.execute()
+            if last_announced != NO_ANNOUNCEMENTS and (len(announced) < 1 or announced[0][0] != last_announced):
+                # Announcements we hadn't read yet were trimmed, so the whole index is read again instead
+                indexed, last_announced = await self.read_stream_index(streams_key, announcements_key)
+            elif len(announced) > 0:
+                indexed.update(fields[b"stream"].decode() for _, fields in announced)
+                last_announced = announced[-1][0]
+            streams = [s for s in indexed if s.split(':')[0] not in aborted]
             num_streams = len(streams)
 
             if num_streams < 1:
-                sys.exit(-1)  # There's no scheduled work and no reason to live
+                slots.release()
+                if len(self.in_flight) > 0:  # Finish what we've started before deciding whether there's more work
+                    await asyncio.wait(self.in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+
+                idle_since = loop.time() if idle_since is None else idle_since
+                if loop.time() - idle_since >= idle_timeout and await take_token(self.redis, retirements_key):
+                    self.logger.info("Retiring idle app...")
+                    sys.exit(0)
+
+                # Stay warm for the next action, waking up as soon as a worker announces a stream for it
+                await self.redis.xread([announcements_key], timeout=block_timeout, latest_ids=[last_announced])
+                continue
+
+            idle_since = None
 
             try:
-                # See if we have any pending messages first
-                message = await self.redis.xread_group(app_group, CONTAINER_ID, streams=streams, count=1,
-                                                       latest_ids=list('0' * num_streams), timeout=None)
+                # See if we have any pending messages first. Once we're executing actions, they're the pending ones.
+                message = []
+                if len(self.in_flight) < 1:
+                    message = await self.redis.xread_group(app_group, CONTAINER_ID, streams=streams, count=1,
+                                                           latest_ids=list('0' * num_streams), timeout=None)
 
-                if len(message) < 1:  # We don't have any pending so lets get a new one
+                if len(message) < 1:  # We don't have any pending so lets wait for a new one
                     message = await self.redis.xread_group(app_group, CONTAINER_ID, streams=streams, count=1,
-                                                           latest_ids=list('>' * num_streams), timeout=None)
+                                                           latest_ids=list('>' * num_streams), timeout=block_timeout)
 
                 if len(message) < 1:  # We didn't get any messages, start over with new streams
+                    slots.release()
                     continue
             except aioredis.errors.ReplyError:
-                continue  # Just keep trying to read messages. This likely gets thrown if a stream doesn't exist
+                # This gets thrown once a stream we were reading has been deleted, i.e. because its execution finished
+                slots.release()
+                indexed.difference_update(await self.prune_streams(streams_key, streams))
+                continue
 
             execution_id_action, stream, id_ = deref_stream_message(message)
             execution_id, action = execution_id_action
 
             # Actually execute the action
-            action = workflow_loads(action)
+            action = workflow_loads(action, Action)
+            task = asyncio.create_task(self.run_action(action, stream, app_group, id_, slots))
+            self.in_flight[task] = action.execution_id
+
+        await asyncio.gather(*self.in_flight, return_exceptions=True)
+
+    async def read_stream_index(self, streams_key, announcements_key):
+        """
+            Reads the app's index of streams along with the ID of the last stream announced, in one transaction so
+            that every stream announced after that ID is one the index didn't have yet.
+        """
+        tr = self.redis.multi_exec()
+        fut_last = tr.xrevrange(announcements_key, count=1)
+        fut_indexed = tr.smembers(streams_key, encoding="utf-8")
+        await tr.execute()
+        last = await fut_last
+        return set(await fut_indexed), last[0][0] if len(last) > 0 else NO_ANNOUNCEMENTS
+
+    async def abort_executions(self):
+        """
+            Cancels the actions being executed for each execution which has been marked for abortion. Actions of
+            other executions carry on, so the app keeps running.
+        """
+        aborting = await self.redis.smembers(REDIS_ABORTING_WORKFLOWS, encoding="utf-8")
+        for task, execution_id in list(self.in_flight.items()):
+            if execution_id in aborting:
+                self.logger.info(f"Aborting action of execution {execution_id}")
+                task.cancel()
+
+    async def prune_streams(self, streams_key, streams):
+        """
+            Removes streams that no longer exist, i.e. because their execution finished, from the app's stream index.
+            Returns the streams which were removed.
+        """
+        pipe: aioredis.commands.Pipeline = self.redis.pipeline()
+        for stream in streams:
+            pipe.exists(stream)
+        exists = await pipe.execute()
+
+        dead_streams = [stream for stream, exist in zip(streams, exists) if not exist]
+        if len(dead_streams) > 0:
+            self.logger.info(f"Removing dead streams from {streams_key}: {dead_streams}")
+            await self.redis.srem(streams_key, *dead_streams)
+        return dead_streams
+
+    async def run_action(self, action: Action, stream, app_group, id_, slots: asyncio.Semaphore):
+        """ Executes a single action, then acknowledges its message and frees its slot for the next action. """
+        try:
             await self.execute_action(action)
 
             # Clean up workflow-queue
-            await self.redis.xack(stream=stream, group_name=app_group, id=id_)
-            await xdel(self.redis, stream=stream, id_=id_)
+            await xack_del(self.redis, stream, app_group, id_)
+        except Exception:
+            self.logger.exception(f"Error while running {action.label}-{action.execution_id}")
+        finally:
+            self.in_flight.pop(asyncio.current_task(), None)
+            slots.release()
 
     async def execute_action(self, action: Action):
         """ Execute an action, and push its result to Redis. """
@@ -119,7 +251,7 @@ class AppBase:
         if hasattr(self, action.name):
             # Tell everyone we started execution
             start_action_msg = NodeStatusMessage.executing_from_node(action, action.execution_id)
-            await self.redis.xadd(results_stream, {action.execution_id: message_dumps(start_action_msg)})
+            await self.redis.xadd(results_stream, {action.execution_id: message_dumps(start_action_msg, stream=True)})
 
             try:
                 func = getattr(self, action.name, None)
@@ -137,9 +269,12 @@ class AppBase:
                                 params[p.name] = temp
                             else:
                                 params[p.name] = p.value
-                        result = await func(**params)
 
-                    action_result = NodeStatusMessage.success_from_node(action, action.execution_id, result=result)
+                        # Large results of upstream actions are passed by reference and only fetched here
+                        result = await func(**(await load_results(self.redis, params)))
+
+                    action_result = NodeStatusMessage.success_from_node(action, action.execution_id,
+                                                                        result=await store_result(self.redis, result))
                     self.logger.debug(f"Executed {action.label}-{action.id_} with result: {result}")
 
                 else:
@@ -155,7 +290,7 @@ class AppBase:
             self.logger.error(f"App {self.__class__.__name__} has no method {action.name}")
             action_result = NodeStatusMessage.failure_from_node(action, action.execution_id,
                                                                 result="Action does not exist")
-        await self.redis.xadd(results_stream, {action.execution_id: message_dumps(action_result)})
+        await self.redis.xadd(results_stream, {action.execution_id: message_dumps(action_result, stream=True)})
 
     @classmethod
     async def run(cls):
@@ -173,4 +308,10 @@ class AppBase:
 
             app = cls(redis=redis, logger=logger, console_logger=console_logger)
 
+            # Let executing actions finish cleanly when we're asked to stop
+            loop = asyncio.get_running_loop()
+            for signame in {'SIGINT', 'SIGTERM'}:
+                loop.add_signal_handler(getattr(signal, signame), app.stop)
+            loop.add_signal_handler(signal.SIGQUIT, lambda: asyncio.ensure_future(app.abort_executions()))
+
             await app.get_actions()
@@ -0,0 +1,56 @@
+import os
+import logging
+import zlib
+
+from walkoff_app_sdk.common.helpers import sint
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger("WALKOFF")
+
+# Compressed payloads start with a byte naming their codec. JSON never starts with either of these, so plain payloads
+# need no header and old and new payloads can sit side by side in the same stream.
+ZLIB_HEADER = b"\x01"
+ZSTD_HEADER = b"\x02"
+
+PAYLOAD_COMPRESSION = os.getenv("PAYLOAD_COMPRESSION", "none").lower()
+PAYLOAD_COMPRESSION_THRESHOLD = sint(os.getenv("PAYLOAD_COMPRESSION_THRESHOLD"), 4096)
+
+if PAYLOAD_COMPRESSION == "zstd" and zstandard is None:
+    logger.warning("PAYLOAD_COMPRESSION is zstd but the zstandard package isn't installed. Falling back to zlib.")
+    PAYLOAD_COMPRESSION = "zlib"
+
+
+def compress_payload(payload, codec=None, threshold=None):
+    """
+        Compresses an encoded payload with the configured codec if it's larger than the threshold. Payloads which
+        aren't compressed are returned untouched.
+    """
+    codec = codec if codec is not None else PAYLOAD_COMPRESSION
+    threshold = threshold if threshold is not None else PAYLOAD_COMPRESSION_THRESHOLD
+
+    if codec not in ("zlib", "zstd") or len(payload) <= threshold:
+        return payload
+
+    data = payload.encode() if isinstance(payload, str) else payload
+    if codec == "zstd":
+        return ZSTD_HEADER + zstandard.ZstdCompressor().compress(data)
+    return ZLIB_HEADER + zlib.compress(data)
+
+
+def decompress_payload(payload):
+    """ Returns the JSON of a payload read from a stream, decompressing it if it carries a codec header. """
+    if not isinstance(payload, (bytes, bytearray)):
+        return payload
+
+    header = payload[:1]
+    if header == ZLIB_HEADER:
+        return zlib.decompress(payload[1:])
+    elif header == ZSTD_HEADER:
+        if zstandard is None:
+            raise ValueError("Received a zstd compressed payload but the zstandard package isn't installed.")
+        return zstandard.ZstdDecompressor().decompress(payload[1:])
+    return payload
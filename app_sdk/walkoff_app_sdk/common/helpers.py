@@ -17,7 +17,7 @@ def sint(value, default):
 
 
 def sfloat(value, default):
-    if not isinstance(default, int):
+    if not isinstance(default, (int, float)):
         raise TypeError("Default value must be of float type")
     try:
         return float(value)
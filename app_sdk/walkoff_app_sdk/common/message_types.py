@@ -1,14 +1,26 @@
 import enum
 import json
 import datetime
+from functools import partial
 
+from walkoff_app_sdk.common.codecs import JSONCodec, stream_codec, codec_for
+from walkoff_app_sdk.common.compression import compress_payload, decompress_payload
 
-def message_dumps(obj):
-    return json.dumps(obj, cls=MessageJSONEncoder)
+
+def message_dumps(obj, stream=False):
+    """ Encodes messages as JSON, or with the stream codec and compression if they're bound for a stream. """
+    codec = stream_codec if stream else JSONCodec
+    try:
+        payload = codec.dumps(obj, MessageJSONEncoder, MESSAGE_TYPE_TAGS)
+    except (TypeError, ValueError, OverflowError):
+        # Results are serialized along with the rest of the message, and only checked one by one if that fails
+        payload = codec.dumps(obj, partial(MessageJSONEncoder, check_results=True), MESSAGE_TYPE_TAGS)
+    return compress_payload(payload) if stream else payload
 
 
 def message_loads(obj):
-    return json.loads(obj, cls=MessageJSONDecoder)
+    obj = decompress_payload(obj)
+    return codec_for(obj).loads(obj, MessageJSONDecoder, MESSAGE_CONSTRUCTORS)
 
 
 def message_dump(obj, fp):
@@ -19,6 +31,36 @@ def message_load(obj):
     return json.load(obj, cls=MessageJSONDecoder)
 
 
+RESULT_REF = "$result_ref"
+
+
+def result_ref(key):
+    """ A claim check standing in for a result which was too large to pass around inline """
+    return {RESULT_REF: key}
+
+
+def find_result_refs(value):
+    """ Returns the keys of every claim check in a value, looking through nested lists and dicts """
+    if isinstance(value, dict):
+        if len(value) == 1 and RESULT_REF in value:
+            return [value[RESULT_REF]]
+        return [key for v in value.values() for key in find_result_refs(v)]
+    elif isinstance(value, list):
+        return [key for v in value for key in find_result_refs(v)]
+    return []
+
+
+def replace_result_refs(value, results):
+    """ Swaps each claim check in a value for its entry in results, keeping any claim check which wasn't found """
+    if isinstance(value, dict):
+        if len(value) == 1 and RESULT_REF in value:
+            return results.get(value[RESULT_REF], value)
+        return {k: replace_result_refs(v, results) for k, v in value.items()}
+    elif isinstance(value, list):
+        return [replace_result_refs(v, results) for v in value]
+    return value
+
+
 class MessageJSONDecoder(json.JSONDecoder):
     """ A custom decoder for decoding JSON strings to Message types. """
 
@@ -44,6 +86,10 @@ class MessageJSONDecoder(json.JSONDecoder):
 class MessageJSONEncoder(json.JSONEncoder):
     """ A custom encoder for encoding Message types to JSON strings. """
 
+    def __init__(self, *args, check_results=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.check_results = check_results
+
     def default(self, o):
         if isinstance(o, NodeStatusMessage):
             r = {"name": o.name, "node_id": o.node_id, "label": o.label, "app_name": o.app_name,
@@ -51,13 +97,13 @@ class MessageJSONEncoder(json.JSONEncoder):
                  "started_at": o.started_at, "completed_at": o.completed_at, "combined_id": o.combined_id,
                  "arguments": o.arguments}
 
-            try:
-                json.dumps(o.result)
-            except (TypeError, ValueError):
-                r["result"] = f"Node returned result of type '{type(o.result)}' which is not JSON serializable."
-                r["status"] = StatusEnum.FAILURE
-            finally:
-                return r
+            if self.check_results:
+                try:
+                    json.dumps(o.result)
+                except (TypeError, ValueError, OverflowError):
+                    r["result"] = f"Node returned result of type '{type(o.result)}' which is not JSON serializable."
+                    r["status"] = StatusEnum.FAILURE
+            return r
 
         elif isinstance(o, WorkflowStatusMessage):
             return {"execution_id": o.execution_id, "workflow_id": o.workflow_id, "name": o.name, "status": o.status,
@@ -210,3 +256,17 @@ class TriggerMessage(object):
 
     def __init__(self, trigger_data):
         self.trigger_data = trigger_data
+
+
+def status_message_constructor(cls):
+    def construct(o):
+        o["status"] = StatusEnum[o["status"]]
+        return cls(**o)
+    return construct
+
+
+# Message types tagged by the binary stream codecs, and the constructors used to rebuild them
+MESSAGE_TYPE_TAGS = {cls: cls.__name__ for cls in (NodeStatusMessage, WorkflowStatusMessage, TriggerMessage)}
+MESSAGE_CONSTRUCTORS = {"NodeStatusMessage": status_message_constructor(NodeStatusMessage),
+                        "WorkflowStatusMessage": status_message_constructor(WorkflowStatusMessage),
+                        "TriggerMessage": lambda o: TriggerMessage(**o)}
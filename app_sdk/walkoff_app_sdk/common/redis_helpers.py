@@ -1,10 +1,25 @@
+import json
+import hashlib
 import logging
+import weakref
+import os
 from contextlib import asynccontextmanager
 
 import aioredis
 
+from walkoff_app_sdk.common.helpers import sint
+from walkoff_app_sdk.common.message_types import result_ref, find_result_refs, replace_result_refs
+
 logger = logging.getLogger("WALKOFF")
 
+REDIS_APP_STREAMS = os.getenv("REDIS_APP_STREAMS", "app-streams")
+REDIS_APP_STREAM_ANNOUNCEMENTS = os.getenv("REDIS_APP_STREAM_ANNOUNCEMENTS", "app-stream-announcements")
+REDIS_APP_RETIREMENTS = os.getenv("REDIS_APP_RETIREMENTS", "app-retirements")
+REDIS_RESULT_STORE = os.getenv("REDIS_RESULT_STORE", "result-store")
+RESULT_INLINE_LIMIT = sint(os.getenv("RESULT_INLINE_LIMIT"), 65536)
+RESULT_STORE_TTL = sint(os.getenv("RESULT_STORE_TTL"), 604800)
+RESULT_SIZE_LIMIT = sint(os.getenv("RESULT_SIZE_LIMIT"), 67108864)
+
 
 @asynccontextmanager
 async def connect_to_redis_pool(redis_uri) -> aioredis.Redis:
@@ -37,3 +52,104 @@ def xlen(redis: aioredis.Redis, key):
 def xdel(redis: aioredis.Redis, stream, id_):
     """ Deletes id_ from stream. Returns the number of items deleted. """
     return redis.execute(b'XDEL', stream, id_)
+
+
+XACK_DEL_SCRIPT = """
+local acked = redis.call('XACK', KEYS[1], ARGV[1], unpack(ARGV, 2))
+redis.call('XDEL', KEYS[1], unpack(ARGV, 2))
+return acked
+"""
+
+_script_shas = weakref.WeakKeyDictionary()
+
+
+async def eval_script(redis: aioredis.Redis, script, keys, args):
+    """ Runs a Lua script by its SHA, loading the script the first time it's run on a connection pool. """
+    shas = _script_shas.setdefault(redis, {})
+    sha = shas.get(script)
+    if sha is None:
+        sha = shas[script] = await redis.script_load(script)
+
+    try:
+        return await redis.evalsha(sha, keys=keys, args=args)
+    except aioredis.ReplyError as e:
+        if not str(e).startswith("NOSCRIPT"):
+            raise
+        # Redis restarted or its script cache was flushed, so load the script again
+        sha = shas[script] = await redis.script_load(script)
+        return await redis.evalsha(sha, keys=keys, args=args)
+
+
+async def xack_del(redis: aioredis.Redis, stream, group_name, *ids):
+    """
+        Acknowledges and deletes messages from a stream in one atomic round trip, so a consumer can't die between the
+        two. Returns the number of messages acked.
+    """
+    if len(ids) < 1:
+        return 0
+    return await eval_script(redis, XACK_DEL_SCRIPT, [stream], [group_name, *ids])
+
+
+TAKE_TOKEN_SCRIPT = """
+local tokens = tonumber(redis.call('GET', KEYS[1]) or '0')
+if tokens > 0 then
+    redis.call('DECR', KEYS[1])
+    return 1
+end
+return 0
+"""
+
+
+async def take_token(redis: aioredis.Redis, key):
+    """ Takes one from a counter of tokens if any are left. Returns whether a token was taken. """
+    return await eval_script(redis, TAKE_TOKEN_SCRIPT, [key], []) == 1
+
+
+def app_streams_key(app_name, version):
+    """ Returns the key of the set which indexes every execution's action stream for an app version. """
+    return f"{REDIS_APP_STREAMS}:{app_name}:{version}"
+
+
+def app_stream_announcements_key(app_name, version):
+    """ Returns the key of the stream announcing each action stream added to an app version's index. """
+    return f"{REDIS_APP_STREAM_ANNOUNCEMENTS}:{app_name}:{version}"
+
+
+def app_retirements_key(app_name, version):
+    """ Returns the key counting how many idle replicas of an app version the umpire has retired. """
+    return f"{REDIS_APP_RETIREMENTS}:{app_name}:{version}"
+
+
+async def store_result(redis: aioredis.Redis, result):
+    """
+        Claim check for results too large to pass around inline. A result whose JSON is over RESULT_INLINE_LIMIT bytes
+        is stored once under a key derived from its content and a reference to that key is returned in its place.
+        Results over RESULT_SIZE_LIMIT bytes aren't stored but truncated to their first RESULT_INLINE_LIMIT bytes.
+    """
+    try:
+        encoded = json.dumps(result)
+    except (TypeError, ValueError):
+        return result  # Leave it to the message encoder to report results which can't be serialized
+
+    if len(encoded) <= RESULT_INLINE_LIMIT:
+        return result
+
+    if len(encoded) > RESULT_SIZE_LIMIT:
+        logger.warning(f"Truncating result of {len(encoded)} bytes, which is over the {RESULT_SIZE_LIMIT} byte limit.")
+        return (f"Result of {len(encoded)} bytes truncated to {RESULT_INLINE_LIMIT} bytes: "
+                f"{encoded[:RESULT_INLINE_LIMIT]}")
+
+    key = f"{REDIS_RESULT_STORE}:{hashlib.sha256(encoded.encode()).hexdigest()}"
+    await redis.set(key, encoded, expire=RESULT_STORE_TTL)
+    return result_ref(key)
+
+
+async def load_results(redis: aioredis.Redis, value):
+    """ Swaps any claim checks in a value for the results they refer to, fetching all of them with a single MGET. """
+    keys = list(dict.fromkeys(find_result_refs(value)))
+    if len(keys) < 1:
+        return value
+
+    stored = await redis.mget(*keys)
+    return replace_result_refs(value, {key: json.loads(result) for key, result in zip(keys, stored)
+                                       if result is not None})
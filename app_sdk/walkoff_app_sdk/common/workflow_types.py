@@ -6,15 +6,35 @@ from operator import attrgetter, itemgetter
 from collections import namedtuple, deque
 from asteval import Interpreter, make_symbol_table
 
+from walkoff_app_sdk.common.codecs import TYPE_TAG, MsgPackCodec, stream_codec, action_stream_codec, codec_for
+from walkoff_app_sdk.common.compression import compress_payload, decompress_payload
+
 logger = logging.getLogger("WALKOFF")
 
 
-def workflow_dumps(obj):
-    return json.dumps(obj, cls=WorkflowJSONEncoder)
+def workflow_dumps(obj, stream=False):
+    """
+        Encodes workflows as JSON, or with the stream codec and compression if they're bound for a stream. Actions
+        bound for a stream use the action stream codec instead, which packs them as records when it's msgpack.
+    """
+    if not stream:
+        return json.dumps(obj, cls=WorkflowJSONEncoder)
+    if isinstance(obj, Action):
+        if action_stream_codec is MsgPackCodec:
+            return compress_payload(MsgPackCodec.pack(action_record(obj)))
+        return compress_payload(action_stream_codec.dumps(obj, WorkflowJSONEncoder, WORKFLOW_TYPE_TAGS))
+    return compress_payload(stream_codec.dumps(obj, WorkflowJSONEncoder, WORKFLOW_TYPE_TAGS))
 
 
-def workflow_loads(obj):
-    return json.loads(obj, cls=WorkflowJSONDecoder)
+def workflow_loads(obj, type_=None):
+    """
+        Decodes workflow types. Payloads known to hold a Workflow or Action can pass that type to have it built
+        directly from the payload's schema, rather than by inspecting every dict in the payload for its type.
+    """
+    obj = decompress_payload(obj)
+    if type_ is not None:
+        return TYPE_DECODERS[type_](codec_for(obj).decode(obj))
+    return codec_for(obj).loads(obj, WorkflowJSONDecoder, WORKFLOW_CONSTRUCTORS)
 
 
 def workflow_dump(obj, fp):
@@ -54,7 +74,7 @@ class WorkflowJSONDecoder(json.JSONDecoder):
             return Parameter(**o)
 
         elif "source_id" in o and "destination_id" in o:
-            self.branches.add(Branch(source_id=o["source_id"], destination_id=o["destination_id"], id_=o["id_"]))
+            self.branches.add(Branch(source_id=o["source_id"], destination_id=o["destination_id"], id_=o.get("id_")))
 
         elif "conditional" in o:
             node = Condition(**o)
@@ -547,3 +567,90 @@ class Workflow(DiGraph):
                     visited.add(child)
 
         return visited
+
+
+def node_constructor(cls):
+    def construct(o):
+        o["position"] = Point(**o["position"])
+        return cls(**o)
+    return construct
+
+
+def parameter_constructor(o):
+    o["variant"] = ParameterVariant[o["variant"]]
+    return Parameter(**o)
+
+
+def workflow_constructor(o):
+    # Nodes are decoded before the workflow holding them, so branches can be resolved from the workflow's own lists
+    nodes = {node.id_: node for node in (*o["actions"], *o["conditions"], *o["transforms"], *o["triggers"])}
+    o["branches"] = {Branch(nodes[b["source_id"]], nodes[b["destination_id"]], b.get("id_")) for b in o["branches"]}
+    o["workflow_variables"] = {var.id_: var for var in o["workflow_variables"]}
+    o["start"] = nodes[o["start"]]
+    return Workflow(**o)
+
+
+# Workflow types tagged by the binary stream codecs, and the constructors used to rebuild them
+WORKFLOW_TYPE_TAGS = {cls: cls.__name__
+                      for cls in (Workflow, Action, Condition, Transform, Trigger, Parameter, Variable)}
+WORKFLOW_CONSTRUCTORS = {"Workflow": workflow_constructor, "Action": node_constructor(Action),
+                         "Condition": node_constructor(Condition), "Transform": node_constructor(Transform),
+                         "Trigger": node_constructor(Trigger), "Parameter": parameter_constructor,
+                         "Variable": lambda o: Variable(**o)}
+
+
+def decode_parameter(o):
+    o.pop(TYPE_TAG, None)
+    o["variant"] = ParameterVariant[o["variant"]]
+    return Parameter(**o)
+
+
+def decode_variable(o):
+    o.pop(TYPE_TAG, None)
+    return Variable(**o)
+
+
+def decode_node(cls, o):
+    o.pop(TYPE_TAG, None)
+    o["position"] = Point(**o["position"])
+    return cls(**o)
+
+
+# Actions are packed as records, lists of their fields in a fixed order, so apps can decode them without looking up a
+# single key. The execution id is always last, which lets plans pack everything before it ahead of time.
+PARAMETER_VARIANTS = {variant.value: variant for variant in ParameterVariant}
+
+
+def action_record(action):
+    return [action.id_, action.name, action.app_name, action.app_version, action.label, action.position.x,
+            action.position.y, action.priority,
+            [[p.name, p.variant.value, p.value, p.id_] for p in action.parameters], action.execution_id]
+
+
+def decode_action_record(r):
+    id_, name, app_name, app_version, label, x, y, priority, parameters, execution_id = r
+    # Arguments are passed by position, which is measurably cheaper for the handful of fields every action has
+    parameters = [Parameter(p_name, False, p_id, value, PARAMETER_VARIANTS[variant])
+                  for p_name, variant, value, p_id in parameters]
+    return Action(name, Point(x, y), app_name, app_version, label, priority, False, parameters, id_, execution_id)
+
+
+def decode_action(o):
+    if isinstance(o, list):
+        return decode_action_record(o)
+    o["parameters"] = [decode_parameter(parameter) for parameter in o["parameters"]]
+    return decode_node(Action, o)
+
+
+def decode_workflow(o):
+    o.pop(TYPE_TAG, None)
+    o["actions"] = [decode_action(action) for action in o["actions"]]
+    o["conditions"] = [decode_node(Condition, condition) for condition in o["conditions"]]
+    o["transforms"] = [decode_node(Transform, transform) for transform in o["transforms"]]
+    o["triggers"] = [decode_node(Trigger, trigger) for trigger in o["triggers"]]
+    o["workflow_variables"] = [decode_variable(var) for var in o["workflow_variables"]]
+    return workflow_constructor(o)
+
+
+# Schema directed decoders for payloads whose type is known ahead of time
+TYPE_DECODERS = {Workflow: decode_workflow, Action: decode_action}
@@ -0,0 +1,111 @@
+import json
+import logging
+
+from common.config import config
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger("WALKOFF")
+
+# Binary payloads start with a byte naming their codec, like compressed payloads do. JSON payloads carry no header so
+# they can be read by anything that reads JSON, which keeps the HTTP API and older stream messages working.
+MSGPACK_HEADER = b"\x03"
+
+# Binary payloads name the type of each encoded object explicitly instead of leaving the decoder to infer it from keys
+TYPE_TAG = "__type__"
+
+
+class JSONCodec:
+    """
+        Encodes objects as JSON text using the JSONEncoder and JSONDecoder of their module. Codecs can also decode
+        payloads to plain lists and dicts, leaving it to the caller to build types from them.
+    """
+    name = "json"
+
+    @staticmethod
+    def dumps(obj, encoder, type_tags):
+        return json.dumps(obj, cls=encoder)
+
+    @staticmethod
+    def loads(payload, decoder, constructors):
+        return json.loads(payload, cls=decoder)
+
+    @staticmethod
+    def decode(payload):
+        # Decoding bytes up front is cheaper than leaving json to detect their encoding
+        return json.loads(payload.decode() if isinstance(payload, (bytes, bytearray)) else payload)
+
+
+class MsgPackCodec:
+    """
+        Encodes objects as MessagePack. Objects are reduced to dicts by the JSONEncoder of their module and tagged with
+        their type, which selects the constructor used to rebuild them when they are decoded.
+    """
+    name = "msgpack"
+
+    @staticmethod
+    def dumps(obj, encoder, type_tags):
+        reduce = encoder().default
+
+        def default(o):
+            r = reduce(o)
+            tag = type_tags.get(type(o))
+            return {TYPE_TAG: tag, **r} if tag is not None else r
+
+        return MSGPACK_HEADER + msgpack.packb(obj, default=default, use_bin_type=True)
+
+    @staticmethod
+    def loads(payload, decoder, constructors):
+        def object_hook(o):
+            tag = o.pop(TYPE_TAG, None)
+            return constructors[tag](o) if tag is not None else o
+
+        return msgpack.unpackb(memoryview(payload)[1:], object_hook=object_hook, raw=False, strict_map_key=False)
+
+    @staticmethod
+    def decode(payload):
+        return msgpack.unpackb(memoryview(payload)[1:], raw=False, strict_map_key=False)
+
+    @staticmethod
+    def pack(obj, header=True):
+        """ Packs plain lists, dicts and values, such as records whose fields are known from their position alone """
+        packed = msgpack.packb(obj, use_bin_type=True)
+        return MSGPACK_HEADER + packed if header else packed
+
+    @staticmethod
+    def pack_prefix(items, length):
+        """ Packs the first items of an array of the given length, leaving the rest to be packed after them """
+        packer = msgpack.Packer(use_bin_type=True)
+        return MSGPACK_HEADER + packer.pack_array_header(length) + b"".join(packer.pack(item) for item in items)
+
+
+CODECS = {codec.name: codec for codec in (JSONCodec, MsgPackCodec)}
+
+
+def configured_codec(setting, name):
+    """ Returns the codec named by a setting, falling back to json if it's unknown or its package isn't installed """
+    if name not in CODECS:
+        logger.warning(f"Unknown {setting} {name}. Falling back to json.")
+        return JSONCodec
+    elif name == "msgpack" and msgpack is None:
+        logger.warning(f"{setting} is msgpack but the msgpack package isn't installed. Falling back to json.")
+        return JSONCodec
+    return CODECS[name]
+
+
+stream_codec = configured_codec("STREAM_CODEC", config.STREAM_CODEC.lower())
+
+# Apps decode an action for every action they run, so action streams default to msgpack whatever the other streams use
+action_stream_codec = configured_codec("ACTION_STREAM_CODEC", config.ACTION_STREAM_CODEC.lower())
+
+
+def codec_for(payload):
+    """ Returns the codec a payload read from a stream was encoded with. """
+    if isinstance(payload, (bytes, bytearray)) and payload[:1] == MSGPACK_HEADER:
+        if msgpack is None:
+            raise ValueError("Received a msgpack encoded payload but the msgpack package isn't installed.")
+        return MsgPackCodec
+    return JSONCodec
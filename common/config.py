@@ -18,7 +18,7 @@ def sint(value, default):
 
 
 def sfloat(value, default):
-    if not isinstance(default, int):
+    if not isinstance(default, (int, float)):
         raise TypeError("Default value must be of float type")
     try:
         return float(value)
@@ -29,9 +29,19 @@ def sfloat(value, default):
 class Config:
     # Worker options
     WORKER_TIMEOUT = os.environ.get("WORKER_TIMEOUT", "30")
+    WORKER_CONCURRENCY = os.environ.get("WORKER_CONCURRENCY", "1")
+    WORKER_MIN_IDLE = os.environ.get("WORKER_MIN_IDLE", "1")
+    GLOBALS_CACHE_TTL = os.environ.get("GLOBALS_CACHE_TTL", "300")
     API_GATEWAY_URI = os.environ.get("API_GATEWAY_URI", "http://api_gateway:8080")
     WALKOFF_USERNAME = os.environ.get("WALKOFF_USERNAME", '')
     WALKOFF_PASSWORD = os.environ.get("WALKOFF_PASSWORD", '')
+    TOKEN_RENEWAL_MARGIN = os.environ.get("TOKEN_RENEWAL_MARGIN", "60")
+    STATUS_BATCH_SIZE = os.environ.get("STATUS_BATCH_SIZE", "50")
+    STATUS_BATCH_WINDOW = os.environ.get("STATUS_BATCH_WINDOW", "50")
+    RESULTS_BATCH_SIZE = os.environ.get("RESULTS_BATCH_SIZE", "100")
+    PARALLEL_CHUNK_SIZE = os.environ.get("PARALLEL_CHUNK_SIZE", "1")
+    PARALLEL_MAX_SHARDS = os.environ.get("PARALLEL_MAX_SHARDS", "256")
+    PARALLEL_MAX_IN_FLIGHT = os.environ.get("PARALLEL_MAX_IN_FLIGHT", "32")
 
     # Umpire options
     APPS_PATH = os.getenv("APPS_PATH", "./apps")
@@ -41,6 +51,15 @@ class Config:
     STACK_PREFIX = os.getenv("STACK_PREFIX", "walkoff")
     DOCKER_REGISTRY = os.getenv("DOCKER_REGISTRY", "localhost:5000")
     UMPIRE_HEARTBEAT = os.getenv("UMPIRE_HEARTBEAT", "1")
+    APP_IDLE_TIMEOUT = os.getenv("APP_IDLE_TIMEOUT", "60")
+    APP_MIN_IDLE_REPLICAS = os.getenv("APP_MIN_IDLE_REPLICAS", "0")
+    AUTOSCALE_EWMA_ALPHA = os.getenv("AUTOSCALE_EWMA_ALPHA", "0.1")
+    AUTOSCALE_TARGET_UTILIZATION = os.getenv("AUTOSCALE_TARGET_UTILIZATION", "0.8")
+    AUTOSCALE_DRAIN_TIME = os.getenv("AUTOSCALE_DRAIN_TIME", "30")
+    AUTOSCALE_HYSTERESIS = os.getenv("AUTOSCALE_HYSTERESIS", "0.2")
+    AUTOSCALE_UP_COOLDOWN = os.getenv("AUTOSCALE_UP_COOLDOWN", "10")
+    AUTOSCALE_DOWN_COOLDOWN = os.getenv("AUTOSCALE_DOWN_COOLDOWN", "300")
+    AUTOSCALE_LOG_LENGTH = os.getenv("AUTOSCALE_LOG_LENGTH", "1000")
 
     # Redis options
     REDIS_URI = os.getenv("REDIS_URI", "redis://redis:6379")
@@ -48,13 +67,38 @@ class Config:
     REDIS_PENDING_WORKFLOWS = os.getenv("REDIS_PENDING_WORKFLOWS", "pending-workflows")
     REDIS_ABORTING_WORKFLOWS = os.getenv("REDIS_ABORTING_WORKFLOWS", "aborting-workflows")
     REDIS_ACTIONS_IN_PROCESS = os.getenv("REDIS_ACTIONS_IN_PROCESS", "actions-in-process")
+    REDIS_APP_STREAMS = os.getenv("REDIS_APP_STREAMS", "app-streams")
+    REDIS_APP_STREAM_ANNOUNCEMENTS = os.getenv("REDIS_APP_STREAM_ANNOUNCEMENTS", "app-stream-announcements")
+    APP_STREAM_ANNOUNCEMENTS_LENGTH = os.getenv("APP_STREAM_ANNOUNCEMENTS_LENGTH", "1000")
+    REDIS_EXECUTION_STREAMS = os.getenv("REDIS_EXECUTION_STREAMS", "execution-streams")
+    REDIS_APP_RETIREMENTS = os.getenv("REDIS_APP_RETIREMENTS", "app-retirements")
+    REDIS_EXECUTION_PLANS = os.getenv("REDIS_EXECUTION_PLANS", "execution-plans")
+    REDIS_RESULT_STORE = os.getenv("REDIS_RESULT_STORE", "result-store")
+    RESULT_INLINE_LIMIT = os.getenv("RESULT_INLINE_LIMIT", "65536")
+    RESULT_STORE_TTL = os.getenv("RESULT_STORE_TTL", "604800")
+    RESULT_SIZE_LIMIT = os.getenv("RESULT_SIZE_LIMIT", "67108864")
+    REDIS_RESULT_CACHE = os.getenv("REDIS_RESULT_CACHE", "result-cache")
+    REDIS_RESULT_CACHE_POLICIES = os.getenv("REDIS_RESULT_CACHE_POLICIES", "result-cache-policies")
+    RESULT_CACHE_SIZE = os.getenv("RESULT_CACHE_SIZE", "10000")
+    RESULT_CACHE_TTL = os.getenv("RESULT_CACHE_TTL", "3600")
+    PAYLOAD_COMPRESSION = os.getenv("PAYLOAD_COMPRESSION", "none")
+    PAYLOAD_COMPRESSION_THRESHOLD = os.getenv("PAYLOAD_COMPRESSION_THRESHOLD", "4096")
+    STREAM_CODEC = os.getenv("STREAM_CODEC", "json")
+    ACTION_STREAM_CODEC = os.getenv("ACTION_STREAM_CODEC", "msgpack")
+    EXECUTION_PLAN_TTL = os.getenv("EXECUTION_PLAN_TTL", "86400")
     REDIS_WORKFLOW_QUEUE = os.getenv("REDIS_WORKFLOW_Q", "workflow-queue")
     REDIS_WORKFLOWS_IN_PROCESS = os.getenv("REDIS_WORKFLOWS_IN_PROCESS", "workflows-in-process")
+    REDIS_WORKER_RETIREMENTS = os.getenv("REDIS_WORKER_RETIREMENTS", "worker-retirements")
+    REDIS_AUTOSCALER_ARRIVALS = os.getenv("REDIS_AUTOSCALER_ARRIVALS", "autoscaler-arrivals")
+    REDIS_AUTOSCALER_SERVICE_TIMES = os.getenv("REDIS_AUTOSCALER_SERVICE_TIMES", "autoscaler-service-times")
+    REDIS_AUTOSCALER_LOG = os.getenv("REDIS_AUTOSCALER_LOG", "autoscaler-log")
+    REDIS_AUTOSCALER_METRICS = os.getenv("REDIS_AUTOSCALER_METRICS", "autoscaler-metrics")
     REDIS_WORKFLOW_GROUP = os.getenv("REDIS_WORKFLOW_GROUP", "workflow-group")
     REDIS_ACTION_RESULTS_GROUP = os.getenv("REDIS_ACTION_RESULTS_GROUP", "action-results-group")
     REDIS_WORKFLOW_TRIGGERS_GROUP = os.getenv("REDIS_WORKFLOW_TRIGGERS_GROUP", "workflow-triggers-group")
     REDIS_WORKFLOW_CONTROL = os.getenv("REDIS_WORKFLOW_CONTROL", "workflow-control")
     REDIS_WORKFLOW_CONTROL_GROUP = os.getenv("REDIS_WORKFLOW_CONTROL_GROUP", "workflow-control-group")
+    REDIS_GLOBALS_CHANNEL = os.getenv("REDIS_GLOBALS_CHANNEL", "global-variable-updates")
 
     # Overrides the environment variables for docker-compose and docker commands on the docker machine at 'DOCKER_HOST'
     # See: https://docs.docker.com/compose/reference/envvars/ for more information.
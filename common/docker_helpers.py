@@ -25,6 +25,10 @@ from common.helpers import sint, sfloat
 
 logger = logging.getLogger("UMPIRE")
 
+IDLE_TIMEOUT_LABEL = "walkoff.idle_timeout"
+MIN_IDLE_REPLICAS_LABEL = "walkoff.min_idle_replicas"
+CONCURRENCY_LABEL = "walkoff.concurrency"
+
 
 class DockerBuildError(Exception):
     pass
@@ -51,7 +55,7 @@ class ServiceKwargs:
         self.env = options.get("environment", None)
         self.hostname = options.get("hostname")
         self.isolation = options.get("isolation")
-        self.labels = {k: v for k, v in (kv.split('=') for kv in deploy_opts.get("labels", []))}
+        self.labels = deploy_labels(service)
         self.log_driver = options.get("logging", {}).get("driver")
         self.log_driver_options = options.get("logging", {}).get("options")
         self.mode = ServiceMode(deploy_opts.get("mode", "replicated"), deploy_opts.get("replicas", 1))
@@ -99,6 +103,32 @@ class ServiceKwargs:
         return service_kwargs
 
 
+def deploy_labels(service):
+    """ Returns the labels in a compose service's deploy options, which may be given as a list or a mapping """
+    labels = service.options.get("deploy", {}).get("labels", {})
+    return labels if isinstance(labels, dict) else dict(kv.split('=', 1) for kv in labels)
+
+
+def app_keep_alive(service):
+    """
+        Returns how many seconds an app's replicas stay alive without work and how many replicas it keeps warm, as set
+        by the walkoff.idle_timeout and walkoff.min_idle_replicas labels in its compose deploy options.
+    """
+    labels = deploy_labels(service)
+    return (sint(labels.get(IDLE_TIMEOUT_LABEL), config.get_int("APP_IDLE_TIMEOUT", 60)),
+            sint(labels.get(MIN_IDLE_REPLICAS_LABEL), config.get_int("APP_MIN_IDLE_REPLICAS", 0)))
+
+
+def app_concurrency(service):
+    """
+        Returns how many actions each of an app's replicas executes at once, as set by the walkoff.concurrency label in
+        its compose deploy options, or by APP_CONCURRENCY in its compose environment. The umpire scales the app by this
+        number and hands it to the app's replicas, so both always agree.
+    """
+    environment = service.options.get("environment") or {}
+    return max(sint(deploy_labels(service).get(CONCURRENCY_LABEL), sint(environment.get("APP_CONCURRENCY"), 1)), 1)
+
+
 async def create_secret(client, name, data):
     data = base64.b64encode(data)
     data = data.decode("ascii")
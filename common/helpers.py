@@ -1,4 +1,11 @@
+import asyncio
+import base64
+import json
 import logging
+import time
+import weakref
+from http import HTTPStatus
+
 from common.config import config
 
 import aiohttp
@@ -23,7 +30,7 @@ def sint(value, default):
 
 
 def sfloat(value, default):
-    if not isinstance(default, int):
+    if not isinstance(default, (int, float)):
         raise TypeError("Default value must be of float type")
     try:
         return float(value)
@@ -31,24 +38,82 @@ def sfloat(value, default):
         return default
 
 
-async def get_walkoff_auth_header(session, token=None, timeout=5*60):
-    url = config.API_GATEWAY_URI.rstrip('/') + '/api'
-
-    # TODO: make this secure and don't use default admin user
-    if token is None:
-        async with session.post(url + "/auth", json={"username": config.WALKOFF_USERNAME,
-                                                     "password": config.WALKOFF_PASSWORD}, timeout=timeout) as resp:
+class TokenManager:
+    """
+        Caches the refresh and access tokens of an internal service and renews them shortly before they expire.
+        Renewals are serialized so that concurrent callers share a single login or refresh round trip.
+    """
+
+    def __init__(self, session, api_uri=None, username=None, password=None, margin=None, timeout=5*60):
+        self.session = session
+        self.url = (api_uri if api_uri is not None else config.API_GATEWAY_URI).rstrip('/') + '/api'
+        self.username = username if username is not None else config.WALKOFF_USERNAME
+        self.password = password if password is not None else config.WALKOFF_PASSWORD
+        self.margin = margin if margin is not None else config.get_int("TOKEN_RENEWAL_MARGIN", 60)
+        self.timeout = timeout
+        self.refresh_token = None
+        self.refresh_expires = 0
+        self.access_token = None
+        self.access_expires = 0
+        self.lock = asyncio.Lock()
+
+    @staticmethod
+    def get_expiration(token):
+        """ Reads the 'exp' claim of a JWT without verifying it. Tokens without one never expire. """
+        try:
+            payload = token.split('.')[1]
+            payload += '=' * (-len(payload) % 4)
+            return json.loads(base64.urlsafe_b64decode(payload)).get("exp", float("inf"))
+        except (AttributeError, IndexError, ValueError):
+            return 0
+
+    def expiring(self, expires):
+        return time.time() + self.margin >= expires
+
+    async def get_auth_header(self):
+        if self.access_token is None or self.expiring(self.access_expires):
+            async with self.lock:
+                # Someone else may have renewed the token while we were waiting on the lock
+                if self.access_token is None or self.expiring(self.access_expires):
+                    await self.renew()
+
+        return {"Authorization": f"Bearer {self.access_token}"}
+
+    async def renew(self):
+        if self.refresh_token is not None and not self.expiring(self.refresh_expires):
+            headers = {"Authorization": f"Bearer {self.refresh_token}"}
+            async with self.session.post(self.url + "/auth/refresh", headers=headers, timeout=self.timeout) as resp:
+                if resp.status == HTTPStatus.CREATED:
+                    resp_json = await resp.json()
+                    self.access_token = resp_json["access_token"]
+                    self.access_expires = self.get_expiration(self.access_token)
+                    logger.debug("Successfully refreshed WALKOFF JWT")
+                    return
+
+        # TODO: make this secure and don't use default admin user
+        async with self.session.post(self.url + "/auth", json={"username": self.username, "password": self.password},
+                                     timeout=self.timeout) as resp:
             resp_json = await resp.json()
-            token = resp_json["refresh_token"]
+            self.refresh_token = resp_json["refresh_token"]
+            self.refresh_expires = self.get_expiration(self.refresh_token)
+            self.access_token = resp_json["access_token"]
+            self.access_expires = self.get_expiration(self.access_token)
             logger.debug("Successfully logged into WALKOFF")
 
-    headers = {"Authorization": f"Bearer {token}"}
-    async with session.post(url + "/auth/refresh", headers=headers, timeout=timeout) as resp:
-        resp_json = await resp.json()
-        access_token = resp_json["access_token"]
-        logger.debug("Successfully refreshed WALKOFF JWT")
+    def invalidate(self):
+        """ Forgets the cached access token, i.e. after it was rejected, so the next request renews it. """
+        self.access_token = None
+        self.access_expires = 0
+
 
-    return {"Authorization": f"Bearer {access_token}"}, token
+_token_managers = weakref.WeakKeyDictionary()
+
+
+def get_token_manager(session):
+    """ Returns the TokenManager shared by every caller using the given session. """
+    if session not in _token_managers:
+        _token_managers[session] = TokenManager(session)
+    return _token_managers[session]
 
 
 def make_patch(message, root, op, value_only=False, white_list=None, black_list=None):
@@ -80,6 +145,10 @@ def get_patches(message):
         if message.status == StatusEnum.EXECUTING:
             patches.append(make_patch(message, root, JSONPatchOps.ADD, black_list={"result", "completed_at"}))
 
+        elif message.status == StatusEnum.ABORTED:
+            # Nodes are aborted whether or not they started, and adding a status replaces any it already has
+            patches.append(make_patch(message, root, JSONPatchOps.ADD, black_list={}))
+
         else:
             patches.append(make_patch(message, root, JSONPatchOps.REPLACE, black_list={}))
 
@@ -111,11 +180,14 @@ async def send_status_update(session, execution_id, message, headers=None):
 
     params = {"event": message.status.value}
     url = f"{config.API_GATEWAY_URI}/api/internal/workflowstatus/{execution_id}"
-    headers, token = await get_walkoff_auth_header(session)
+    token_manager = get_token_manager(session)
+    headers = await token_manager.get_auth_header()
     headers["content-type"] = "application/json"
 
     try:
         async with session.patch(url, data=message_dumps(patches), params=params, headers=headers, timeout=5) as resp:
+            if resp.status == HTTPStatus.UNAUTHORIZED:
+                token_manager.invalidate()
             if resp.content_type == "application/json":
                 results = await resp.json()
                 logger.debug(f"API-Gateway status update response: {results}")
@@ -124,3 +196,77 @@ async def send_status_update(session, execution_id, message, headers=None):
         logger.error(f"Could not send status message to {url}: {e!r}")
     except Exception as e:
         logger.error(f"Unknown error while sending message to {url}: {e!r}")
+
+
+async def send_status_updates(session, updates):
+    """ Sends a batch of {execution_id, event, patches} updates to the api_gateway in a single request """
+
+    if len(updates) < 1:
+        return None
+
+    url = f"{config.API_GATEWAY_URI}/api/internal/workflowstatus"
+    token_manager = get_token_manager(session)
+    headers = await token_manager.get_auth_header()
+    headers["content-type"] = "application/json"
+
+    try:
+        async with session.patch(url, data=message_dumps(updates), headers=headers, timeout=5) as resp:
+            if resp.status == HTTPStatus.UNAUTHORIZED:
+                token_manager.invalidate()
+            if resp.content_type == "application/json":
+                results = await resp.json()
+                logger.debug(f"API-Gateway bulk status update response: {results}")
+                if results.get("failed"):
+                    logger.error(f"API-Gateway could not apply the status updates {results['failed']}")
+                return results
+    except aiohttp.ClientConnectionError as e:
+        logger.error(f"Could not send {len(updates)} status messages to {url}: {e!r}")
+    except Exception as e:
+        logger.error(f"Unknown error while sending {len(updates)} status messages to {url}: {e!r}")
+
+
+class StatusBatcher:
+    """
+        Coalesces status messages into bulk updates for the api_gateway. A batch is sent once max_items messages are
+        queued or window milliseconds after its first message arrived, whichever comes first. Batches are sent one at
+        a time so the api_gateway applies every message in the order it was queued.
+    """
+
+    def __init__(self, session, max_items=None, window=None):
+        self.session = session
+        self.max_items = max_items if max_items is not None else config.get_int("STATUS_BATCH_SIZE", 50)
+        self.window = (window if window is not None else config.get_int("STATUS_BATCH_WINDOW", 50)) / 1000
+        self.pending = []
+        self.flush_task = None
+        self.lock = asyncio.Lock()
+
+    async def send(self, execution_id, message):
+        """ Queues a status message, mirroring the arguments of send_status_update """
+
+        if message is None:
+            return None
+
+        patches = get_patches(message)
+
+        if len(patches) < 1:
+            raise ValueError(f"Attempting to send improper message type: {type(message)}")
+
+        self.pending.append({"execution_id": execution_id, "event": message.status.value, "patches": patches})
+
+        if len(self.pending) >= self.max_items:
+            await self.flush()
+        elif self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self.flush_after_window())
+
+    async def flush_after_window(self):
+        await asyncio.sleep(self.window)
+        await self.flush()
+
+    async def flush(self):
+        """ Sends every queued message now """
+        async with self.lock:
+            if len(self.pending) < 1:
+                return
+
+            batch, self.pending = self.pending, []
+            await send_status_updates(self.session, batch)
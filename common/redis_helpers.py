@@ -1,8 +1,15 @@
+import json
+import time
+import hashlib
 import logging
+import weakref
 from contextlib import asynccontextmanager
 
 import aioredis
 
+from common.config import config
+from common.message_types import result_ref, find_result_refs, replace_result_refs
+
 logger = logging.getLogger("WALKOFF")
 
 
@@ -38,3 +45,224 @@ def xlen(redis: aioredis.Redis, key):
 def xdel(redis: aioredis.Redis, stream, id_):
     """ Deletes id_ from stream. Returns the number of items deleted. """
     return redis.execute(b'XDEL', stream, id_)
+
+
+XACK_DEL_SCRIPT = """
+local acked = redis.call('XACK', KEYS[1], ARGV[1], unpack(ARGV, 2))
+redis.call('XDEL', KEYS[1], unpack(ARGV, 2))
+return acked
+"""
+
+_script_shas = weakref.WeakKeyDictionary()
+
+
+async def eval_script(redis: aioredis.Redis, script, keys, args):
+    """ Runs a Lua script by its SHA, loading the script the first time it's run on a connection pool. """
+    shas = _script_shas.setdefault(redis, {})
+    sha = shas.get(script)
+    if sha is None:
+        sha = shas[script] = await redis.script_load(script)
+
+    try:
+        return await redis.evalsha(sha, keys=keys, args=args)
+    except aioredis.ReplyError as e:
+        if not str(e).startswith("NOSCRIPT"):
+            raise
+        # Redis restarted or its script cache was flushed, so load the script again
+        sha = shas[script] = await redis.script_load(script)
+        return await redis.evalsha(sha, keys=keys, args=args)
+
+
+async def xack_del(redis: aioredis.Redis, stream, group_name, *ids):
+    """
+        Acknowledges and deletes messages from a stream in one atomic round trip, so a consumer can't die between the
+        two. Returns the number of messages acked.
+    """
+    if len(ids) < 1:
+        return 0
+    return await eval_script(redis, XACK_DEL_SCRIPT, [stream], [group_name, *ids])
+
+
+TAKE_TOKEN_SCRIPT = """
+local tokens = tonumber(redis.call('GET', KEYS[1]) or '0')
+if tokens > 0 then
+    redis.call('DECR', KEYS[1])
+    return 1
+end
+return 0
+"""
+
+
+async def take_token(redis: aioredis.Redis, key):
+    """ Takes one from a counter of tokens if any are left. Returns whether a token was taken. """
+    return await eval_script(redis, TAKE_TOKEN_SCRIPT, [key], []) == 1
+
+
+def app_streams_key(app_name, version):
+    """ Returns the key of the set which indexes every execution's action stream for an app version. """
+    return f"{config.REDIS_APP_STREAMS}:{app_name}:{version}"
+
+
+def app_stream_announcements_key(app_name, version):
+    """ Returns the key of the stream announcing each action stream added to an app version's index. """
+    return f"{config.REDIS_APP_STREAM_ANNOUNCEMENTS}:{app_name}:{version}"
+
+
+def execution_streams_key(execution_id):
+    """ Returns the key of the set which indexes every action stream of an execution. """
+    return f"{config.REDIS_EXECUTION_STREAMS}:{execution_id}"
+
+
+async def record_service_time(redis: aioredis.Redis, service, seconds):
+    """ Counts a piece of work completed by a service, and how long it took, for the umpire's autoscaler """
+    pipe: aioredis.commands.Pipeline = redis.pipeline()
+    pipe.hincrby(config.REDIS_AUTOSCALER_SERVICE_TIMES, f"{service}:count", 1)
+    pipe.hincrbyfloat(config.REDIS_AUTOSCALER_SERVICE_TIMES, f"{service}:seconds", seconds)
+    await pipe.execute()
+
+
+def app_retirements_key(app_name, version):
+    """ Returns the key counting how many idle replicas of an app version the umpire has retired. """
+    return f"{config.REDIS_APP_RETIREMENTS}:{app_name}:{version}"
+
+
+def execution_plan_key(workflow_id, digest):
+    """ Returns the key of the execution plan compiled from the version of a workflow with the given digest. """
+    return f"{config.REDIS_EXECUTION_PLANS}:{workflow_id}:{digest}"
+
+
+async def store_result(redis: aioredis.Redis, result):
+    """
+        Claim check for results too large to pass around inline. A result whose JSON is over RESULT_INLINE_LIMIT bytes
+        is stored once under a key derived from its content and a reference to that key is returned in its place.
+        Results over RESULT_SIZE_LIMIT bytes aren't stored but truncated to their first RESULT_INLINE_LIMIT bytes.
+    """
+    try:
+        encoded = json.dumps(result)
+    except (TypeError, ValueError):
+        return result  # Leave it to the message encoder to report results which can't be serialized
+
+    inline_limit = config.get_int("RESULT_INLINE_LIMIT", 65536)
+    if len(encoded) <= inline_limit:
+        return result
+
+    size_limit = config.get_int("RESULT_SIZE_LIMIT", 67108864)
+    if len(encoded) > size_limit:
+        logger.warning(f"Truncating result of {len(encoded)} bytes, which is over the {size_limit} byte limit.")
+        return f"Result of {len(encoded)} bytes truncated to {inline_limit} bytes: {encoded[:inline_limit]}"
+
+    key = f"{config.REDIS_RESULT_STORE}:{hashlib.sha256(encoded.encode()).hexdigest()}"
+    await redis.set(key, encoded, expire=config.get_int("RESULT_STORE_TTL", 604800))
+    return result_ref(key)
+
+
+async def load_results(redis: aioredis.Redis, value):
+    """ Swaps any claim checks in a value for the results they refer to, fetching all of them with a single MGET. """
+    keys = list(dict.fromkeys(find_result_refs(value)))
+    if len(keys) < 1:
+        return value
+
+    stored = await redis.mget(*keys)
+    return replace_result_refs(value, {key: json.loads(result) for key, result in zip(keys, stored)
+                                       if result is not None})
+
+
+# Cached results expire by their TTL without being removed from the LRU index, so both scripts first drop the entries
+# whose expiry, as kept in a second sorted set, has passed
+PRUNE_EXPIRED_RESULTS = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[4], '-inf', ARGV[1], 'LIMIT', 0, 1000)
+if #expired > 0 then
+    redis.call('ZREM', KEYS[2], unpack(expired))
+    redis.call('ZREM', KEYS[4], unpack(expired))
+end
+"""
+
+GET_CACHED_RESULT_SCRIPT = PRUNE_EXPIRED_RESULTS + """
+local result = redis.call('GET', KEYS[1])
+if result then
+    redis.call('ZADD', KEYS[2], ARGV[1], KEYS[1])
+    redis.call('HINCRBY', KEYS[3], 'hits', 1)
+else
+    redis.call('HINCRBY', KEYS[3], 'misses', 1)
+end
+return result
+"""
+
+CACHE_RESULT_SCRIPT = PRUNE_EXPIRED_RESULTS + """
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+redis.call('ZADD', KEYS[2], ARGV[1], KEYS[1])
+redis.call('ZADD', KEYS[4], tonumber(ARGV[1]) + tonumber(ARGV[3]), KEYS[1])
+local excess = redis.call('ZCARD', KEYS[2]) - tonumber(ARGV[4])
+if excess > 0 then
+    local evicted = redis.call('ZRANGE', KEYS[2], 0, excess - 1)
+    redis.call('ZREMRANGEBYRANK', KEYS[2], 0, excess - 1)
+    redis.call('ZREM', KEYS[4], unpack(evicted))
+    redis.call('HINCRBY', KEYS[3], 'evictions', redis.call('DEL', unpack(evicted)))
+end
+"""
+
+
+def result_cache_keys(key):
+    """ Returns the keys the result cache scripts work on: the result, the LRU index, the stats and the expiries """
+    return [key, *(f"{config.REDIS_RESULT_CACHE}:{name}" for name in ("index", "stats", "expiries"))]
+
+
+def result_cache_field(app_name, app_version, action_name):
+    """ Returns the field holding an action's result cache TTL in the hash the api_gateway publishes them to. """
+    return f"{app_name}:{app_version}:{action_name}"
+
+
+def result_cache_key(app_name, app_version, action_name, parameters):
+    """
+        Returns the key an action's result is cached under, derived from a canonical encoding of its dereferenced
+        parameters, or None if the parameters can't be encoded.
+    """
+    try:
+        encoded = json.dumps({p.name: p.value for p in parameters}, sort_keys=True, separators=(",", ":"))
+    except (TypeError, ValueError):
+        return None
+    digest = hashlib.sha256(encoded.encode()).hexdigest()
+    return f"{config.REDIS_RESULT_CACHE}:{result_cache_field(app_name, app_version, action_name)}:{digest}"
+
+
+async def get_result_cache_ttls(redis: aioredis.Redis, actions):
+    """ Looks up which of the given actions are cacheable, returning their TTLs keyed by result_cache_field. """
+    fields = list({result_cache_field(a.app_name, a.app_version, a.name) for a in actions})
+    if len(fields) < 1 or config.get_int("RESULT_CACHE_SIZE", 10000) < 1:
+        return {}
+
+    ttls = await redis.hmget(config.REDIS_RESULT_CACHE_POLICIES, *fields)
+    return {field: int(ttl) for field, ttl in zip(fields, ttls) if ttl is not None}
+
+
+async def get_cached_result(redis: aioredis.Redis, key):
+    """ Returns a cached result, or None on a miss. Hits refresh the entry's place in the eviction order. """
+    cached = await eval_script(redis, GET_CACHED_RESULT_SCRIPT, result_cache_keys(key), [time.time()])
+    return json.loads(cached) if cached is not None else None
+
+
+async def cache_result(redis: aioredis.Redis, key, result, ttl):
+    """
+        Caches a result for ttl seconds. The cache holds at most RESULT_CACHE_SIZE results, evicting the least recently
+        used ones once it's full. Results holding claim checks are cached no longer than the results they refer to
+        are stored for, and not at all if any of those have already expired.
+    """
+    try:
+        encoded = json.dumps(result)
+    except (TypeError, ValueError):
+        return
+
+    refs = list(dict.fromkeys(find_result_refs(result)))
+    if len(refs) > 0:
+        pipe: aioredis.commands.Pipeline = redis.pipeline()
+        for ref in refs:
+            pipe.ttl(ref)
+        ttls = await pipe.execute()
+        if any(ref_ttl == -2 for ref_ttl in ttls):
+            return
+        ttl = min(ttl, *(ref_ttl for ref_ttl in ttls if ref_ttl >= 0))
+        if ttl < 1:
+            return
+
+    await eval_script(redis, CACHE_RESULT_SCRIPT, result_cache_keys(key),
+                      [time.time(), encoded, ttl, config.get_int("RESULT_CACHE_SIZE", 10000)])
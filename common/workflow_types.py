@@ -1,20 +1,45 @@
+import ast
 import uuid
 import json
+import time
+import hashlib
 import enum
 import logging
+import contextlib
+from functools import lru_cache
 from operator import attrgetter, itemgetter
 from collections import namedtuple, deque
 from asteval import Interpreter, make_symbol_table
 
+from common.codecs import TYPE_TAG, MSGPACK_HEADER, MsgPackCodec, stream_codec, action_stream_codec, codec_for
+from common.compression import compress_payload, decompress_payload
+
 logger = logging.getLogger("WALKOFF")
 
 
-def workflow_dumps(obj):
-    return json.dumps(obj, cls=WorkflowJSONEncoder)
+def workflow_dumps(obj, stream=False):
+    """
+        Encodes workflows as JSON, or with the stream codec and compression if they're bound for a stream. Actions
+        bound for a stream use the action stream codec instead, which packs them as records when it's msgpack.
+    """
+    if not stream:
+        return json.dumps(obj, cls=WorkflowJSONEncoder)
+    if isinstance(obj, Action):
+        if action_stream_codec is MsgPackCodec:
+            return compress_payload(MsgPackCodec.pack(action_record(obj)))
+        return compress_payload(action_stream_codec.dumps(obj, WorkflowJSONEncoder, WORKFLOW_TYPE_TAGS))
+    return compress_payload(stream_codec.dumps(obj, WorkflowJSONEncoder, WORKFLOW_TYPE_TAGS))
 
 
-def workflow_loads(obj):
-    return json.loads(obj, cls=WorkflowJSONDecoder)
+def workflow_loads(obj, type_=None):
+    """
+        Decodes workflow types. Payloads known to hold a Workflow or Action can pass that type to have it built
+        directly from the payload's schema, rather than by inspecting every dict in the payload for its type.
+    """
+    obj = decompress_payload(obj)
+    if type_ is not None:
+        return TYPE_DECODERS[type_](codec_for(obj).decode(obj))
+    return codec_for(obj).loads(obj, WorkflowJSONDecoder, WORKFLOW_CONSTRUCTORS)
 
 
 def workflow_dump(obj, fp):
@@ -34,6 +59,53 @@ class ConditionException(Exception):
     pass
 
 
+@lru_cache(maxsize=1024)
+def parse_conditional(conditional):
+    """ Conditionals are parsed once and the AST is reused every time a condition with the same text is evaluated """
+    return ast.parse(conditional)
+
+
+class InterpreterPool:
+    """
+        Keeps asteval Interpreters around for conditions to reuse, since building one costs far more than running the
+        short scripts conditions are made of. Each interpreter keeps its base symbol table, which is entirely read-only,
+        and only has a condition's parent and child symbols swapped in and out around each evaluation.
+    """
+    def __init__(self, max_size=8):
+        self.max_size = max_size
+        self.interpreters = []
+
+    @staticmethod
+    def create():
+        aeval = Interpreter(symtable=make_symbol_table(use_numpy=False), no_for=True, no_while=True, no_try=True,
+                            no_functiondef=True, no_ifexp=True, no_listcomp=True, no_augassign=True, no_assert=True,
+                            no_delete=True, no_raise=True, no_print=True, use_numpy=False, builtins_readonly=True)
+        return aeval, set(aeval.symtable), set(aeval.readonly_symbols)
+
+    @contextlib.contextmanager
+    def interpreter(self, symbols, readonly_symbols):
+        entry = self.interpreters.pop() if self.interpreters else self.create()
+        aeval, base_symbols, base_readonly = entry
+
+        aeval.symtable.update(symbols)
+        aeval.readonly_symbols = base_readonly | set(readonly_symbols)
+        aeval.error = []
+        aeval.start_time = time.time()
+        try:
+            yield aeval
+        finally:
+            # Drop the symbols passed in along with any the condition assigned so nothing leaks into the next call
+            if len(aeval.symtable) != len(base_symbols):
+                for name in [name for name in aeval.symtable if name not in base_symbols]:
+                    del aeval.symtable[name]
+            aeval.readonly_symbols = base_readonly
+            if len(self.interpreters) < self.max_size:
+                self.interpreters.append(entry)
+
+
+interpreter_pool = InterpreterPool()
+
+
 class WorkflowJSONDecoder(json.JSONDecoder):
     def __init__(self, *args, **kwargs):
         super().__init__(object_hook=self.object_hook, *args, **kwargs)
@@ -54,7 +126,7 @@ class WorkflowJSONDecoder(json.JSONDecoder):
             return Parameter(**o)
 
         elif "source_id" in o and "destination_id" in o:
-            self.branches.add(Branch(source_id=o["source_id"], destination_id=o["destination_id"], id_=o["id_"]))
+            self.branches.add(Branch(source_id=o["source_id"], destination_id=o["destination_id"], id_=o.get("id_")))
 
         elif "conditional" in o:
             node = Condition(**o)
@@ -66,6 +138,11 @@ class WorkflowJSONDecoder(json.JSONDecoder):
             self.nodes[node.id_] = node
             return node
 
+        elif "reducer" in o:
+            node = Reducer(**o)
+            self.nodes[node.id_] = node
+            return node
+
         elif "trigger_schema" in o:
             node = Trigger(**o)
             self.nodes[node.id_] = node
@@ -112,12 +189,13 @@ class WorkflowJSONEncoder(json.JSONEncoder):
             actions = [action for action in o.actions]
             conditions = [condition for condition in o.conditions]
             transforms = [transform for transform in o.transforms]
+            reducers = [reducer for reducer in o.reducers]
             triggers = [trigger for trigger in o.triggers]
             workflow_variables = list(o.workflow_variables.values())
             return {"id_": o.id_, "execution_id": o.execution_id, "name": o.name, "start": o.start.id_,
                     "actions": actions, "conditions": conditions, "branches": branches, "transforms": transforms,
-                    "triggers": triggers, "workflow_variables": workflow_variables, "is_valid": o.is_valid,
-                    "errors": None}
+                    "reducers": reducers, "triggers": triggers, "workflow_variables": workflow_variables,
+                    "is_valid": o.is_valid, "errors": None, "plan_digest": o.plan_digest}
 
         elif isinstance(o, Action):
             position = {"x": o.position.x, "y": o.position.y}
@@ -135,6 +213,11 @@ class WorkflowJSONEncoder(json.JSONEncoder):
             return {"id_": o.id_, "name": o.name, "app_name": o.app_name, "app_version": o.app_version,
                     "label": o.label, "position": position, "transform": o.transform, "parameter": o.parameter}
 
+        elif isinstance(o, Reducer):
+            position = {"x": o.position.x, "y": o.position.y}
+            return {"id_": o.id_, "name": o.name, "app_name": o.app_name, "app_version": o.app_version,
+                    "label": o.label, "position": position, "reducer": o.reducer, "parameter": o.parameter}
+
         elif isinstance(o, Trigger):
             position = {"x": o.position.x, "y": o.position.y}
             return {"id_": o.id_, "name": o.name, "app_name": o.app_name, "app_version": o.app_version,
@@ -312,17 +395,18 @@ class Condition(Node):
     def __call__(self, parents, children, accumulator) -> str:
         parent_symbols = {k: ParentSymbol(accumulator[v.id_]) for k, v in self.format_node_names(parents).items()}
         children_symbols = {k: ChildSymbol(v.id_) for k, v in self.format_node_names(children).items()}
-        syms = make_symbol_table(use_numpy=False, **parent_symbols, **children_symbols)
-        aeval = Interpreter(usersyms=syms, no_for=True, no_while=True, no_try=True, no_functiondef=True, no_ifexp=True,
-                            no_listcomp=True, no_augassign=True, no_assert=True, no_delete=True, no_raise=True,
-                            no_print=True, use_numpy=False, builtins_readonly=True,
-                            readonly_symbols=children_symbols.keys())
 
-        aeval(self.conditional)
-        child_id = getattr(aeval.symtable.get("selected_node", None), "id_", None)
+        try:
+            tree = parse_conditional(self.conditional)
+        except SyntaxError as e:
+            raise ConditionException(e.msg)
 
-        if len(aeval.error) > 0:
-            raise ConditionException
+        with interpreter_pool.interpreter({**parent_symbols, **children_symbols}, children_symbols.keys()) as aeval:
+            aeval.run(tree, expr=self.conditional, with_raise=False)
+            child_id = getattr(aeval.symtable.get("selected_node", None), "id_", None)
+
+            if len(aeval.error) > 0:
+                raise ConditionException(aeval.error[0].get_error()[1])
 
         return child_id
 
@@ -405,6 +489,87 @@ class Transform(Node):
         return data.split(delimiter)
 
 
+# The reducers available to Reducer nodes, each with a factory for its initial state
+REDUCERS = {"sum": int, "count": int, "concat": list, "merge": dict, "unique": dict, "min": lambda: None,
+            "max": lambda: None, "group_by": dict}
+
+
+class Reducer(Node):
+    """
+        Folds the items of its parent's result into a single value. When the parent is a parallelized action, each
+        shard's items are folded in as the shard completes so only the reducer's state is held rather than every item.
+    """
+    __slots__ = ("reducer", "parameter")
+
+    def __init__(self, name, position: Point, app_name, app_version, label, reducer, parameter=None, id_=None,
+                 errors=None, is_valid=None):
+        super().__init__(name, position, label, app_name, app_version, id_, errors, is_valid)
+        self.reducer = reducer.lower()
+        self.parameter = parameter
+        self.priority = 3  # Reducers have a fixed, mid valued priority
+
+    def __str__(self):
+        return f"Reducer: {self.label}::{self.id_}"
+
+    def __repr__(self):
+        return f"Reducer: {self.label}::{self.id_}"
+
+    def __eq__(self, other):
+        if isinstance(other, self.__class__) and self.__slots__ == other.__slots__:
+            return attrs_equal(self, other)
+        return False
+
+    def __hash__(self):
+        return hash(id(self))
+
+    def __call__(self, data):
+        """ Reduce a whole result at once """
+        logger.debug(f"Attempting execution of: {self.name}-{self.id_}")
+        result = self.finish(self.update(self.start(), data))
+        logger.debug(f"Executed {self.name}-{self.id_} with result: {result}")
+        return result
+
+    def start(self):
+        return REDUCERS[self.reducer]()
+
+    def update(self, state, items):
+        step = getattr(self, f"_{self.__class__.__name__}__{self.reducer}")
+        for item in items:
+            state = step(state, item)
+        return state
+
+    def finish(self, state):
+        return list(state.values()) if self.reducer == "unique" else state
+
+    def __sum(self, total, item):
+        return total + item
+
+    def __count(self, count, item):
+        return count + 1
+
+    def __concat(self, items, item):
+        items.append(item)
+        return items
+
+    def __merge(self, merged, item):
+        merged.update(item)
+        return merged
+
+    def __unique(self, seen, item):
+        seen.setdefault(json.dumps(item, sort_keys=True), item)
+        return seen
+
+    def __min(self, least, item):
+        return item if least is None or item < least else least
+
+    def __max(self, most, item):
+        return item if most is None or item > most else most
+
+    def __group_by(self, groups, item):
+        groups.setdefault(item[self.parameter], []).append(item)
+        return groups
+
+
 class DiGraph:
     __slots__ = ("nodes", "edges", "rev_adjacency")
 
@@ -475,12 +640,13 @@ class DiGraph:
 # TODO: Maybe look into pooling nodes/branches and sharing them across a workflow to save memory?
 class Workflow(DiGraph):
     __slots__ = ("start", "id_", "is_valid", "name", "execution_id", "workflow_variables", "conditions", "transforms",
-                 "triggers", "actions", "errors", "description", "tags")
+                 "reducers", "triggers", "actions", "errors", "description", "tags", "plan_digest")
 
     def __init__(self, name, start, actions: [Action], conditions: [Condition], triggers: [Trigger],
                  transforms: [Transform], branches: [Branch], workflow_variables, id_=None, execution_id=None,
-                 is_valid=None, errors=None, description=None, tags=None):
-        super().__init__(nodes=[*actions, *conditions, *triggers, *transforms], edges=branches)
+                 is_valid=None, errors=None, description=None, tags=None, plan_digest=None, reducers=None):
+        reducers = reducers if reducers is not None else []
+        super().__init__(nodes=[*actions, *conditions, *triggers, *transforms, *reducers], edges=branches)
 
         self.start = start
         self.id_ = id_ if id_ is not None else str(uuid.uuid4())
@@ -490,11 +656,13 @@ class Workflow(DiGraph):
         self.workflow_variables = workflow_variables if workflow_variables is not None else []
         self.conditions = conditions
         self.transforms = transforms
+        self.reducers = reducers
         self.triggers = triggers
         self.actions = actions
         self.errors = errors if errors is not None else []
         self.description = description
         self.tags = tags if tags is not None else []
+        self.plan_digest = plan_digest  # Identifies the cached ExecutionPlan compiled from this version, if any
 
     def __eq__(self, other):
         if isinstance(other, self.__class__) and self.__slots__ == other.__slots__:
@@ -528,3 +696,231 @@ class Workflow(DiGraph):
                     visited.add(child)
 
         return visited
+
+
+class ExecutionPlan:
+    """
+        A workflow compiled down to what the worker needs in order to schedule it. Nodes reachable from the start are
+        given integer indices in topological order, and each index maps to the indices of its parents, its children,
+        the descendants which get cancelled along with it and the consumers which read its result. Actions whose
+        parameters are all static values are pre-encoded into templates, with a slot at the end for the execution id.
+    """
+    __slots__ = ("order", "index", "parents", "children", "descendants", "payloads", "consumers", "inputs")
+
+    def __init__(self, order, parents, children, descendants, payloads, consumers=None):
+        self.order = order
+        self.index = {node_id: i for i, node_id in enumerate(order)}
+        self.parents = parents
+        self.children = children
+        self.descendants = descendants
+        self.payloads = payloads
+        self.consumers = consumers
+
+        # The inverse of consumers, i.e. the nodes whose results each node reads. Plans cached before consumers were
+        # compiled have neither, and their results are simply kept for the whole execution.
+        self.inputs = None
+        if consumers is not None:
+            self.inputs = [[] for _ in order]
+            for i, node_consumers in enumerate(consumers):
+                for j in node_consumers:
+                    self.inputs[j].append(i)
+
+    @staticmethod
+    def digest(workflow_json):
+        """ Hashes the JSON of a workflow so that plans are keyed by the version of the workflow they came from """
+        return hashlib.sha256(json.dumps(workflow_json, sort_keys=True).encode()).hexdigest()
+
+    @classmethod
+    def compile(cls, workflow: Workflow, start: Node = None):
+        start = start if start is not None else workflow.start
+
+        # BFS from the start to find every node which can run
+        reachable = [start]
+        visited = {start}
+        queue = deque([start])
+        while queue:
+            node = queue.pop()
+            for child in sorted(workflow.successors(node), reverse=True):
+                if child not in visited:
+                    queue.appendleft(child)
+                    visited.add(child)
+                    reachable.append(child)
+
+        parents = {node: [p for p in workflow.rev_adjacency.get(node, ()) if p in visited] for node in reachable}
+        parents[start] = []
+
+        # Kahn's algorithm gives us a topological order. Cycles aren't supported, but any nodes caught in one are
+        # still scheduled after the rest so they behave as they did before plans were compiled.
+        in_degree = {node: len(node_parents) for node, node_parents in parents.items()}
+        ready = deque([start])
+        order = []
+        while ready:
+            node = ready.popleft()
+            order.append(node)
+            for child in sorted(workflow.successors(node), reverse=True):
+                if child is start:
+                    continue
+                in_degree[child] -= 1
+                if in_degree[child] == 0:
+                    ready.append(child)
+        ordered = set(order)
+        order.extend(node for node in reachable if node not in ordered)
+
+        index = {node: i for i, node in enumerate(order)}
+        parent_indices = [sorted(index[p] for p in parents[node]) for node in order]
+        child_indices = [[index[c] for c in sorted(workflow.successors(node), reverse=True)] for node in order]
+
+        # A node's descendants are the nodes which can only run through it, i.e. those cancelled along with it
+        descendants = []
+        for i in range(len(order)):
+            found = []
+            stack = [i]
+            while stack:
+                for child in child_indices[stack.pop()]:
+                    if len(parent_indices[child]) == 1 and child not in found:
+                        found.append(child)
+                        stack.append(child)
+            descendants.append(found)
+
+        # A node's consumers are the nodes which read its result: conditions, transforms and reducers read their
+        # parents' results and actions read the results their ACTION_RESULT parameters refer to. A result can be
+        # dropped once all of its consumers have run, so the results held at any time depend on the workflow's width.
+        consumers = [[j for j in child_indices[i] if isinstance(order[j], (Condition, Transform, Reducer))]
+                     for i in range(len(order))]
+        ids = {node.id_: i for i, node in enumerate(order)}
+        for j, node in enumerate(order):
+            if not isinstance(node, Action):
+                continue
+            for p in node.parameters:
+                if p.variant == ParameterVariant.ACTION_RESULT and isinstance(p.value, str) and p.value in ids:
+                    if j not in consumers[ids[p.value]]:
+                        consumers[ids[p.value]].append(j)
+
+        payloads = {}
+        for i, node in enumerate(order):
+            if isinstance(node, Action) and not node.parallelized \
+                    and all(p.variant == ParameterVariant.STATIC_VALUE for p in node.parameters):
+                # The execution id is left out of the template and always goes last, after everything else in it
+                if action_stream_codec is MsgPackCodec:
+                    record = action_record(node)
+                    payloads[i] = MsgPackCodec.pack_prefix(record[:-1], len(record))
+                else:
+                    encoded = WorkflowJSONEncoder().default(node)
+                    del encoded["execution_id"]
+                    payloads[i] = json.dumps(encoded, cls=WorkflowJSONEncoder)
+
+        return cls([node.id_ for node in order], parent_indices, child_indices, descendants, payloads, consumers)
+
+    def payload(self, node_id, execution_id):
+        """ Returns the encoded action for this execution, or None if the action has to be encoded when it's run """
+        template = self.payloads.get(self.index.get(node_id))
+        if template is None:
+            return None
+        if isinstance(template, bytes):
+            return template + MsgPackCodec.pack(execution_id, header=False)
+        return f'{template[:-1]}, "execution_id": {json.dumps(execution_id)}}}'
+
+    def dumps(self):
+        # Packed templates are kept as latin-1 text, which maps each byte to a character and back again
+        templates = {i: t.decode("latin-1") if isinstance(t, bytes) else t for i, t in self.payloads.items()}
+        return json.dumps({"order": self.order, "parents": self.parents, "children": self.children,
+                           "descendants": self.descendants, "templates": templates, "consumers": self.consumers})
+
+    @classmethod
+    def loads(cls, obj):
+        o = json.loads(obj)
+        # Plans cached before payloads were templated hold a placeholder for the execution id instead, so their
+        # actions are encoded when they're run
+        payloads = {int(i): t.encode("latin-1") if t[:1] == MSGPACK_HEADER.decode("latin-1") else t
+                    for i, t in o.get("templates", {}).items()}
+        return cls(o["order"], o["parents"], o["children"], o["descendants"], payloads, o.get("consumers"))
+
+
+def node_constructor(cls):
+    def construct(o):
+        o["position"] = Point(**o["position"])
+        return cls(**o)
+    return construct
+
+
+def parameter_constructor(o):
+    o["variant"] = ParameterVariant[o["variant"]]
+    return Parameter(**o)
+
+
+def workflow_constructor(o):
+    # Nodes are decoded before the workflow holding them, so branches can be resolved from the workflow's own lists
+    o["reducers"] = o.get("reducers", [])
+    nodes = {node.id_: node for node in (*o["actions"], *o["conditions"], *o["transforms"], *o["reducers"],
+                                         *o["triggers"])}
+    o["branches"] = {Branch(nodes[b["source_id"]], nodes[b["destination_id"]], b.get("id_")) for b in o["branches"]}
+    o["workflow_variables"] = {var.id_: var for var in o["workflow_variables"]}
+    o["start"] = nodes[o["start"]]
+    return Workflow(**o)
+
+
+# Workflow types tagged by the binary stream codecs, and the constructors used to rebuild them
+WORKFLOW_TYPE_TAGS = {cls: cls.__name__
+                      for cls in (Workflow, Action, Condition, Transform, Reducer, Trigger, Parameter, Variable)}
+WORKFLOW_CONSTRUCTORS = {"Workflow": workflow_constructor, "Action": node_constructor(Action),
+                         "Condition": node_constructor(Condition), "Transform": node_constructor(Transform),
+                         "Reducer": node_constructor(Reducer), "Trigger": node_constructor(Trigger),
+                         "Parameter": parameter_constructor, "Variable": lambda o: Variable(**o)}
+
+
+def decode_parameter(o):
+    o.pop(TYPE_TAG, None)
+    o["variant"] = ParameterVariant[o["variant"]]
+    return Parameter(**o)
+
+
+def decode_variable(o):
+    o.pop(TYPE_TAG, None)
+    return Variable(**o)
+
+
+def decode_node(cls, o):
+    o.pop(TYPE_TAG, None)
+    o["position"] = Point(**o["position"])
+    return cls(**o)
+
+
+# Actions are packed as records, lists of their fields in a fixed order, so apps can decode them without looking up a
+# single key. The execution id is always last, which lets plans pack everything before it ahead of time.
+PARAMETER_VARIANTS = {variant.value: variant for variant in ParameterVariant}
+
+
+def action_record(action):
+    return [action.id_, action.name, action.app_name, action.app_version, action.label, action.position.x,
+            action.position.y, action.priority,
+            [[p.name, p.variant.value, p.value, p.id_] for p in action.parameters], action.execution_id]
+
+
+def decode_action_record(r):
+    id_, name, app_name, app_version, label, x, y, priority, parameters, execution_id = r
+    # Arguments are passed by position, which is measurably cheaper for the handful of fields every action has
+    parameters = [Parameter(p_name, False, p_id, value, PARAMETER_VARIANTS[variant])
+                  for p_name, variant, value, p_id in parameters]
+    return Action(name, Point(x, y), app_name, app_version, label, priority, False, parameters, id_, execution_id)
+
+
+def decode_action(o):
+    if isinstance(o, list):
+        return decode_action_record(o)
+    o["parameters"] = [decode_parameter(parameter) for parameter in o["parameters"]]
+    return decode_node(Action, o)
+
+
+def decode_workflow(o):
+    o.pop(TYPE_TAG, None)
+    o["actions"] = [decode_action(action) for action in o["actions"]]
+    o["conditions"] = [decode_node(Condition, condition) for condition in o["conditions"]]
+    o["transforms"] = [decode_node(Transform, transform) for transform in o["transforms"]]
+    o["reducers"] = [decode_node(Reducer, reducer) for reducer in o.get("reducers", [])]
+    o["triggers"] = [decode_node(Trigger, trigger) for trigger in o["triggers"]]
+    o["workflow_variables"] = [decode_variable(var) for var in o["workflow_variables"]]
+    return workflow_constructor(o)
+
+
+# Schema directed decoders for payloads whose type is known ahead of time
+TYPE_DECODERS = {Workflow: decode_workflow, Action: decode_action}
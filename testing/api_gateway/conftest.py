@@ -103,6 +103,7 @@ def execdb():
     from api_gateway.executiondb.parameter import Parameter
     from api_gateway.executiondb.returns import ReturnApi
     from api_gateway.executiondb.transform import Transform
+    from api_gateway.executiondb.reducer import Reducer
     from api_gateway.executiondb.workflow import Workflow
     from api_gateway.executiondb.workflow_variable import WorkflowVariable
     from api_gateway.executiondb.workflowresults import WorkflowStatus
@@ -111,7 +112,7 @@ def execdb():
     execution_db = ExecutionDatabase.instance
     execution_db.session.rollback()
     classes = [Workflow, Action, AppApi, Branch, GlobalVariable, Dashboard,
-               Condition, Transform, WorkflowStatus, WorkflowStatus, Parameter, ReturnApi,
+               Condition, Transform, Reducer, WorkflowStatus, WorkflowStatus, Parameter, ReturnApi,
                WorkflowVariable]
     for ee in classes:
         execution_db.session.query(ee).delete()
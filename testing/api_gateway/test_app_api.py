@@ -1,9 +1,15 @@
+import json
 import logging
+from http import HTTPStatus
 
 import pytest
+from flask import current_app
 from flask.testing import FlaskClient
+from sqlalchemy import inspect, text
 import yaml
 
+from common.config import config
+
 from testing.api_gateway.helpers import assert_crud_resource
 
 logger = logging.getLogger(__name__)
@@ -413,3 +419,114 @@ def test_create_api_invalid_parameters(api_gateway: FlaskClient, auth_header, ex
         },
     ]
     assert_crud_resource(api_gateway, auth_header, apps_api_url, inputs, yaml.full_load, valid=False)
+
+
+def test_create_api_cacheable_actions(api_gateway: FlaskClient, auth_header, execdb):
+    """Assert that cacheable actions and their TTLs are stored and published to the workers' cache policies"""
+    cache = current_app.running_context.cache
+    api = yaml.full_load("""
+    walkoff_version: 1.0.0
+    app_version: 1.0.0
+    name: test_cache:1.0.0
+    description: An App API with cacheable actions
+    actions:
+      - name: cached_for_a_day
+        cacheable: true
+        cache_ttl: 86400
+      - name: cached_for_default
+        cacheable: true
+      - name: not_cached
+    """)
+    fields = [f"test_cache:1.0.0:1.0.0:{action['name']}" for action in api["actions"]]
+
+    p = api_gateway.post(apps_api_url, headers=auth_header, data=json.dumps(api))
+    assert p.status_code == HTTPStatus.CREATED
+    actions = {action["name"]: action for action in p.get_json()["actions"]}
+    assert actions["cached_for_a_day"]["cacheable"] and actions["cached_for_a_day"]["cache_ttl"] == 86400
+    assert actions["cached_for_default"]["cacheable"] and actions["cached_for_default"]["cache_ttl"] is None
+    assert not actions["not_cached"]["cacheable"]
+
+    try:
+        default_ttl = config.get_int("RESULT_CACHE_TTL", 3600)
+        assert cache.hmget(config.REDIS_RESULT_CACHE_POLICIES, fields) == [b"86400", str(default_ttl).encode(), None]
+
+        # Actions which are no longer cacheable are withdrawn from the policies
+        api["actions"][0]["cacheable"] = False
+        u = api_gateway.put(f"{apps_api_url}/{p.get_json()['id_']}", headers=auth_header, data=json.dumps(api))
+        assert u.status_code == HTTPStatus.OK
+        assert not {action["name"]: action for action in u.get_json()["actions"]}["cached_for_a_day"]["cacheable"]
+        assert cache.hmget(config.REDIS_RESULT_CACHE_POLICIES, fields) == [None, str(default_ttl).encode(), None]
+    finally:
+        cache.hdel(config.REDIS_RESULT_CACHE_POLICIES, *fields)
+
+
+def test_add_missing_action_api_columns(api_gateway: FlaskClient, auth_header, execdb):
+    """Assert that columns added to the action API model are added to a table created before them"""
+    inputs = [{"create": """
+            walkoff_version: 1.0.0
+            app_version: 1.0.0
+            name: test_app:1.0.0
+            description: An App API created before its actions could be cacheable
+            actions:
+              - name: test_action
+            """}]
+    assert_crud_resource(api_gateway, auth_header, apps_api_url, inputs, yaml.full_load)
+
+    execdb.session.commit()
+    with execdb.engine.begin() as connection:
+        connection.execute(text("ALTER TABLE action_api DROP COLUMN cacheable, DROP COLUMN cache_ttl"))
+    execdb.add_missing_columns()
+
+    columns = {column["name"] for column in inspect(execdb.engine).get_columns("action_api")}
+    assert {"cacheable", "cache_ttl"} <= columns
+    p = api_gateway.get(apps_api_url, headers=auth_header)
+    assert p.status_code == HTTPStatus.OK
+    action = p.get_json()[0]["actions"][0]
+    assert action["cacheable"] is False and action["cache_ttl"] is None
+
+
+def test_read_result_cache_stats(api_gateway: FlaskClient, auth_header, execdb):
+    """Assert that the result cache's counters and size are reported, leaving out results which have expired"""
+    cache = current_app.running_context.cache
+    keys = [f"{config.REDIS_RESULT_CACHE}:{name}" for name in ("stats", "index", "expiries")]
+    cache.delete(*keys)
+
+    p = api_gateway.get(f"{apps_url}/cache", headers=auth_header)
+    assert p.status_code == HTTPStatus.OK
+    assert p.get_json() == {"hits": 0, "misses": 0, "evictions": 0, "size": 0,
+                            "capacity": config.get_int("RESULT_CACHE_SIZE", 10000)}
+
+    cache.hset(f"{config.REDIS_RESULT_CACHE}:stats", "hits", 3)
+    cache.hset(f"{config.REDIS_RESULT_CACHE}:stats", "misses", 2)
+    cache.zadd(f"{config.REDIS_RESULT_CACHE}:index", {"first": 1, "second": 2, "expired": 0})
+    cache.zadd(f"{config.REDIS_RESULT_CACHE}:expiries", {"first": 2e9, "second": 2e9, "expired": 1})
+    try:
+        p = api_gateway.get(f"{apps_url}/cache", headers=auth_header)
+        assert p.status_code == HTTPStatus.OK
+        assert p.get_json()["hits"] == 3 and p.get_json()["misses"] == 2 and p.get_json()["evictions"] == 0
+        assert p.get_json()["size"] == 2
+    finally:
+        cache.delete(*keys)
+
+
+def test_read_autoscaler_status(api_gateway: FlaskClient, auth_header, execdb):
+    """Assert that the autoscaler's metrics are reported along with its most recent decisions first"""
+    cache = current_app.running_context.cache
+    cache.delete(config.REDIS_AUTOSCALER_METRICS, config.REDIS_AUTOSCALER_LOG)
+
+    worker = {"service": "worker", "action": "up", "previous": 1, "replicas": 2, "reason": "backlog"}
+    app = {"service": "hello_world:1.0.0", "action": "hold", "previous": 1, "replicas": 1, "reason": "hysteresis"}
+    cache.hset(config.REDIS_AUTOSCALER_METRICS, "worker", json.dumps(worker))
+    cache.hset(config.REDIS_AUTOSCALER_METRICS, "hello_world:1.0.0", json.dumps(app))
+    for replicas in (2, 3):
+        cache.xadd(config.REDIS_AUTOSCALER_LOG, {"decision": json.dumps(dict(worker, replicas=replicas))})
+    try:
+        p = api_gateway.get(f"{apps_url}/autoscaler", headers=auth_header)
+        assert p.status_code == HTTPStatus.OK
+        assert sorted(p.get_json()["services"], key=lambda s: s["service"]) == [app, worker]
+        assert [decision["replicas"] for decision in p.get_json()["decisions"]] == [3, 2]
+
+        p = api_gateway.get(f"{apps_url}/autoscaler?limit=1", headers=auth_header)
+        assert [decision["replicas"] for decision in p.get_json()["decisions"]] == [3]
+    finally:
+        cache.delete(config.REDIS_AUTOSCALER_METRICS, config.REDIS_AUTOSCALER_LOG)
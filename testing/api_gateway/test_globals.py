@@ -1,5 +1,6 @@
 import logging
 import json
+from http import HTTPStatus
 
 from flask.testing import FlaskClient
 
@@ -118,6 +119,21 @@ def test_create_global_no_template(api_gateway: FlaskClient, auth_header, execdb
     assert_crud_resource(api_gateway, auth_header, globals_url, inputs, json.loads)
 
 
+def test_read_globals_by_id(api_gateway: FlaskClient, auth_header, execdb):
+    """Assert that globals are read in batches, leaving out the ones which do not exist"""
+    ids = []
+    for name in ("first", "second", "third"):
+        p = api_gateway.post(globals_url, headers=auth_header, data=json.dumps({"name": name, "value": name}))
+        assert p.status_code == HTTPStatus.CREATED
+        ids.append(p.get_json()["id_"])
+
+    missing = "8254ba1a-3f6a-40c6-b0c7-d00acd40650d"
+    p = api_gateway.get(f"{globals_url}/batch?ids={ids[0]},{ids[2]},{missing}&to_decrypt=false",
+                        headers=auth_header)
+    assert p.status_code == HTTPStatus.OK
+    assert sorted(global_var["name"] for global_var in p.get_json()) == ["first", "third"]
+
+
 # def test_read_all_globals_in_db(api_gateway, token, serverdb, execdb):
 #     header = {'Authorization': 'Bearer {}'.format(token['access_token']), 'content-type': 'application/json'}
 #     response = api_gateway.get("/api/globals", headers=header)
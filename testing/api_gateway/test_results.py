@@ -0,0 +1,155 @@
+import json
+import logging
+import uuid
+from http import HTTPStatus
+
+from flask.testing import FlaskClient
+
+from common.message_types import StatusEnum
+from api_gateway.server.endpoints import results
+from api_gateway.executiondb.workflowresults import WorkflowStatus, NodeStatus
+
+logger = logging.getLogger(__name__)
+workflow_status_url = "/api/internal/workflowstatus"
+
+
+def create_workflow_status(execdb, name):
+    workflow_status = WorkflowStatus(execution_id=uuid.uuid4(), workflow_id=uuid.uuid4(), name=name,
+                                     status=StatusEnum.PENDING)
+    execdb.session.add(workflow_status)
+    execdb.session.commit()
+    return str(workflow_status.execution_id)
+
+
+def read_status(execdb, execution_id):
+    execdb.session.expire_all()
+    return execdb.session.query(WorkflowStatus).filter_by(execution_id=execution_id).first().status
+
+
+def test_update_workflow_statuses(api_gateway: FlaskClient, auth_header, execdb):
+    """Assert that a batch of patches is applied to each of the workflow statuses it names"""
+    first = create_workflow_status(execdb, "first")
+    second = create_workflow_status(execdb, "second")
+
+    updates = [
+        {"execution_id": first, "event": "EXECUTING",
+         "patches": [{"op": "replace", "path": "/status", "value": "EXECUTING"}]},
+        {"execution_id": second, "event": "EXECUTING",
+         "patches": [{"op": "replace", "path": "/status", "value": "EXECUTING"}]},
+        {"execution_id": first, "event": "COMPLETED",
+         "patches": [{"op": "replace", "path": "/status", "value": "COMPLETED"}]},
+    ]
+    p = api_gateway.patch(workflow_status_url, headers=auth_header, data=json.dumps(updates))
+    assert p.status_code == HTTPStatus.OK
+    assert sorted(p.get_json()["updated"]) == sorted([first, second])
+    assert p.get_json()["missing"] == [] and p.get_json()["failed"] == []
+
+    assert read_status(execdb, first) == StatusEnum.COMPLETED
+    assert read_status(execdb, second) == StatusEnum.EXECUTING
+
+
+def test_update_workflow_statuses_failures(api_gateway: FlaskClient, auth_header, execdb):
+    """Assert that patches which cannot be applied only lose the updates to their own execution"""
+    good = create_workflow_status(execdb, "good")
+    bad = create_workflow_status(execdb, "bad")
+    missing = str(uuid.uuid4())
+
+    # Replacing the status of a node which never reported one conflicts
+    node_id = str(uuid.uuid4())
+    succeeded = {"node_id": node_id, "combined_id": f"{node_id}:{bad}", "name": "pause", "label": "pause",
+                 "app_name": "hello_world", "status": "SUCCESS"}
+    updates = [
+        {"execution_id": good, "event": "EXECUTING",
+         "patches": [{"op": "replace", "path": "/status", "value": "EXECUTING"}]},
+        {"execution_id": bad, "event": "EXECUTING",
+         "patches": [{"op": "replace", "path": "/status", "value": "EXECUTING"}]},
+        {"execution_id": bad, "event": "SUCCESS",
+         "patches": [{"op": "replace", "path": f"/node_statuses/{node_id}", "value": succeeded}]},
+        {"execution_id": missing, "event": "EXECUTING",
+         "patches": [{"op": "replace", "path": "/status", "value": "EXECUTING"}]},
+    ]
+    p = api_gateway.patch(workflow_status_url, headers=auth_header, data=json.dumps(updates))
+    assert p.status_code == HTTPStatus.OK
+    assert p.get_json() == {"updated": [good, bad], "missing": [missing],
+                            "failed": [{"index": 2, "execution_id": bad, "event": "SUCCESS"}]}
+
+    # Only the update with the conflicting patch is lost
+    assert read_status(execdb, good) == StatusEnum.EXECUTING
+    assert read_status(execdb, bad) == StatusEnum.EXECUTING
+
+    # A status which fails to load only loses its own update too
+    updates = [
+        {"execution_id": good, "event": "COMPLETED",
+         "patches": [{"op": "replace", "path": "/status", "value": "NOT_A_STATUS"}]},
+        {"execution_id": good, "event": "COMPLETED",
+         "patches": [{"op": "replace", "path": "/status", "value": "COMPLETED"}]},
+    ]
+    p = api_gateway.patch(workflow_status_url, headers=auth_header, data=json.dumps(updates))
+    assert p.status_code == HTTPStatus.OK
+    assert p.get_json() == {"updated": [good], "missing": [],
+                            "failed": [{"index": 0, "execution_id": good, "event": "COMPLETED"}]}
+    assert read_status(execdb, good) == StatusEnum.COMPLETED
+
+
+def test_update_workflow_statuses_events(api_gateway: FlaskClient, auth_header, execdb, monkeypatch):
+    """Assert that stream subscribers are sent each update's status rather than the batch's final status"""
+    execution_id = create_workflow_status(execdb, "events")
+    node_id = str(uuid.uuid4())
+    node_status = {"node_id": node_id, "combined_id": f"{node_id}:{execution_id}", "name": "pause", "label": "pause",
+                   "app_name": "hello_world"}
+
+    pushed = []
+    monkeypatch.setattr(results.gevent, "spawn", lambda func, *args: pushed.append((func, args)))
+
+    updates = [
+        {"execution_id": execution_id, "event": "EXECUTING",
+         "patches": [{"op": "replace", "path": "/status", "value": "EXECUTING"}]},
+        {"execution_id": execution_id, "event": "EXECUTING",
+         "patches": [{"op": "add", "path": f"/node_statuses/{node_id}",
+                      "value": dict(node_status, status="EXECUTING")}]},
+        {"execution_id": execution_id, "event": "SUCCESS",
+         "patches": [{"op": "replace", "path": f"/node_statuses/{node_id}",
+                      "value": dict(node_status, status="SUCCESS", result="done")}]},
+        {"execution_id": execution_id, "event": "COMPLETED",
+         "patches": [{"op": "replace", "path": "/status", "value": "COMPLETED"}]},
+    ]
+    p = api_gateway.patch(workflow_status_url, headers=auth_header, data=json.dumps(updates))
+    assert p.status_code == HTTPStatus.OK
+
+    workflow_events = [(args[1], args[0]["status"]) for func, args in pushed
+                       if func is results.push_to_workflow_stream_queue]
+    assert workflow_events == [("EXECUTING", "EXECUTING"), ("EXECUTING", "EXECUTING"), ("SUCCESS", "EXECUTING"),
+                               ("COMPLETED", "COMPLETED")]
+    node_events = [(args[1], [(status["status"], status["result"]) for status in args[0]]) for func, args in pushed
+                   if func is results.push_to_action_stream_queue]
+    assert node_events == [("EXECUTING", [("EXECUTING", None)]), ("SUCCESS", [("SUCCESS", "done")])]
+
+
+def test_update_workflow_statuses_aborted_nodes(api_gateway: FlaskClient, auth_header, execdb):
+    """Assert that nodes which are aborted before they report a status don't lose their execution's updates"""
+    execution_id = create_workflow_status(execdb, "aborted")
+    started, cancelled = str(uuid.uuid4()), str(uuid.uuid4())
+
+    def node_status(node_id, status):
+        return {"node_id": node_id, "combined_id": f"{node_id}:{execution_id}", "name": "pause", "label": "pause",
+                "app_name": "hello_world", "status": status}
+
+    updates = [
+        {"execution_id": execution_id, "event": "EXECUTING",
+         "patches": [{"op": "replace", "path": "/status", "value": "EXECUTING"}]},
+        {"execution_id": execution_id, "event": "EXECUTING",
+         "patches": [{"op": "add", "path": f"/node_statuses/{started}", "value": node_status(started, "EXECUTING")}]},
+        {"execution_id": execution_id, "event": "ABORTED",
+         "patches": [{"op": "add", "path": f"/node_statuses/{started}", "value": node_status(started, "ABORTED")}]},
+        {"execution_id": execution_id, "event": "ABORTED",
+         "patches": [{"op": "add", "path": f"/node_statuses/{cancelled}",
+                      "value": node_status(cancelled, "ABORTED")}]},
+    ]
+    p = api_gateway.patch(workflow_status_url, headers=auth_header, data=json.dumps(updates))
+    assert p.status_code == HTTPStatus.OK
+    assert p.get_json() == {"updated": [execution_id], "missing": [], "failed": []}
+    assert read_status(execdb, execution_id) == StatusEnum.EXECUTING
+
+    node_statuses = execdb.session.query(NodeStatus).filter(NodeStatus.combined_id.like(f"%:{execution_id}")).all()
+    assert {str(status.node_id): status.status for status in node_statuses} == {started: StatusEnum.ABORTED,
+                                                                               cancelled: StatusEnum.ABORTED}
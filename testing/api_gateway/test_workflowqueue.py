@@ -2,4 +2,61 @@ import pytest
 
 import api_gateway.server.endpoints.workflows
 import json
-import logging
\ No newline at end of file
+import logging
+from http import HTTPStatus
+
+import yaml
+from flask import current_app
+
+from common.workflow_types import ExecutionPlan
+from api_gateway.server.endpoints.workflowqueue import execution_plan_key, get_execution_plan, workflow_getter
+
+logger = logging.getLogger(__name__)
+
+minimal_workflow = {
+    "actions": [
+        {
+            "app_name": "hello_world:1.0.0",
+            "app_version": "1.0.0",
+            "id_": "703dc24c-5d83-9001-5e54-aabfbe401e64",
+            "label": "hello_world",
+            "name": "hello_world",
+            "position": {"x": 0, "y": 0}
+        }
+    ],
+    "name": "Test",
+    "start": "703dc24c-5d83-9001-5e54-aabfbe401e64"
+}
+
+
+def test_get_execution_plan(api_gateway, auth_header, execdb, monkeypatch):
+    """Assert that every change to a workflow is seen by its next execution, but plans are only compiled once"""
+    with open("apps/hello_world/1.0.0/api.yaml") as f:
+        p = api_gateway.post("/api/apps/apis", headers=auth_header, data=json.dumps(yaml.full_load(f)))
+    assert p.status_code == HTTPStatus.CREATED
+    p = api_gateway.post("/api/workflows", headers=auth_header, data=json.dumps(minimal_workflow))
+    assert p.status_code == HTTPStatus.CREATED
+    workflow_id = p.get_json()["id_"]
+
+    cache = current_app.running_context.cache
+    workflow_json, digest = get_execution_plan(workflow_getter(workflow_id))
+    assert workflow_json["id_"] == workflow_id
+    assert cache.exists(execution_plan_key(workflow_id, digest))
+
+    compiled = []
+    compile_plan = ExecutionPlan.compile
+
+    def compile_counted(workflow):
+        compiled.append(workflow.id_)
+        return compile_plan(workflow)
+
+    monkeypatch.setattr(ExecutionPlan, "compile", compile_counted)
+    assert get_execution_plan(workflow_getter(workflow_id)) == (workflow_json, digest)
+    assert compiled == []
+
+    # Workflows can change without going through the workflow endpoints
+    workflow_getter(workflow_id).name = "Renamed"
+    execdb.session.commit()
+    workflow_json, new_digest = get_execution_plan(workflow_getter(workflow_id))
+    assert workflow_json["name"] == "Renamed"
+    assert new_digest != digest and len(compiled) == 1
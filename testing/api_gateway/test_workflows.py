@@ -1,5 +1,7 @@
 import json
 import logging
+from http import HTTPStatus
+from uuid import uuid4
 
 import pytest
 import yaml
@@ -46,3 +48,86 @@ def test_workflow_post_and_get(api_gateway, auth_header, execdb):
         },
     ]
     assert_crud_resource(api_gateway, auth_header, workflows_url, inputs, json.loads, delete=True)
+
+
+
+def reducer_workflow(reducer, parameter=None, sources=1):
+    """ Actions which each feed the same reducer, with fresh IDs so that it can be created alongside others """
+    action_ids = [str(uuid4()) for _ in range(sources)]
+    reducer_id = str(uuid4())
+    return {
+        "actions": [
+            {
+                "app_name": "hello_world",
+                "app_version": "1.0.0",
+                "id_": action_id,
+                "label": f"hello_world_{i}",
+                "name": "hello_world",
+                "position": {"x": 100 * i, "y": 0}
+            } for i, action_id in enumerate(action_ids or [str(uuid4())])
+        ],
+        "reducers": [
+            {
+                "app_name": "Builtin",
+                "app_version": "1.0.0",
+                "id_": reducer_id,
+                "label": "reducer",
+                "name": "Reducer",
+                "reducer": reducer,
+                "parameter": parameter,
+                "position": {"x": 0, "y": 100}
+            }
+        ],
+        "branches": [{"source_id": action_id, "destination_id": reducer_id} for action_id in action_ids],
+        "name": str(uuid4()),
+    }
+
+
+def assert_reducer_errors(response, expected):
+    reducer = response.get_json()["reducers"][0]
+    assert reducer["errors"] == expected
+    assert reducer["is_valid"] == (not expected)
+
+
+def test_workflow_reducer_validation(api_gateway, auth_header, execdb):
+    """Assert that reducers are validated against the workflow when it's created and when it's updated"""
+    with open("apps/hello_world/1.0.0/api.yaml") as f:
+        r = {"create": f.read()}
+    assert_crud_resource(api_gateway, auth_header, "/api/apps/apis", [r], yaml.full_load)
+
+    workflow = reducer_workflow("sum")
+    workflow["start"] = workflow["actions"][0]["id_"]
+    p = api_gateway.post(workflows_url, headers=auth_header, data=json.dumps(workflow))
+    assert p.status_code == HTTPStatus.CREATED
+    assert_reducer_errors(p, [])
+    workflow_id = p.get_json()["id_"]
+
+    # Unknown reducers are rejected by the API's schema before the workflow is validated
+    unknown = reducer_workflow("average")
+    unknown["start"] = unknown["actions"][0]["id_"]
+    p = api_gateway.post(workflows_url, headers=auth_header, data=json.dumps(unknown))
+    assert p.status_code == HTTPStatus.BAD_REQUEST
+    unknown["id_"] = workflow_id
+    u = api_gateway.put(f"{workflows_url}/{workflow_id}", headers=auth_header, data=json.dumps(unknown))
+    assert u.status_code == HTTPStatus.BAD_REQUEST
+
+    cases = [
+        (reducer_workflow("group_by", parameter="host"), []),
+        (reducer_workflow("group_by"), ["The group_by reducer requires the key to group by as its parameter."]),
+        (reducer_workflow("sum", sources=0), ["Reducers must have exactly one incoming connection."]),
+        (reducer_workflow("sum", sources=2), ["Reducers must have exactly one incoming connection."]),
+    ]
+    for workflow, expected in cases:
+        workflow["start"] = workflow["actions"][0]["id_"]
+        p = api_gateway.post(workflows_url, headers=auth_header, data=json.dumps(workflow))
+        assert p.status_code == HTTPStatus.CREATED
+        assert_reducer_errors(p, expected)
+
+    # Updating the first workflow swaps in a copy of each case's nodes, which are validated against its branches
+    for workflow, expected in cases:
+        workflow = reducer_workflow(workflow["reducers"][0]["reducer"], workflow["reducers"][0]["parameter"],
+                                    sources=len(workflow["branches"]))
+        workflow.update(id_=workflow_id, start=workflow["actions"][0]["id_"])
+        u = api_gateway.put(f"{workflows_url}/{workflow_id}", headers=auth_header, data=json.dumps(workflow))
+        assert u.status_code == HTTPStatus.OK
+        assert_reducer_errors(u, expected)
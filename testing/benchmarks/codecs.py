@@ -0,0 +1,60 @@
+"""
+    Serialization benchmark for the stream codecs. Encodes and decodes workflows and action payloads, as the worker
+    reads and writes them, and node status messages with results of increasing size, as apps and the worker place them
+    on the results stream, using JSON and MessagePack.
+
+    Run from the repository root with: python -m testing.benchmarks.codecs
+"""
+import argparse
+import timeit
+
+from common.codecs import CODECS, msgpack
+from common.message_types import (NodeStatusMessage, MessageJSONEncoder, MessageJSONDecoder, MESSAGE_TYPE_TAGS,
+                                  MESSAGE_CONSTRUCTORS)
+from common.workflow_types import (WorkflowJSONEncoder, WorkflowJSONDecoder, WORKFLOW_TYPE_TAGS, WORKFLOW_CONSTRUCTORS,
+                                   workflow_loads)
+from testing.benchmarks.compression import workflow_json, scan_result
+
+WORKFLOW_TYPES = (WorkflowJSONEncoder, WorkflowJSONDecoder, WORKFLOW_TYPE_TAGS, WORKFLOW_CONSTRUCTORS)
+MESSAGE_TYPES = (MessageJSONEncoder, MessageJSONDecoder, MESSAGE_TYPE_TAGS, MESSAGE_CONSTRUCTORS)
+
+
+def measure(obj, types, codec, iterations):
+    encoder, decoder, type_tags, constructors = types
+    encoded = codec.dumps(obj, encoder, type_tags)
+    data = encoded.encode() if isinstance(encoded, str) else encoded
+    dumps_time = timeit.timeit(lambda: codec.dumps(obj, encoder, type_tags), number=iterations)
+    loads_time = timeit.timeit(lambda: codec.loads(data, decoder, constructors), number=iterations)
+    return len(data), dumps_time / iterations * 1e6, loads_time / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    codecs = [CODECS["json"]] + ([CODECS["msgpack"]] if msgpack is not None else [])
+
+    samples = []
+    for n in (5, 50, 250):
+        workflow = workflow_loads(workflow_json(n))
+        samples.append((f"workflow, {n} actions", workflow, WORKFLOW_TYPES))
+    action = workflow.actions[0]
+    action.execution_id = workflow.execution_id
+    samples.append(("action", action, WORKFLOW_TYPES))
+    samples += [(f"status, {n} hosts", NodeStatusMessage.success_from_node(action, workflow.execution_id,
+                                                                         scan_result(n)), MESSAGE_TYPES)
+                for n in (0, 10, 1000)]
+
+    print(f"{'payload':<24}{'codec':<9}{'bytes':>10}{'dumps us':>12}{'loads us':>12}")
+    for name, obj, types in samples:
+        for codec in codecs:
+            size, dumps_us, loads_us = measure(obj, types, codec, args.iterations)
+            print(f"{name:<24}{codec.name:<9}{size:>10}{dumps_us:>12.1f}{loads_us:>12.1f}")
+
+    if msgpack is None:
+        print("msgpack isn't installed, so only json was measured.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+    Size and latency benchmark for stream payload compression. Encodes representative workflows, as they are placed on
+    the workflow queue, and action results of increasing size, as they are placed on the results stream, with each
+    available codec and reports the encoded size and the cost of dumping and loading them.
+
+    Run from the repository root with: python -m testing.benchmarks.compression
+"""
+import argparse
+import json
+import timeit
+import uuid
+
+from common.compression import compress_payload, zstandard
+from common.message_types import NodeStatusMessage, message_dumps, message_loads
+from common.workflow_types import Action, Point, workflow_loads
+
+
+def workflow_json(num_actions):
+    """ A linear workflow of nmap scans, in the form the API gateway queues it """
+    actions = []
+    for i in range(num_actions):
+        parameters = [{"id_": str(uuid.uuid4()), "name": "hosts", "variant": "STATIC_VALUE",
+                       "value": [f"10.0.{i}.{host}" for host in range(16)]},
+                      {"id_": str(uuid.uuid4()), "name": "options", "variant": "STATIC_VALUE",
+                       "value": "-sV -T4 -p 1-1024 --script default,safe"}]
+        actions.append({"id_": str(uuid.uuid4()), "name": "run_scan", "label": f"Scan subnet {i}",
+                        "app_name": "nmap", "app_version": "1.0.0", "priority": 3,
+                        "position": {"x": 120 * i, "y": 80}, "parameters": parameters})
+
+    branches = [{"id_": str(uuid.uuid4()), "source_id": src["id_"], "destination_id": dst["id_"]}
+                for src, dst in zip(actions, actions[1:])]
+
+    return json.dumps({"id_": str(uuid.uuid4()), "execution_id": str(uuid.uuid4()), "name": "benchmark",
+                       "start": actions[0]["id_"], "actions": actions, "branches": branches, "conditions": [],
+                       "transforms": [], "triggers": [], "workflow_variables": [], "is_valid": True})
+
+
+def scan_result(num_hosts):
+    """ An nmap-like XML report, the sort of verbose and repetitive result apps tend to return """
+    hosts = "".join(f'<host><status state="up"/><address addr="10.0.0.{i % 256}" addrtype="ipv4"/><ports>'
+                    f'<port protocol="tcp" portid="22"><state state="open"/><service name="ssh" product="OpenSSH"/>'
+                    f'</port><port protocol="tcp" portid="443"><state state="open"/><service name="https"/></port>'
+                    f'</ports></host>' for i in range(num_hosts))
+    return f'<?xml version="1.0"?><nmaprun scanner="nmap">{hosts}</nmaprun>'
+
+
+def measure(payload, loads, codec, iterations):
+    encoded = compress_payload(payload, codec=codec, threshold=0)
+    data = encoded.encode() if isinstance(encoded, str) else encoded
+    dumps_time = timeit.timeit(lambda: compress_payload(payload, codec=codec, threshold=0), number=iterations)
+    loads_time = timeit.timeit(lambda: loads(data), number=iterations)
+    return len(data), dumps_time / iterations * 1e6, loads_time / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    codecs = ["none", "zlib"] + (["zstd"] if zstandard is not None else [])
+
+    action = Action("run_scan", Point(0, 0), "nmap", "1.0.0", "Scan", 3)
+    samples = [(f"workflow, {n} actions", workflow_json(n), workflow_loads) for n in (5, 50, 250)]
+    samples += [(f"result, {n} hosts", message_dumps(NodeStatusMessage.success_from_node(action, "execution",
+                                                                                         scan_result(n))),
+                 message_loads) for n in (10, 100, 1000)]
+
+    print(f"{'payload':<24}{'codec':<8}{'bytes':>10}{'ratio':>8}{'compress us':>14}{'loads us':>12}")
+    for name, payload, loads in samples:
+        for codec in codecs:
+            size, dumps_us, loads_us = measure(payload, loads, codec, args.iterations)
+            print(f"{name:<24}{codec:<8}{size:>10}{len(payload) / size:>8.1f}{dumps_us:>14.1f}{loads_us:>12.1f}")
+
+    if zstandard is None:
+        print("zstandard isn't installed, so zstd wasn't measured.")
+
+
+if __name__ == "__main__":
+    main()
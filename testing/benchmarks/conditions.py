@@ -0,0 +1,69 @@
+"""
+    Micro-benchmark for Condition evaluation, comparing the pooled interpreter and cached AST against building a fresh
+    asteval Interpreter and re-parsing the conditional on every call, as conditions used to.
+
+    Run from the repository root with: python -m testing.benchmarks.conditions
+"""
+import argparse
+import timeit
+
+from asteval import Interpreter, make_symbol_table
+
+from common.workflow_types import Action, Condition, ConditionException, ParentSymbol, ChildSymbol, Point
+
+CONDITIONAL = """
+if parent.result > 10:
+    selected_node = high
+elif parent.result > 5:
+    selected_node = medium
+else:
+    selected_node = low
+"""
+
+
+def uncached_call(condition, parents, children, accumulator):
+    """ Condition.__call__ as it was before interpreters were pooled and conditionals were cached """
+    parent_symbols = {k: ParentSymbol(accumulator[v.id_]) for k, v in condition.format_node_names(parents).items()}
+    children_symbols = {k: ChildSymbol(v.id_) for k, v in condition.format_node_names(children).items()}
+    syms = make_symbol_table(use_numpy=False, **parent_symbols, **children_symbols)
+    aeval = Interpreter(usersyms=syms, no_for=True, no_while=True, no_try=True, no_functiondef=True, no_ifexp=True,
+                        no_listcomp=True, no_augassign=True, no_assert=True, no_delete=True, no_raise=True,
+                        no_print=True, use_numpy=False, builtins_readonly=True,
+                        readonly_symbols=children_symbols.keys())
+
+    aeval(condition.conditional)
+    child_id = getattr(aeval.symtable.get("selected_node", None), "id_", None)
+
+    if len(aeval.error) > 0:
+        raise ConditionException
+
+    return child_id
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    position = Point(0, 0)
+    parent = Action("parent", position, "app", "1.0.0", "parent", 3)
+    children = {child.id_: child for child in (Action(label, position, "app", "1.0.0", label, 3)
+                                                for label in ("high", "medium", "low"))}
+    parents = {parent.id_: parent}
+    accumulator = {parent.id_: 7}
+    condition = Condition("condition", position, "builtin", "1.0.0", "condition", CONDITIONAL)
+
+    assert condition(parents, children, accumulator) == uncached_call(condition, parents, children, accumulator)
+
+    uncached = timeit.timeit(lambda: uncached_call(condition, parents, children, accumulator),
+                             number=args.iterations)
+    cached = timeit.timeit(lambda: condition(parents, children, accumulator), number=args.iterations)
+
+    print(f"{args.iterations} evaluations")
+    print(f"fresh interpreter:  {uncached / args.iterations * 1e6:10.1f} us/call")
+    print(f"pooled interpreter: {cached / args.iterations * 1e6:10.1f} us/call")
+    print(f"speedup:            {uncached / cached:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
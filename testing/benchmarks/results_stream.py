@@ -0,0 +1,76 @@
+"""
+    Benchmark for consuming a worker's results stream, reporting messages per second when each message is read, acked
+    and deleted on its own versus reading batches and acking and deleting each batch with a single xack_del.
+
+    Needs a running Redis. Run from the repository root with:
+    python -m testing.benchmarks.results_stream --redis-uri redis://localhost:6379
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+import aioredis
+
+from common.config import config
+from common.redis_helpers import xdel, xack_del
+
+GROUP = "benchmark-group"
+CONSUMER = "benchmark-consumer"
+
+
+async def fill_stream(redis, stream, messages, payload):
+    await redis.delete(stream)
+    await redis.xgroup_create(stream, GROUP, mkstream=True)
+    pipe = redis.pipeline()
+    for _ in range(messages):
+        pipe.xadd(stream, {"execution_id": payload})
+    await pipe.execute()
+
+
+async def consume_one_at_a_time(redis, stream, messages):
+    for _ in range(messages):
+        msg = await redis.xread_group(GROUP, CONSUMER, streams=[stream], count=1, latest_ids=['>'])
+        _, id_, _ = msg[0]
+        await redis.xack(stream=stream, group_name=GROUP, id=id_)
+        await xdel(redis, stream=stream, id_=id_)
+
+
+async def consume_in_batches(redis, stream, messages, batch_size):
+    consumed = 0
+    while consumed < messages:
+        msgs = await redis.xread_group(GROUP, CONSUMER, streams=[stream], count=batch_size, latest_ids=['>'])
+        ids = [id_ for _, id_, _ in msgs]
+        await xack_del(redis, stream, GROUP, *ids)
+        consumed += len(ids)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--redis-uri", default=config.REDIS_URI)
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--batch-size", type=int, default=config.get_int("RESULTS_BATCH_SIZE", 100))
+    parser.add_argument("--payload-size", type=int, default=512)
+    args = parser.parse_args()
+
+    redis = await aioredis.create_redis_pool(args.redis_uri)
+    stream = f"benchmark-{uuid.uuid4()}:results"
+    payload = "x" * args.payload_size
+
+    try:
+        for name, consume in (("one at a time", lambda: consume_one_at_a_time(redis, stream, args.messages)),
+                              (f"batches of {args.batch_size}",
+                               lambda: consume_in_batches(redis, stream, args.messages, args.batch_size))):
+            await fill_stream(redis, stream, args.messages, payload)
+            start = time.perf_counter()
+            await consume()
+            elapsed = time.perf_counter() - start
+            print(f"{name:>20}: {args.messages / elapsed:12.0f} messages/s")
+    finally:
+        await redis.delete(stream)
+        redis.close()
+        await redis.wait_closed()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+"""
+    Simulation of worker scaling under bursty workflow arrivals, comparing workers which exit after WORKER_TIMEOUT
+    seconds without work, so that each burst waits on containers cold starting, against a warm pool of workers sized
+    for the recent demand. Reports the p50 and p99 time from a workflow being queued to a worker picking it up, which
+    is when its first action is scheduled, along with the average number of workers kept running.
+
+    This is a model, not a measurement: no containers or Redis are involved, every worker takes a fixed --cold-start
+    seconds to become ready and every workflow holds its worker for a fixed --duration. The figures only compare the two
+    scaling policies under those assumptions; real cold starts vary with the image, the host and the swarm scheduler.
+
+    Run from the repository root with: python -m testing.benchmarks.worker_pool
+"""
+import argparse
+import math
+import random
+import statistics
+
+
+def arrivals(args, rng):
+    """ Bursts of workflows, as when a trigger or schedule fires, separated by exponentially distributed quiet gaps """
+    now = 0.0
+    times = []
+    for _ in range(args.bursts):
+        now += rng.expovariate(1 / args.mean_gap)
+        times += sorted(now + rng.uniform(0, args.burst_spread) for _ in range(rng.randint(1, args.burst_size)))
+    return times
+
+
+def simulate(args, queued, warm_pool):
+    """ Steps through the arrivals with the umpire scaling workers every heartbeat, returning each workflow's wait """
+    queued = list(queued)
+    waiting, waits, workers, demand = [], [], [], []
+    retirements, worker_time, tick = 0, 0.0, 0.1
+    end = queued[-1] + args.duration + args.timeout
+    heartbeat = max(round(args.heartbeat / tick), 1)
+
+    for step in range(math.ceil(end / tick)):
+        now = step * tick
+        while queued and queued[0] <= now:
+            waiting.append(queued.pop(0))
+
+        for worker in workers:
+            if worker["ready"] <= now and worker["busy"] <= now and waiting:
+                waits.append(now - waiting.pop(0))
+                worker["busy"] = worker["idle"] = now + args.duration
+
+        # Idle workers notice the empty queue each time their read times out
+        remaining = []
+        for worker in workers:
+            idle = worker["ready"] <= now and worker["busy"] <= now
+            timed_out = idle and now - worker["idle"] >= args.timeout
+            if timed_out and not warm_pool:
+                continue
+            if timed_out and retirements > 0:
+                retirements -= 1
+                continue
+            if timed_out:
+                worker["idle"] = now
+            remaining.append(worker)
+        workers = remaining
+
+        if step % heartbeat == 0:
+            needed = len(waiting) + sum(worker["busy"] > now for worker in workers)
+            if warm_pool:
+                demand = [(t, n) for t, n in demand if t >= now - args.window] + [(now, needed)]
+                needed = min(max(n for _, n in demand) + args.min_idle, args.max_workers)
+                retirements = max(sum(worker["ready"] <= now for worker in workers) - needed, 0)
+            needed = min(needed, args.max_workers)
+            workers += [{"ready": now + args.cold_start, "busy": 0, "idle": now + args.cold_start}
+                        for _ in range(needed - len(workers))]
+
+        worker_time += len(workers) * tick
+
+    return waits, worker_time / end
+
+
+def percentile(values, p):
+    return sorted(values)[min(int(len(values) * p), len(values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bursts", type=int, default=500)
+    parser.add_argument("--burst-size", type=int, default=8, help="most workflows in a burst")
+    parser.add_argument("--burst-spread", type=float, default=5, help="seconds over which a burst arrives")
+    parser.add_argument("--mean-gap", type=float, default=120, help="mean seconds between bursts")
+    parser.add_argument("--duration", type=float, default=10, help="seconds a workflow holds its worker")
+    parser.add_argument("--cold-start", type=float, default=8, help="seconds for a worker container to start")
+    parser.add_argument("--timeout", type=float, default=30, help="WORKER_TIMEOUT")
+    parser.add_argument("--heartbeat", type=float, default=1, help="UMPIRE_HEARTBEAT")
+    parser.add_argument("--window", type=float, default=300, help="seconds of demand the warm pool is sized for")
+    parser.add_argument("--min-idle", type=int, default=1, help="WORKER_MIN_IDLE")
+    parser.add_argument("--max-workers", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    queued = arrivals(args, random.Random(args.seed))
+
+    print(f"Modelled with a fixed {args.cold_start:g}s cold start and {args.duration:g}s workflows")
+    print(f"{'policy':<14}{'workflows':>11}{'p50 s':>9}{'p99 s':>9}{'mean s':>9}{'workers':>10}")
+    for name, warm_pool in (("exit on idle", False), ("warm pool", True)):
+        waits, workers = simulate(args, queued, warm_pool)
+        print(f"{name:<14}{len(waits):>11}{percentile(waits, 0.5):>9.2f}{percentile(waits, 0.99):>9.2f}"
+              f"{statistics.mean(waits):>9.2f}{workers:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
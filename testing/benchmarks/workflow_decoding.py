@@ -0,0 +1,54 @@
+"""
+    Micro-benchmark for decoding workflow types, comparing the schema directed decoders used when the type of a payload
+    is known against the WorkflowJSONDecoder object_hook, which inspects every dict for its type. Covers the action
+    payloads apps decode for every action they run and the workflows workers decode for every execution. The last row
+    compares sniffing an action's JSON against decoding the msgpack record action streams carry by default.
+
+    Run from the repository root with: python -m testing.benchmarks.workflow_decoding
+"""
+import argparse
+import timeit
+
+from common.codecs import CODECS, MsgPackCodec, msgpack
+from common.workflow_types import (Action, Workflow, Parameter, ParameterVariant, Point, WorkflowJSONEncoder,
+                                   WORKFLOW_TYPE_TAGS, action_record, workflow_loads)
+from testing.benchmarks.compression import workflow_json
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+
+    codecs = [CODECS["json"]] + ([CODECS["msgpack"]] if msgpack is not None else [])
+
+    action = Action("run_scan", Point(120, 80), "nmap", "1.0.0", "Scan subnet", 3, execution_id="execution",
+                    parameters=[Parameter("hosts", value="10.0.0.0/24", variant=ParameterVariant.STATIC_VALUE),
+                                Parameter("ports", value="22,80,443", variant=ParameterVariant.STATIC_VALUE)])
+    samples = [("action", action, Action, args.iterations)]
+    samples += [(f"workflow, {n} actions", workflow_loads(workflow_json(n)), Workflow, max(args.iterations // n, 10))
+                for n in (5, 50)]
+
+    print(f"{'payload':<22}{'codec':<9}{'sniffing us':>13}{'directed us':>13}{'speedup':>9}")
+    for name, obj, type_, iterations in samples:
+        for codec in codecs:
+            payload = codec.dumps(obj, WorkflowJSONEncoder, WORKFLOW_TYPE_TAGS)
+            payload = payload.encode() if isinstance(payload, str) else payload
+
+            sniffing = min(timeit.repeat(lambda: workflow_loads(payload), number=iterations, repeat=5))
+            directed = min(timeit.repeat(lambda: workflow_loads(payload, type_), number=iterations, repeat=5))
+            print(f"{name:<22}{codec.name:<9}{sniffing / iterations * 1e6:>13.1f}{directed / iterations * 1e6:>13.1f}"
+                  f"{sniffing / directed:>8.1f}x")
+
+    # Action streams pack actions as msgpack records, which are compared against sniffing the same action as JSON
+    if msgpack is not None:
+        payload = CODECS["json"].dumps(action, WorkflowJSONEncoder, WORKFLOW_TYPE_TAGS).encode()
+        record = MsgPackCodec.pack(action_record(action))
+        sniffing = min(timeit.repeat(lambda: workflow_loads(payload), number=args.iterations, repeat=5))
+        directed = min(timeit.repeat(lambda: workflow_loads(record, Action), number=args.iterations, repeat=5))
+        print(f"{'action record':<22}{'msgpack':<9}{sniffing / args.iterations * 1e6:>13.1f}"
+              f"{directed / args.iterations * 1e6:>13.1f}{sniffing / directed:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
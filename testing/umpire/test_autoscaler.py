@@ -0,0 +1,104 @@
+import birdisle.aioredis
+import pytest
+import pytest_asyncio
+
+from common.config import config
+from umpire.autoscaler import Autoscaler
+
+
+@pytest.fixture
+def autoscaler(monkeypatch):
+    monkeypatch.setattr(config, "AUTOSCALE_EWMA_ALPHA", "0.5")
+    monkeypatch.setattr(config, "AUTOSCALE_TARGET_UTILIZATION", "1")
+    monkeypatch.setattr(config, "AUTOSCALE_DRAIN_TIME", "10")
+    monkeypatch.setattr(config, "AUTOSCALE_HYSTERESIS", "0.25")
+    monkeypatch.setattr(config, "AUTOSCALE_UP_COOLDOWN", "5")
+    monkeypatch.setattr(config, "AUTOSCALE_DOWN_COOLDOWN", "60")
+    yield Autoscaler()
+
+
+@pytest_asyncio.fixture
+async def redis():
+    server = birdisle.Server()
+    redis = await birdisle.aioredis.create_redis(server)
+    yield redis
+    redis.close()
+    await redis.wait_closed()
+    server.close()
+
+
+#test that arrival rates and service times are smoothed from the autoscaler's counters
+def test_autoscaler_load(autoscaler):
+    autoscaler.update_loads({"nmap:1.0.0": "10"}, {}, now=0)
+    load = autoscaler.loads["nmap:1.0.0"]
+    assert load.arrival_rate == 0 and load.service_time is None
+
+    autoscaler.update_loads({"nmap:1.0.0": "30"}, {"nmap:1.0.0:count": "4", "nmap:1.0.0:seconds": "8"}, now=10)
+    assert load.arrival_rate == 1.0
+    assert load.service_time == 2.0
+
+    autoscaler.update_loads({"nmap:1.0.0": "30"}, {"nmap:1.0.0:count": "6", "nmap:1.0.0:seconds": "20"}, now=20)
+    assert load.arrival_rate == 0.5
+    assert load.service_time == 4.0
+
+
+#test that services scale up promptly, but only scale down well after a change and by more than the hysteresis band
+def test_autoscaler_decisions(autoscaler):
+    # Until a service has completed any work, it's scaled to the depth of its queue
+    decision = autoscaler.decide("worker", queued=3, executing=1, running=0, max_replicas=10, now=0)
+    assert (decision.action, decision.replicas, decision.reason) == ("up", 4, "queue depth")
+
+    load = autoscaler.loads["worker"]
+    load.arrival_rate, load.service_time = 2.0, 3.0
+    decision = autoscaler.decide("worker", queued=10, executing=4, running=4, max_replicas=10, now=1)
+    assert (decision.action, decision.replicas, decision.reason) == ("hold", 4, "up cooldown")
+
+    decision = autoscaler.decide("worker", queued=10, executing=4, running=4, max_replicas=10, now=6)
+    assert (decision.action, decision.replicas, decision.reason) == ("up", 9, "arrival rate")
+
+    # A small drop in load is absorbed by the hysteresis band, a large one waits out the cooldown
+    decision = autoscaler.decide("worker", queued=0, executing=7, running=9, max_replicas=10, now=100)
+    assert (decision.action, decision.replicas, decision.reason) == ("hold", 9, "hysteresis")
+
+    load.arrival_rate = 0.5
+    decision = autoscaler.decide("worker", queued=0, executing=1, running=9, max_replicas=10, now=30)
+    assert (decision.action, decision.replicas, decision.reason) == ("hold", 9, "down cooldown")
+
+    decision = autoscaler.decide("worker", queued=0, executing=1, running=9, spare=1, max_replicas=10, now=100)
+    assert (decision.action, decision.previous, decision.replicas) == ("down", 9, 3)
+
+    decision = autoscaler.decide("worker", queued=0, executing=0, running=3, min_replicas=5, max_replicas=10, now=101)
+    assert (decision.action, decision.replicas, decision.reason) == ("up", 5, "min replicas")
+
+    decision = autoscaler.decide("worker", queued=100, executing=0, running=5, max_replicas=10, now=200)
+    assert (decision.action, decision.replicas, decision.reason) == ("up", 10, "max replicas")
+    assert set(autoscaler.decisions) == {"worker"}
+
+
+#test that retirements are only handed out for the replicas the target drops by, even before retired replicas exit
+@pytest.mark.asyncio
+async def test_autoscaler_retirements(autoscaler, redis):
+    autoscaler.redis = redis
+    key = config.REDIS_WORKER_RETIREMENTS
+
+    # The umpire found more replicas running than are needed when it started
+    decision = autoscaler.decide("worker", queued=0, executing=2, running=5, max_replicas=10, now=0)
+    await autoscaler.issue_retirements(key, decision)
+    assert await redis.get(key) == b"3"
+
+    # Replicas which took a retirement are counted as running until they exit, which mustn't hand out more
+    await redis.decrby(key, 2)
+    decision = autoscaler.decide("worker", queued=0, executing=2, running=5, max_replicas=10, now=1)
+    await autoscaler.issue_retirements(key, decision)
+    assert decision.action == "hold" and await redis.get(key) == b"1"
+
+    load = autoscaler.loads["worker"]
+    load.target = 8
+    decision = autoscaler.decide("worker", queued=0, executing=2, running=6, max_replicas=10, now=100)
+    await autoscaler.issue_retirements(key, decision)
+    assert (decision.action, decision.replicas) == ("down", 2)
+    assert await redis.get(key) == b"5"
+
+    decision = autoscaler.decide("worker", queued=5, executing=2, running=3, max_replicas=10, now=200)
+    await autoscaler.issue_retirements(key, decision)
+    assert decision.action == "up" and await redis.get(key) == b"0"
@@ -0,0 +1,69 @@
+from types import SimpleNamespace
+
+import birdisle.aioredis
+import pytest
+import pytest_asyncio
+
+from common.config import config
+from common.docker_helpers import app_concurrency
+from common.redis_helpers import app_streams_key, execution_streams_key
+from umpire import umpire
+from umpire.umpire import Umpire
+
+
+@pytest_asyncio.fixture
+async def redis():
+    server = birdisle.Server()
+    redis = await birdisle.aioredis.create_redis(server)
+    yield redis
+    redis.close()
+    await redis.wait_closed()
+    server.close()
+
+
+#test that workflows claimed by workers which no longer exist are put back in the workflow queue
+@pytest.mark.asyncio
+async def test_check_pending_workflows(redis, monkeypatch):
+    queue, group = config.REDIS_WORKFLOW_QUEUE, config.REDIS_WORKFLOW_GROUP
+    await redis.xgroup_create(queue, group, mkstream=True)
+    for execution_id in ("first", "second", "third"):
+        await redis.xadd(queue, {execution_id: "workflow"})
+        stream = f"{execution_id}:hello_world:1.0.0"
+        await redis.xgroup_create(stream, "hello_world:1.0.0", mkstream=True)
+        await redis.sadd(app_streams_key("hello_world", "1.0.0"), stream)
+        await redis.sadd(execution_streams_key(execution_id), stream)
+    await redis.xread_group(group, "alive", streams=[queue], latest_ids=[">"], count=1)
+    await redis.xread_group(group, "dead", streams=[queue], latest_ids=[">"], count=2)
+
+    async def get_containers(docker_client, service, short_ids=False):
+        assert service == "worker" and short_ids
+        return {"alive"}
+
+    monkeypatch.setattr(umpire, "get_containers", get_containers)
+    await Umpire(redis=redis).check_pending_workflows()
+
+    pending = await redis.xpending(queue, group)
+    assert pending[0] == 1 and pending[-1] == [[b"alive", b"1"]]
+    assert b"dead" not in [consumer[b"name"] for consumer in await redis.xinfo_consumers(queue, group)]
+
+    # The streams the dead worker left behind are gone, while the live worker's are untouched
+    indexed = await redis.smembers(app_streams_key("hello_world", "1.0.0"), encoding="utf-8")
+    assert indexed == ["first:hello_world:1.0.0"]
+    assert await redis.exists("first:hello_world:1.0.0", execution_streams_key("first")) == 2
+    assert await redis.exists("second:hello_world:1.0.0", execution_streams_key("second")) == 0
+
+    # The dead worker's workflows are read again by the next worker, and nothing else is left in the queue
+    messages = await redis.xread_group(group, "next", streams=[queue], latest_ids=[">"], count=10)
+    assert sorted(list(fields)[0] for _, _, fields in messages) == [b"second", b"third"]
+    assert await redis.xlen(queue) == 3
+
+
+#test that an app's concurrency is read from its deploy labels, falling back to its environment
+def test_app_concurrency():
+    def service(labels=None, environment=None):
+        return SimpleNamespace(options={"deploy": {"labels": labels or {}}, "environment": environment})
+
+    assert app_concurrency(service()) == 1
+    assert app_concurrency(service(environment={"APP_CONCURRENCY": "4"})) == 4
+    assert app_concurrency(service(["walkoff.concurrency=10"], {"APP_CONCURRENCY": "4"})) == 10
+    assert app_concurrency(service({"walkoff.concurrency": "0"})) == 1
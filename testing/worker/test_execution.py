@@ -0,0 +1,574 @@
+import asyncio
+import json
+import logging
+import time
+
+import aiohttp
+import pytest
+import pytest_asyncio
+
+from worker.worker import Worker, GlobalsCache
+
+from common.codecs import CODECS, codec_for, action_stream_codec
+from common.compression import compress_payload, decompress_payload, ZLIB_HEADER
+from common.config import config
+from common.helpers import StatusBatcher, get_patches
+from common.redis_helpers import (store_result, load_results, result_cache_field, get_result_cache_ttls,
+                                  execution_plan_key, app_streams_key, app_stream_announcements_key,
+                                  execution_streams_key, cache_result, get_cached_result)
+from common.workflow_types import (Action, Condition, Transform, Parameter, ParameterVariant, Branch, Workflow,
+                                   ExecutionPlan, Point, Reducer, ConditionException, interpreter_pool, workflow_dumps,
+                                   workflow_loads, WorkflowJSONEncoder, WorkflowJSONDecoder, WORKFLOW_TYPE_TAGS,
+                                   WORKFLOW_CONSTRUCTORS)
+from common.message_types import (NodeStatusMessage, StatusEnum, JSONPatchOps, MessageJSONEncoder,
+                                  MessageJSONDecoder, MESSAGE_TYPE_TAGS, MESSAGE_CONSTRUCTORS, message_dumps,
+                                  message_loads, find_result_refs)
+
+import birdisle.aioredis
+
+logger = logging.getLogger("TEST EXECUTION")
+
+#####################
+##### FIXTURES ######
+#####################
+@pytest.fixture(scope="module")
+def server():
+    # Embedded Redis servers don't survive being restarted with Lua scripts loaded, so tests share one
+    server = birdisle.Server()
+    yield server
+    server.close()
+
+
+@pytest_asyncio.fixture
+async def redis(server):
+    redis = await birdisle.aioredis.create_redis(server)
+    await redis.flushall()
+    yield redis
+    redis.close()
+    await redis.wait_closed()
+
+
+@pytest_asyncio.fixture
+async def session():
+    session = aiohttp.ClientSession()
+    yield session
+    await session.close()
+
+
+@pytest.fixture
+def wf():
+    """ A diamond of actions, with a transform hanging off one side """
+    start = Action("hello_world", Point(0, 0), "hello_world", "1.0.0", "start", 1)
+    left = Action("pause", Point(-1, 1), "hello_world", "1.0.0", "left", 1,
+                  parameters=[Parameter("seconds", value=1, variant=ParameterVariant.STATIC_VALUE)])
+    right = Action("pause", Point(1, 1), "hello_world", "1.0.0", "right", 1,
+                   parameters=[Parameter("seconds", value=2, variant=ParameterVariant.STATIC_VALUE)])
+    end = Action("repeat_back_to_me", Point(0, 2), "hello_world", "1.0.0", "end", 1,
+                 parameters=[Parameter("call", value=left.id_, variant=ParameterVariant.ACTION_RESULT)])
+    transform = Transform("transform", Point(1, 2), "builtin", "1.0.0", "transform", "get_value_at_index",
+                          parameter=0)
+    branches = [Branch(start, left, None), Branch(start, right, None), Branch(left, end, None),
+                Branch(right, end, None), Branch(right, transform, None)]
+    yield Workflow("diamond", start, [start, left, right, end], [], [], [transform], branches, {},
+                   execution_id="execution")
+
+
+@pytest.fixture
+def worker(session, redis, wf):
+    return Worker(redis=redis, workflow=wf, session=session)
+
+
+#####################
+####### TESTS #######
+#####################
+
+#test that idle workers stay warm until the umpire retires them
+@pytest.mark.asyncio
+async def test_worker_retirement(redis, monkeypatch):
+    monkeypatch.setattr(config, "WORKER_TIMEOUT", "1")
+    monkeypatch.setattr("worker.worker.CONTAINER_ID", "worker")
+    await redis.xgroup_create(config.REDIS_WORKFLOW_QUEUE, config.REDIS_WORKFLOW_GROUP, mkstream=True)
+
+    reads = []
+    xread_group = redis.xread_group
+
+    async def read(*args, **kwargs):
+        reads.append(await xread_group(*args, **kwargs))
+        if len(reads) == 2:
+            await redis.set(config.REDIS_WORKER_RETIREMENTS, 1)
+        return reads[-1]
+
+    monkeypatch.setattr(redis, "xread_group", read)
+    with pytest.raises(SystemExit):
+        async for _ in Worker.get_workflow(redis):
+            assert False
+
+    assert reads == [[], []]
+    assert await redis.get(config.REDIS_WORKER_RETIREMENTS) == b"0"
+
+
+#test event driven readiness of scheduled nodes
+@pytest.mark.asyncio
+async def test_resolve_node_wakes_dependents(worker):
+    node = worker.start_action
+    children = {n.id_: n for n in worker.workflow.successors(node)}
+    worker.register_dependencies(node, {})
+
+    for child in children.values():
+        worker.register_dependencies(child, {node.id_: node})
+        assert not worker.ready_events[child.id_].is_set()
+
+    assert worker.ready_events[node.id_].is_set()
+    worker.resolve_node(node.id_, "Temporary Data")
+
+    for child in children.values():
+        assert worker.pending_parents[child.id_] == 0
+        assert worker.ready_events[child.id_].is_set()
+
+    # resolving the same node twice must not decrement its dependents again
+    worker.resolve_node(node.id_, "New Data")
+    assert worker.accumulator[node.id_] == "New Data"
+    for child in children.values():
+        assert worker.pending_parents[child.id_] == 0
+
+
+#test compiled execution plans
+def test_execution_plan(worker):
+    plan = ExecutionPlan.compile(worker.workflow)
+    start = plan.index[worker.start_action.id_]
+
+    assert plan.order[0] == worker.start_action.id_
+    assert plan.parents[start] == []
+    for i, node_id in enumerate(plan.order):
+        assert all(j < i for j in plan.parents[i])  # parents always come first
+        for j in plan.children[i]:
+            assert i in plan.parents[j] or j == start
+
+    loaded = ExecutionPlan.loads(plan.dumps())
+    assert loaded.order == plan.order
+    assert loaded.descendants == plan.descendants
+    for node_id in plan.order:
+        payload = loaded.payload(node_id, "execution_id")
+        if payload is not None:
+            assert workflow_loads(payload, Action).execution_id == "execution_id"
+
+
+#test that pre-encoded actions decode to the action of the execution, whatever their static parameters hold
+def test_execution_plan_payloads():
+    a = Action("a", Point(0, 0), "nmap", "1.0.0", "a", 3,
+               parameters=[Parameter("target", value="$execution_id", variant=ParameterVariant.STATIC_VALUE)])
+    workflow = Workflow("workflow", a, [a], [], [], [], [], {})
+
+    plan = ExecutionPlan.loads(ExecutionPlan.compile(workflow).dumps())
+    action = workflow_loads(plan.payload(a.id_, "execution_id"), Action)
+    assert action.execution_id == "execution_id"
+    assert action.parameters[0].value == "$execution_id"
+
+    a.execution_id = "execution_id"
+    assert plan.payload(a.id_, "execution_id") == workflow_dumps(a, stream=True)
+
+
+#test that cancelling a branch only touches the nodes that can no longer run
+@pytest.mark.asyncio
+async def test_cancel_subgraph_uses_plan(worker):
+    worker.plan = ExecutionPlan.compile(worker.workflow)
+    worker.live_consumers = {node_id: len(c) for node_id, c in zip(worker.plan.order, worker.plan.consumers)}
+    nodes = [worker.workflow.nodes[node_id] for node_id in worker.plan.order]
+    for node in nodes:
+        worker.in_process[node.id_] = node
+        worker.node_tasks[node.id_] = asyncio.create_task(asyncio.sleep(60))
+
+    await worker.cancel_subgraph(worker.start_action)
+    expected = {worker.start_action.id_, *(worker.plan.order[j] for j in worker.plan.descendants[0])}
+
+    for node in nodes:
+        task = worker.node_tasks[node.id_]
+        assert task.cancelled() == (node.id_ in expected)
+        assert (node.id_ in worker.in_process) == (node.id_ not in expected)
+        task.cancel()
+    assert worker.cancelled == expected
+
+
+#test that nodes which already left in_process are cancelled without reporting them aborted a second time
+@pytest.mark.asyncio
+async def test_cancel_subgraph_reported_nodes(worker):
+    sent = []
+
+    class Batcher:
+        async def send(self, execution_id, message):
+            sent.append(message)
+
+    worker.status_batcher = Batcher()
+    worker.plan = ExecutionPlan.compile(worker.workflow)
+    worker.live_consumers = {node_id: len(c) for node_id, c in zip(worker.plan.order, worker.plan.consumers)}
+    start, left, right, end = worker.workflow.actions
+    for node in worker.workflow.actions:
+        worker.node_tasks[node.id_] = asyncio.create_task(asyncio.sleep(60))
+        if node is not right:
+            worker.in_process[node.id_] = node
+
+    await worker.cancel_subgraph(start)
+    assert all(worker.node_tasks[node.id_].cancelled() for node in (start, left, right))
+    assert [(status.node_id, status.status) for status in sent] == [(start.id_, StatusEnum.ABORTED),
+                                                                     (left.id_, StatusEnum.ABORTED)]
+
+    # Aborted nodes may never have started, so their status is added rather than replaced
+    assert [(patch.op, patch.path) for patch in get_patches(sent[1])] == [
+        (JSONPatchOps.ADD, f"/node_statuses/{left.id_}")]
+    worker.node_tasks[end.id_].cancel()
+
+
+#test that results are dropped once every node which reads them has run or been cancelled
+@pytest.mark.asyncio
+async def test_result_liveness():
+    a = Action("a", Point(0, 0), "nmap", "1.0.0", "a", 3)
+    t = Transform("t", Point(1, 0), "builtin", "1.0.0", "t", "get_value_at_index", parameter=0)
+    b = Action("b", Point(2, 0), "nmap", "1.0.0", "b", 3,
+               parameters=[Parameter("data", value=a.id_, variant=ParameterVariant.ACTION_RESULT)])
+    workflow = Workflow("workflow", a, [a, b], [], [], [t], [Branch(a, t, None), Branch(t, b, None)], {})
+
+    plan = ExecutionPlan.compile(workflow)
+    assert sorted(plan.consumers[plan.index[a.id_]]) == sorted([plan.index[t.id_], plan.index[b.id_]])
+    assert plan.consumers[plan.index[t.id_]] == [] and plan.consumers[plan.index[b.id_]] == []
+    assert ExecutionPlan.loads(plan.dumps()).inputs == plan.inputs
+
+    worker = Worker(workflow=workflow)
+    worker.plan = plan
+    worker.live_consumers = {node_id: len(c) for node_id, c in zip(plan.order, plan.consumers)}
+
+    worker.resolve_node(a.id_, [1, 2, 3])
+    worker.release_inputs(t.id_)
+    assert worker.accumulator[a.id_] == [1, 2, 3]  # b still has to read it
+
+    worker.resolve_node(t.id_, 1)
+    assert t.id_ not in worker.accumulator  # nothing reads the transform's result
+    assert (await worker.dereference_params(b))[0].value == [1, 2, 3]
+    assert b.parameters[0].value == a.id_
+
+    await worker.cancel_subgraph(b)
+    assert worker.accumulator == {}
+    assert a.id_ in worker.resolved and t.id_ in worker.resolved
+
+
+#test that action streams are indexed by their app and execution, and announced to the app's replicas
+@pytest.mark.asyncio
+async def test_provision_stream(worker, redis):
+    stream = "execution:hello_world:1.0.0"
+    await worker.provision_stream(stream, "hello_world", "1.0.0")
+
+    assert await redis.smembers(app_streams_key("hello_world", "1.0.0"), encoding="utf-8") == [stream]
+    assert await redis.smembers(execution_streams_key("execution"), encoding="utf-8") == [stream]
+    announced = await redis.xrange(app_stream_announcements_key("hello_world", "1.0.0"))
+    assert [fields for _, fields in announced] == [{b"stream": stream.encode()}]
+    assert worker.streams == {stream}
+
+
+#test that parallel actions are split into bounded chunks, with a bounded number of shards in flight
+@pytest.mark.asyncio
+async def test_parallel_action_chunks(redis, monkeypatch):
+    node = Action("scan", Point(0, 0), "nmap", "1.0.0", "scan", 3, parallelized=True,
+                  parameters=[Parameter("hosts", value=list(range(10)), variant=ParameterVariant.STATIC_VALUE,
+                                        parallelized=True),
+                              Parameter("options", value="-sV", variant=ParameterVariant.STATIC_VALUE)])
+    workflow = Workflow("workflow", node, [node], [], [], [], [], {}, execution_id="execution")
+    worker = Worker(workflow=workflow, redis=redis)
+    monkeypatch.setattr(config, "PARALLEL_CHUNK_SIZE", "2")
+    monkeypatch.setattr(config, "PARALLEL_MAX_SHARDS", "4")
+    monkeypatch.setattr(config, "PARALLEL_MAX_IN_FLIGHT", "2")
+
+    shards = []
+
+    async def schedule_node(act, parents, children):
+        shards.append(act)
+        assert len(worker.shard_groups) <= 2
+        if len(shards) % 2 == 0:  # complete shards out of order, two at a time
+            worker.resolve_shard(shards[-1].id_, [h * 10 for h in shards[-1].parameters[-1].value])
+            worker.resolve_shard(shards[-2].id_, [h * 10 for h in shards[-2].parameters[-1].value])
+
+    worker.schedule_node = schedule_node
+    await worker.execute_parallel_action(node, node.parameters)
+    worker.resolve_shard(shards[-1].id_, [h * 10 for h in shards[-1].parameters[-1].value])
+
+    assert [act.parameters[-1].value for act in shards] == [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]]
+    assert all(act.parameters[0].value == "-sV" for act in shards)
+    assert worker.accumulator[node.id_] == [h * 10 for h in range(10)]
+    assert worker.shard_groups == {} and worker.shard_results == {}
+
+
+#test that a parallel action which fails is reported as a failure, which cancels the nodes downstream of it
+@pytest.mark.asyncio
+async def test_parallel_action_failure(redis):
+    node = Action("scan", Point(0, 0), "nmap", "1.0.0", "scan", 3, parallelized=True,
+                  parameters=[Parameter("hosts", value=42, variant=ParameterVariant.STATIC_VALUE, parallelized=True)])
+    total = Reducer("Reducer", Point(1, 0), "Builtin", "1.0.0", "total", "sum")
+    workflow = Workflow("workflow", node, [node], [], [], [], [Branch(node, total, None)], {},
+                        execution_id="execution", reducers=[total])
+    worker = Worker(workflow=workflow, redis=redis, status_batcher=StatusBatcher(None, window=60000))
+    worker.plan = ExecutionPlan.compile(workflow)
+    worker.live_consumers = {node_id: len(c) for node_id, c in zip(worker.plan.order, worker.plan.consumers)}
+    worker.in_process = {node.id_: node, total.id_: total}
+    worker.node_tasks[total.id_] = asyncio.create_task(asyncio.sleep(60))
+
+    await worker.schedule_node(node, {}, {})
+    task = worker.node_tasks[node.id_]
+    assert task in worker.scheduling_tasks
+    await task
+
+    statuses = [message_loads(message[b"execution"]) for _, message in await redis.xrange(worker.results_stream)]
+    assert [(s.node_id, s.status) for s in statuses] == [(node.id_, StatusEnum.FAILURE)]
+    assert "TypeError" in statuses[0].result
+
+    await worker.handle_action_result(statuses[0])
+    assert worker.node_tasks[total.id_].cancelled()
+    assert worker.cancelled == {node.id_, total.id_}
+    assert worker.in_process == {}
+
+
+#test that each reducer gives the same result whether items are folded in at once or as they arrive
+def test_reducers():
+    ports = [{"host": "a", "port": 22}, {"host": "b", "port": 22}, {"host": "a", "port": 443},
+             {"host": "a", "port": 22}]
+    cases = [("sum", None, [1, 2, 3], 6),
+             ("count", None, ports, 4),
+             ("concat", None, ports, ports),
+             ("merge", None, [{"a": 1}, {"b": 2}, {"a": 3}], {"a": 3, "b": 2}),
+             ("unique", None, ports, ports[:3]),
+             ("min", None, [3, 1, 2], 1),
+             ("max", None, [3, 1, 2], 3),
+             ("group_by", "host", ports, {"a": [ports[0], ports[2], ports[3]], "b": [ports[1]]})]
+
+    for name, parameter, data, expected in cases:
+        reducer = Reducer("Reducer", Point(0, 0), "Builtin", "1.0.0", name, name, parameter=parameter)
+        assert reducer(data) == expected
+        assert reducer.finish(reducer.update(reducer.update(reducer.start(), data[:1]), data[1:])) == expected
+
+
+#test that reducers downstream of a parallel action are fed its shards and that its results aren't kept for them
+@pytest.mark.asyncio
+async def test_parallel_action_reducers(redis, monkeypatch):
+    node = Action("scan", Point(0, 0), "nmap", "1.0.0", "scan", 3, parallelized=True,
+                  parameters=[Parameter("hosts", value=list(range(10)), variant=ParameterVariant.STATIC_VALUE,
+                                        parallelized=True)])
+    total = Reducer("Reducer", Point(1, 0), "Builtin", "1.0.0", "total", "sum")
+    grouped = Reducer("Reducer", Point(1, 1), "Builtin", "1.0.0", "grouped", "group_by", parameter="host")
+    workflow = Workflow("workflow", node, [node], [], [], [], [Branch(node, total, None), Branch(node, grouped, None)],
+                        {}, execution_id="execution", reducers=[total, grouped])
+    worker = Worker(workflow=workflow, redis=redis)
+    worker.plan = ExecutionPlan.compile(workflow)
+    worker.live_consumers = {node_id: len(c) for node_id, c in zip(worker.plan.order, worker.plan.consumers)}
+    monkeypatch.setattr(config, "PARALLEL_CHUNK_SIZE", "3")
+
+    async def schedule_node(act, parents, children):
+        worker.resolve_shard(act.id_, act.parameters[0].value)
+
+    worker.schedule_node = schedule_node
+    await worker.execute_parallel_action(node, node.parameters)
+
+    assert worker.accumulator[node.id_] is None
+    assert worker.reductions[total.id_] == sum(range(10))
+    assert isinstance(worker.reductions[grouped.id_], TypeError)  # the items aren't dicts
+
+    await worker.execute_reducer(total, node)
+    await worker.execute_reducer(grouped, node)
+    assert worker.reductions == {}
+
+    statuses = [message_loads(message[b"execution"]) for _, message in await redis.xrange(worker.results_stream)]
+    assert [(s.node_id, s.status) for s in statuses] == [(node.id_, StatusEnum.SUCCESS),
+                                                         (total.id_, StatusEnum.SUCCESS),
+                                                         (grouped.id_, StatusEnum.FAILURE)]
+    assert statuses[1].result == sum(range(10))
+
+
+#test that cacheable actions reuse results across executions and that the cache stays within its size
+@pytest.mark.asyncio
+async def test_result_cache(redis, monkeypatch):
+    def cidr_to_array(cidr):
+        return Action("cidr_to_array", Point(0, 0), "ip_addr_utils", "1.0.0", "cidr", 3, execution_id="execution",
+                      parameters=[Parameter("ip_array", value=[cidr], variant=ParameterVariant.STATIC_VALUE)])
+
+    first, second = cidr_to_array("10.0.0.0/31"), cidr_to_array("10.0.0.2/31")
+    workflow = Workflow("workflow", first, [first, second], [], [], [], [], {}, execution_id="execution")
+    worker = Worker(workflow=workflow, redis=redis, status_batcher=StatusBatcher(None, window=60000))
+    monkeypatch.setattr(config, "RESULT_CACHE_SIZE", "1")
+
+    await redis.hset(config.REDIS_RESULT_CACHE_POLICIES, result_cache_field("ip_addr_utils", "1.0.0", "cidr_to_array"),
+                     60)
+    worker.cache_ttls = await get_result_cache_ttls(redis, workflow.actions)
+    assert worker.cache_ttls == {"ip_addr_utils:1.0.0:cidr_to_array": 60}
+
+    assert not await worker.get_cached_action_result(first, first.parameters)
+    await worker.cache_action_result(NodeStatusMessage.success_from_node(first, "execution", ["10.0.0.0", "10.0.0.1"]))
+    hit = cidr_to_array("10.0.0.0/31")
+    assert await worker.get_cached_action_result(hit, hit.parameters)
+
+    statuses = [message_loads(message[b"execution"]) for _, message in await redis.xrange(worker.results_stream)]
+    assert [(s.status, s.result) for s in statuses] == [(StatusEnum.SUCCESS, ["10.0.0.0", "10.0.0.1"])]
+
+    # Caching a second result evicts the first, since the cache only holds one
+    assert not await worker.get_cached_action_result(second, second.parameters)
+    await worker.cache_action_result(NodeStatusMessage.success_from_node(second, "execution", ["10.0.0.2", "10.0.0.3"]))
+    assert not await worker.get_cached_action_result(first, first.parameters)
+
+    stats = await redis.hgetall(f"{config.REDIS_RESULT_CACHE}:stats", encoding="utf-8")
+    assert stats == {"hits": "1", "misses": "3", "evictions": "1"}
+
+
+#test that cached results don't outlive the results they refer to, and expired ones leave the cache's index
+@pytest.mark.asyncio
+async def test_result_cache_expiry(redis, monkeypatch):
+    monkeypatch.setattr(config, "RESULT_INLINE_LIMIT", "10")
+    monkeypatch.setattr(config, "RESULT_STORE_TTL", "30")
+    ref = await store_result(redis, ["10.0.0.0", "10.0.0.1"])
+
+    await cache_result(redis, "referencing", ref, 60)
+    assert 0 < await redis.ttl("referencing") <= 30
+    await redis.delete(find_result_refs(ref)[0])
+    await cache_result(redis, "dangling", ref, 60)
+    assert not await redis.exists("dangling")
+
+    # The referencing result expires, and the next lookup removes it from the index
+    index, expiries = f"{config.REDIS_RESULT_CACHE}:index", f"{config.REDIS_RESULT_CACHE}:expiries"
+    assert await redis.zrange(index, encoding="utf-8") == ["referencing"]
+    await redis.delete("referencing")
+    await redis.zadd(expiries, 0, "referencing")
+    assert await get_cached_result(redis, "referencing") is None
+    assert await redis.zcard(index) == 0 and await redis.zcard(expiries) == 0
+
+
+#test that pooled condition interpreters don't leak symbols between evaluations
+def test_condition_interpreter_reuse():
+    position = Point(0, 0)
+    parent = Action("parent", position, "app", "1.0.0", "parent", 3)
+    high, low = (Action(label, position, "app", "1.0.0", label, 3) for label in ("high", "low"))
+    condition = Condition("condition", position, "builtin", "1.0.0", "condition",
+                          "x = 1\nif parent.result > 5:\n    selected_node = high\nelse:\n    selected_node = low")
+
+    assert condition({parent.id_: parent}, {high.id_: high, low.id_: low}, {parent.id_: 10}) == high.id_
+    assert condition({parent.id_: parent}, {high.id_: high, low.id_: low}, {parent.id_: 0}) == low.id_
+
+    aeval, base_symbols, _ = interpreter_pool.interpreters[-1]
+    assert set(aeval.symtable) == base_symbols
+
+    unknown = Condition("condition", position, "builtin", "1.0.0", "condition", "selected_node = missing")
+    with pytest.raises(ConditionException):
+        unknown({parent.id_: parent}, {high.id_: high}, {parent.id_: 0})
+
+
+#test that large results are passed around by reference and small ones stay inline
+@pytest.mark.asyncio
+async def test_result_claim_check(redis):
+    small = {"hosts": ["10.0.0.1"]}
+    large = "x" * (config.get_int("RESULT_INLINE_LIMIT", 65536) + 1)
+
+    assert await store_result(redis, small) == small
+    ref = await store_result(redis, large)
+    assert ref != large
+    assert await store_result(redis, large) == ref  # content addressed
+
+    assert await load_results(redis, ref) == large
+    assert await load_results(redis, [ref, small]) == [large, small]
+
+    huge = "x" * (config.get_int("RESULT_SIZE_LIMIT", 67108864) + 1)
+    truncated = await store_result(redis, huge)
+    assert isinstance(truncated, str) and len(truncated) < len(huge)
+
+
+
+#test that compressed and plain payloads decode alike and small payloads are left as plain JSON
+def test_payload_compression():
+    payload = json.dumps({"hosts": ["10.0.0.1"] * 1000})
+
+    assert compress_payload(payload, codec="none", threshold=0) == payload
+    assert compress_payload(payload, codec="zlib", threshold=len(payload)) == payload
+
+    compressed = compress_payload(payload, codec="zlib", threshold=0)
+    assert compressed[:1] == ZLIB_HEADER and len(compressed) < len(payload)
+    assert decompress_payload(compressed) == payload.encode()
+    assert decompress_payload(payload.encode()) == payload.encode()
+    assert decompress_payload(payload) == payload
+
+
+#test that stream codecs rebuild workflow types and messages from their type tags
+@pytest.mark.parametrize("codec", ["json", "msgpack"])
+def test_stream_codecs(codec):
+    if codec == "msgpack":
+        pytest.importorskip("msgpack")
+    codec = CODECS[codec]
+
+    action = Action("scan", Point(1, 2), "nmap", "1.0.0", "scan", 3, execution_id="execution",
+                    parameters=[Parameter("hosts", value=["10.0.0.1"], variant=ParameterVariant.STATIC_VALUE)])
+    payload = codec.dumps(action, WorkflowJSONEncoder, WORKFLOW_TYPE_TAGS)
+    payload = payload.encode() if isinstance(payload, str) else payload
+    assert codec_for(payload) is codec
+    assert codec.loads(payload, WorkflowJSONDecoder, WORKFLOW_CONSTRUCTORS) == action
+
+    status = NodeStatusMessage.success_from_node(action, "execution", {"hosts": ["10.0.0.1"]})
+    payload = codec.dumps(status, MessageJSONEncoder, MESSAGE_TYPE_TAGS)
+    decoded = codec.loads(payload, MessageJSONDecoder, MESSAGE_CONSTRUCTORS)
+    assert isinstance(decoded, NodeStatusMessage)
+    assert decoded.status == StatusEnum.SUCCESS and decoded.result == status.result
+
+
+#test that payloads of a known type decode to the same objects as when their type is inferred
+def test_schema_directed_decoding():
+    start = Action("start", Point(0, 0), "nmap", "1.0.0", "start", 3)
+    end = Action("end", Point(1, 0), "nmap", "1.0.0", "end", 3)
+    workflow = Workflow("workflow", start, [start, end], [], [], [], [Branch(start, end, None)], {})
+
+    payload = workflow_dumps(workflow)
+    decoded = workflow_loads(payload, Workflow)
+    assert isinstance(decoded, Workflow) and decoded.actions == workflow_loads(payload).actions
+    assert decoded.start.id_ == start.id_
+    assert [n.id_ for n in decoded.successors(decoded.start)] == [end.id_]
+
+    action = Action("scan", Point(0, 0), "nmap", "1.0.0", "scan", 3, execution_id="execution",
+                    parameters=[Parameter("hosts", value={"x": 1, "y": 2}, variant=ParameterVariant.STATIC_VALUE)])
+    decoded = workflow_loads(workflow_dumps(action), Action)
+    assert decoded == action
+    assert decoded.parameters[0].value == {"x": 1, "y": 2}  # only positions are decoded as Points
+
+    # Actions bound for a stream are packed as records when msgpack is installed
+    payload = workflow_dumps(action, stream=True)
+    assert codec_for(payload) is action_stream_codec
+    assert workflow_loads(payload, Action) == action
+
+
+#test that results are encoded with their message and only checked on their own when that fails
+def test_status_message_results():
+    action = Action("scan", Point(0, 0), "nmap", "1.0.0", "scan", 3)
+
+    status = message_loads(message_dumps(NodeStatusMessage.success_from_node(action, "execution", [1, 2, 3])))
+    assert status.status == StatusEnum.SUCCESS and status.result == [1, 2, 3]
+
+    for stream in (False, True):
+        status = NodeStatusMessage.success_from_node(action, "execution", {1, 2, 3})
+        status = message_loads(message_dumps([status, status], stream=stream))[0]
+        assert status.status == StatusEnum.FAILURE
+        assert "not JSON serializable" in status.result
+
+
+#test that cached globals are served locally until they expire or are invalidated
+@pytest.mark.asyncio
+async def test_globals_cache(session, redis):
+    cache = GlobalsCache(session, redis, ttl=300)
+    cache.globals["global_id"] = "cached global"
+    cache.expirations["global_id"] = time.monotonic() + 300
+
+    assert await cache.get(["global_id"]) == {"global_id": "cached global"}
+
+    cache.invalidate("global_id")
+    assert "global_id" not in cache.globals
+    assert "global_id" not in cache.expirations
+
+
+
+#test that an execution plan which can't be read from the cache is compiled again
+@pytest.mark.asyncio
+async def test_unreadable_execution_plan(worker, redis):
+    worker.workflow.plan_digest = "digest"
+    key = execution_plan_key(worker.workflow.id_, "digest")
+    await redis.set(key, "{not json")
+
+    plan = await worker.get_execution_plan()
+    assert plan.order == ExecutionPlan.compile(worker.workflow).order
+    assert ExecutionPlan.loads(await redis.get(key)).order == plan.order
@@ -12,9 +12,8 @@ from worker.worker import Worker
 
 #from common.message_types import message_dumps, message_loads, NodeStatusMessage, WorkflowStatusMessage, StatusEnum, JSONPatch, JSONPatchOps
 from common.config import config
-from common.helpers import connect_to_redis_pool
+from common.redis_helpers import connect_to_redis_pool
 from common.workflow_types import workflow_load, Node, Action, Condition, Transform, Trigger, ParameterVariant, Workflow, workflow_dumps, workflow_loads, workflow_dump, ConditionException
-from common.workflow_types import WorkflowVariable
 
 from async_generator import yield_, async_generator
 import birdisle.aioredis
@@ -108,6 +107,7 @@ async def test_get_workflow(redis, worker):
     assert (await redis.lpop("workflow-queue")).decode("utf-8") == x
     await redis.lpush("workflow-queue", x)
     assert await redis.lpop("workflows-in-process") == None
+    await redis.set(config.REDIS_WORKER_RETIREMENTS, 1)  # retire once the queue is empty
 
     try:
         async for i in worker.get_workflow(redis):
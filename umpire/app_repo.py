@@ -12,7 +12,7 @@ from compose.cli.command import get_project
 
 from common.config import config
 from common.docker_helpers import get_project
-from common.helpers import get_walkoff_auth_header
+from common.helpers import get_token_manager
 
 logging.basicConfig(level=logging.info, format="{asctime} - {name} - {levelname}:{message}", style='{')
 logger = logging.getLogger("AppRepo")
@@ -35,7 +35,6 @@ class AppRepo:
     def __init__(self, path, session):
         self.path = Path(path)
         self.session = session
-        self.token = None
         self.apps = {}
         self.loaded_apis = {}
 
@@ -53,7 +52,7 @@ class AppRepo:
         while True:
             try:
                 # Do an explicit check to see if we have previously stored the api and update it if so.
-                headers, self.token = await get_walkoff_auth_header(self.session, self.token)
+                headers = await get_token_manager(self.session).get_auth_header()
                 async with self.session.get(url, headers=headers) as resp:
                     if resp.status == 200:
                         results = await resp.json()
@@ -68,7 +67,7 @@ class AppRepo:
     async def store_api(self, api):
         url = f"{config.API_GATEWAY_URI}/api/apps/apis"
         try:
-            headers, self.token = await get_walkoff_auth_header(self.session, self.token)
+            headers = await get_token_manager(self.session).get_auth_header()
             if api.get("name") in self.loaded_apis:
                 async with self.session.put(url + f"/{api['name']}", json=api, headers=headers) as resp:
                     if resp.status == 200:
@@ -107,7 +106,7 @@ class AppRepo:
             return
 
         try:
-            headers, self.token = await get_walkoff_auth_header(self.session, self.token)
+            headers = await get_token_manager(self.session).get_auth_header()
             [await self.session.delete(f"{url}/{api}", headers=headers) for api in unused_apis]
 
         except (asyncio.TimeoutError, aiohttp.ClientConnectionError) as e:
@@ -0,0 +1,180 @@
+import json
+import logging
+import math
+import time
+
+from common.config import config
+
+logger = logging.getLogger("UMPIRE")
+
+
+class ServiceLoad:
+    """ The autoscaler's view of the work arriving at one service, smoothed across heartbeats """
+    __slots__ = ("arrivals", "completed", "busy_seconds", "observed_at", "arrival_rate", "service_time", "target",
+                 "scaled_up_at", "scaled_at")
+
+    def __init__(self):
+        self.arrivals = None
+        self.completed = None
+        self.busy_seconds = None
+        self.observed_at = None
+        self.arrival_rate = 0.0
+        self.service_time = None
+        self.target = None
+        self.scaled_up_at = None
+        self.scaled_at = None
+
+
+class ScalingDecision:
+    """ How many replicas a service should run, and why """
+    __slots__ = ("service", "action", "previous", "replicas", "reason", "arrival_rate", "service_time", "queued",
+                 "executing", "running", "decided_at")
+
+    def __init__(self, service, action, previous, replicas, reason, load, queued, executing, running):
+        self.service = service
+        self.action = action
+        self.previous = previous
+        self.replicas = replicas
+        self.reason = reason
+        self.arrival_rate = load.arrival_rate
+        self.service_time = load.service_time
+        self.queued = queued
+        self.executing = executing
+        self.running = running
+        self.decided_at = time.time()
+
+    def to_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+
+class Autoscaler:
+    """
+        Decides how many replicas each service runs from an EWMA of the rate work arrives at it, an EWMA of how long
+        each piece of work takes and the depth of its queue. Scaling up waits only for AUTOSCALE_UP_COOLDOWN, while
+        scaling down waits for AUTOSCALE_DOWN_COOLDOWN after any change and for the target to fall by more than
+        AUTOSCALE_HYSTERESIS, so that bursty arrivals don't churn replicas. Decisions to scale are appended to an audit
+        log stream and the latest decision for every service is published as metrics.
+    """
+    def __init__(self, redis=None):
+        self.redis = redis
+        self.loads = {}
+        self.decisions = {}
+        self.alpha = min(max(config.get_float("AUTOSCALE_EWMA_ALPHA", 0.1), 0.01), 1)
+        self.utilization = min(max(config.get_float("AUTOSCALE_TARGET_UTILIZATION", 0.8), 0.1), 1)
+        self.drain_time = max(config.get_float("AUTOSCALE_DRAIN_TIME", 30), 1)
+        self.hysteresis = min(max(config.get_float("AUTOSCALE_HYSTERESIS", 0.2), 0), 1)
+        self.up_cooldown = config.get_int("AUTOSCALE_UP_COOLDOWN", 10)
+        self.down_cooldown = config.get_int("AUTOSCALE_DOWN_COOLDOWN", 300)
+
+    async def observe(self):
+        """ Reads the counters of work arriving at and completed by each service and updates their EWMAs """
+        pipe = self.redis.pipeline()
+        pipe.hgetall(config.REDIS_AUTOSCALER_ARRIVALS, encoding="utf-8")
+        pipe.hgetall(config.REDIS_AUTOSCALER_SERVICE_TIMES, encoding="utf-8")
+        arrivals, service_times = await pipe.execute()
+        self.update_loads(arrivals, service_times, time.monotonic())
+
+    def update_loads(self, arrivals, service_times, now):
+        """
+            Folds the arrival and service time counters into each service's EWMAs. The counters only ever grow, so
+            each heartbeat's sample is their difference from the last heartbeat's.
+        """
+        services = {*arrivals, *(field.rsplit(':', 1)[0] for field in service_times)}
+        for service in services:
+            load = self.loads.setdefault(service, ServiceLoad())
+            total = int(arrivals.get(service, 0))
+            completed = int(service_times.get(f"{service}:count", 0))
+            busy_seconds = float(service_times.get(f"{service}:seconds", 0))
+
+            if load.observed_at is not None and now > load.observed_at:
+                rate = max(total - load.arrivals, 0) / (now - load.observed_at)
+                load.arrival_rate += self.alpha * (rate - load.arrival_rate)
+
+                if completed > load.completed:
+                    service_time = (busy_seconds - load.busy_seconds) / (completed - load.completed)
+                    load.service_time = service_time if load.service_time is None else \
+                        load.service_time + self.alpha * (service_time - load.service_time)
+
+            load.arrivals, load.completed, load.busy_seconds, load.observed_at = total, completed, busy_seconds, now
+
+    def decide(self, service, queued, executing, running, concurrency=1, spare=0, min_replicas=0, max_replicas=1,
+               now=None):
+        """
+            Returns how many replicas a service should run. The service needs enough slots to keep up with the work
+            arriving at it, at AUTOSCALE_TARGET_UTILIZATION, and to drain its queue within AUTOSCALE_DRAIN_TIME
+            seconds. Until it has completed any work, it gets a slot for every queued and executing piece of work.
+            Spare replicas are kept on top of those which are needed, and min_replicas are kept regardless.
+        """
+        now = time.monotonic() if now is None else now
+        load = self.loads.setdefault(service, ServiceLoad())
+
+        if load.service_time is None:
+            slots, reason = queued + executing, "queue depth"
+        else:
+            predicted = load.arrival_rate * load.service_time / self.utilization
+            backlog = queued * load.service_time / self.drain_time
+            slots, reason = max(predicted + backlog, executing), "arrival rate" if predicted >= backlog else "backlog"
+
+        needed = math.ceil(round(slots / max(concurrency, 1), 6)) + spare
+        if needed < min_replicas:
+            needed, reason = min_replicas, "min replicas"
+        if needed > max_replicas:
+            needed, reason = max_replicas, "max replicas"
+
+        previous = load.target
+        if previous is None:
+            action, load.target = "up", needed
+        elif needed > previous:
+            if load.scaled_up_at is not None and now - load.scaled_up_at < self.up_cooldown:
+                action, reason = "hold", "up cooldown"
+            else:
+                action, load.target = "up", needed
+        elif needed < previous:
+            if needed > previous * (1 - self.hysteresis):
+                action, reason = "hold", "hysteresis"
+            elif load.scaled_at is not None and now - load.scaled_at < self.down_cooldown:
+                action, reason = "hold", "down cooldown"
+            else:
+                action, load.target = "down", needed
+        else:
+            action = "hold"
+
+        if action == "up":
+            load.scaled_up_at = load.scaled_at = now
+        elif action == "down":
+            load.scaled_at = now
+
+        decision = ScalingDecision(service, action, previous, load.target, reason, load, queued, executing, running)
+        self.decisions[service] = decision
+        return decision
+
+    async def issue_retirements(self, key, decision):
+        """
+            Hands out a retirement for every replica the service has been scaled down by, which idle replicas take and
+            then exit. Retirements are only added when the target falls, as replicas which have taken one are still
+            counted as running until they exit, and they're withdrawn when the target rises again.
+        """
+        if decision.action == "down":
+            retirements = min(decision.previous, decision.running) - decision.replicas
+            if retirements > 0:
+                await self.redis.incrby(key, retirements)
+        elif decision.action == "up":
+            # The first decision after the umpire starts sizes the replicas it found running
+            await self.redis.set(key, max(decision.running - decision.replicas, 0) if decision.previous is None else 0)
+
+    async def publish(self):
+        """ Appends this heartbeat's decisions to scale to the audit log and publishes every service's metrics """
+        if len(self.decisions) < 1:
+            return
+
+        pipe = self.redis.pipeline()
+        for decision in self.decisions.values():
+            if decision.action != "hold":
+                logger.info(f"Scaling {decision.service} {decision.action} from {decision.previous} to "
+                            f"{decision.replicas} replicas ({decision.reason})")
+                pipe.xadd(config.REDIS_AUTOSCALER_LOG, {"decision": json.dumps(decision.to_dict())},
+                          max_len=config.get_int("AUTOSCALE_LOG_LENGTH", 1000), exact_len=False)
+        pipe.hmset_dict(config.REDIS_AUTOSCALER_METRICS,
+                        {service: json.dumps(decision.to_dict()) for service, decision in self.decisions.items()})
+        await pipe.execute()
+        self.decisions = {}
@@ -16,14 +16,16 @@ from docker.types.services import SecretReference
 
 
 from common.config import config
-from common.helpers import send_status_update, UUID_GLOB
-from common.redis_helpers import connect_to_redis_pool, xlen, xdel
+from common.helpers import send_status_update
+from common.redis_helpers import (connect_to_redis_pool, xlen, xack_del, app_streams_key, app_retirements_key,
+                                  app_stream_announcements_key, execution_streams_key)
 from common.message_types import WorkflowStatusMessage
-from common.workflow_types import workflow_loads
+from common.workflow_types import workflow_loads, Workflow
 from common.docker_helpers import (ServiceKwargs, DockerBuildError, docker_context, stream_docker_log, get_containers,
                                    load_secrets, update_service, connect_to_aiodocker, get_service, get_replicas,
-                                   remove_service, get_secret)
+                                   remove_service, get_secret, app_keep_alive, app_concurrency)
 from umpire.app_repo import AppRepo
+from umpire.autoscaler import Autoscaler
 
 logging.basicConfig(level=logging.info, format="{asctime} - {name} - {levelname}:{message}", style='{')
 logger = logging.getLogger("UMPIRE")
@@ -41,6 +43,7 @@ class Umpire:
         self.worker = {}
         self.max_workers = 1
         self.service_replicas = {}
+        self.autoscaler = Autoscaler(redis)
 
     @classmethod
     async def init(cls, docker_client, redis, session):
@@ -80,14 +83,25 @@ class Umpire:
     async def shutdown(self):
         logger.info("Shutting down Umpire...")
 
-        # Clean up redis streams
-        action_queues = set(await self.redis.keys(pattern="*:*", encoding="utf-8")).union({config.REDIS_WORKFLOW_QUEUE})
+        # Clean up redis streams. Every stream is indexed by its app or its execution, so the keyspace isn't scanned.
+        executions = await self.redis.smembers(config.REDIS_EXECUTING_WORKFLOWS, encoding="utf-8")
+        app_versions = [(app_name, version) for app_name, versions in self.app_repo.apps.items()
+                        for version in versions]
+        results_streams = {f"{execution_id}:results" for execution_id in executions}
+        action_queues = {*(await self.get_action_streams()), *results_streams, config.REDIS_WORKFLOW_QUEUE}
         await self.redis.xgroup_destroy(config.REDIS_WORKFLOW_QUEUE, config.REDIS_WORKFLOW_GROUP)
-        [await self.redis.xgroup_destroy(q, config.REDIS_ACTION_RESULTS_GROUP) for q in action_queues]
+        [await self.redis.xgroup_destroy(q, config.REDIS_ACTION_RESULTS_GROUP) for q in action_queues
+         if await self.redis.type(q) == b"stream"]
         mask = [await self.redis.delete(q) for q in action_queues]
         removed_qs = list(compress(action_queues, mask))
         logger.debug(f"Removed redis streams: {removed_qs}")
 
+        indexes = [*(execution_streams_key(execution_id) for execution_id in executions),
+                   *(app_streams_key(app_name, version) for app_name, version in app_versions),
+                   *(app_stream_announcements_key(app_name, version) for app_name, version in app_versions)]
+        if len(indexes) > 0:
+            await self.redis.delete(*indexes)
+
         # Clean up docker services
         services = [*(await self.get_running_apps()).keys(), "worker"]
         mask = [await remove_service(self.docker_client, s) for s in services]
@@ -235,7 +249,10 @@ class Umpire:
             secrets = await load_secrets(self.docker_client, project=self.app_repo.apps[app][version])
             secrets.append(SecretReference(secret_id=encryption_secret_id, secret_name="encryption_key"))
             mode = {"replicated": {'Replicas': replicas}}
-            service_kwargs = ServiceKwargs.configure(image=image_name, service=service, secrets=secrets, mode=mode)
+            env = {**(service.options.get("environment") or {}), "APP_IDLE_TIMEOUT": str(app_keep_alive(service)[0]),
+                   "APP_CONCURRENCY": str(app_concurrency(service))}
+            service_kwargs = ServiceKwargs.configure(image=image_name, service=service, secrets=secrets, mode=mode,
+                                                     env=env)
             await self.docker_client.services.create(name=app_name, **service_kwargs)
             self.running_apps[app_name] = await get_service(self.docker_client, app_name)
 
@@ -319,6 +336,11 @@ class Umpire:
             return
 
     async def scale_worker(self):
+        """
+            Sizes the worker pool as decided by the autoscaler, keeping WORKER_MIN_IDLE warm workers on top of those
+            which are needed, rather than letting every worker exit once the queue is empty. Idle workers beyond that
+            are retired by handing out retirements which they take when they next find the queue empty.
+        """
         total_workflows = await xlen(self.redis, config.REDIS_WORKFLOW_QUEUE)
         executing_workflows = (await self.redis.xpending(config.REDIS_WORKFLOW_QUEUE, config.REDIS_WORKFLOW_GROUP))[0]
         queued_workflows = total_workflows - executing_workflows
@@ -326,64 +348,172 @@ class Umpire:
         logger.debug(f"Queued Workflows: {queued_workflows}")
         logger.debug(f"Executing Workflows: {executing_workflows}")
 
-        current_workers = self.service_replicas.get("worker", {"running": 0, "desired": 0})["desired"]
-        workers_needed = min(total_workflows, self.max_workers)
-        logger.debug(f"Running Workers: {current_workers}")
-
-        if workers_needed > current_workers > 0:
+        replicas = self.service_replicas.get("worker", {"running": 0, "desired": 0})
+        running, desired = replicas["running"], replicas["desired"]
+        decision = self.autoscaler.decide("worker", queued_workflows, executing_workflows, running,
+                                          concurrency=config.get_int("WORKER_CONCURRENCY", 1),
+                                          spare=config.get_int("WORKER_MIN_IDLE", 1), max_replicas=self.max_workers)
+        workers_needed = decision.replicas
+        logger.debug(f"Running Workers: {running}")
+
+        # Exited workers hold on to their slots in the service, so they're dropped before starting new workers
+        if workers_needed > running and (decision.action == "up" or desired <= running):
+            if desired > running:
+                await self.launch_workers(running)
             await self.launch_workers(workers_needed)
-        elif workers_needed > current_workers == 0:  # scale to 0 and restart
-            await self.launch_workers(0)
+        elif running <= workers_needed < desired:  # retired workers have exited
             await self.launch_workers(workers_needed)
 
+        await self.autoscaler.issue_retirements(config.REDIS_WORKER_RETIREMENTS, decision)
+
+    async def get_workflow_consumer(self, execution_id):
+        """ Returns the worker which has claimed the given execution from the workflow queue, if any """
+        executing_workflows = (await self.redis.xpending(config.REDIS_WORKFLOW_QUEUE, config.REDIS_WORKFLOW_GROUP))[0]
+        if executing_workflows < 1:
+            return None
+
+        pending = await self.redis.xpending(config.REDIS_WORKFLOW_QUEUE, config.REDIS_WORKFLOW_GROUP, "-", "+",
+                                            executing_workflows)
+        pipe = self.redis.pipeline()
+        futs = [pipe.xrange(config.REDIS_WORKFLOW_QUEUE, start=id_, stop=id_) for id_, _, _, _ in pending]
+        await pipe.execute()
+
+        for (_, consumer, _, _), fut in zip(pending, futs):
+            messages = await fut
+            if messages and execution_id.encode() in messages[0][1]:
+                return consumer.decode()
+        return None
+
+    async def get_action_streams(self):
+        """ Returns the action streams of every execution, as indexed by the workers, for each known app version """
+        app_versions = [(app_name, version) for app_name, versions in self.app_repo.apps.items()
+                        for version in versions]
+        if len(app_versions) < 1:
+            return set()
+
+        pipe: aioredis.commands.Pipeline = self.redis.pipeline()
+        for app_name, version in app_versions:
+            pipe.smembers(app_streams_key(app_name, version), encoding="utf-8")
+        return set().union(*(await pipe.execute()))
+
     async def scale_app(self):
+        """
+            Scales each app as decided by the autoscaler, keeping at least its min_idle_replicas warm.
+            Replicas beyond that are retired once they've been idle for the app's idle timeout, rather than exiting as
+            soon as there's no work and the whole service being restarted when the next action arrives.
+        """
         self.running_apps = await self.get_running_apps()
         logger.debug(f"Running apps: {[{s: self.service_replicas.get(s)['running']} for s in self.running_apps.keys()]}")
 
-        streams = [key.split(':') for key in await self.redis.keys(pattern=UUID_GLOB + ":*:*", encoding="utf-8")]
+        streams = [key.split(':') for key in await self.get_action_streams()]
 
         workloads = {f"{app_name}:{version}": {"total": 0, "queued": 0, "executing": 0}
                      for _, app_name, version in streams}
 
-        if len(streams) > 0:
-            for execution_id, app_name, version in streams:
-                stream = f"{execution_id}:{app_name}:{version}"
-                group = f"{app_name}:{version}"
-
-                try:
-                    executing_work = (await self.redis.xpending(stream=stream, group_name=group))[0]
-                    total_work = await xlen(self.redis, stream)
-                except aioredis.ReplyError:
-                    continue  # the group or stream got closed while we were checking other streams
-
-                queued_work = total_work - executing_work
-
-                workloads[group]["executing"] += executing_work
-                workloads[group]["queued"] += queued_work
-                workloads[group]["total"] += total_work
+        # Apps without work are still scaled, to keep them warm or to retire their idle replicas
+        workloads.update({f"{app_name}:{version}": {"total": 0, "queued": 0, "executing": 0}
+                          for app_name, versions in self.app_repo.apps.items() for version, project in versions.items()
+                          if f"{app_name}:{version}" not in workloads
+                          and (f"{config.APP_PREFIX}_{app_name}" in self.running_apps
+                               or app_keep_alive(project.services[0])[1] > 0)})
 
-                service_name = f"{config.APP_PREFIX}_{app_name}"
-                curr_replicas = self.service_replicas.get(service_name, {"running": 0, "desired": 0})["desired"]
-                max_replicas = self.app_repo.apps[app_name][version].services[0].options["deploy"]["replicas"]
-                replicas_needed = min(total_work, max_replicas)
+        for execution_id, app_name, version in streams:
+            stream = f"{execution_id}:{app_name}:{version}"
+            group = f"{app_name}:{version}"
 
-                if replicas_needed > curr_replicas > 0:
-                    await self.update_app(app_name, version, replicas_needed)
-                elif replicas_needed > curr_replicas == 0:  # scale to 0 and restart
-                    await self.update_app(app_name, version, 0)
-                    await self.update_app(app_name, version, replicas_needed)
-                else:
-                    continue
+            try:
+                executing_work = (await self.redis.xpending(stream=stream, group_name=group))[0]
+                total_work = await xlen(self.redis, stream)
+            except aioredis.ReplyError:
+                continue  # the group or stream got closed while we were checking other streams
+
+            workloads[group]["executing"] += executing_work
+            workloads[group]["queued"] += total_work - executing_work
+            workloads[group]["total"] += total_work
+
+        for group, workload in workloads.items():
+            app_name, version = group.split(':')
+            service = self.app_repo.apps[app_name][version].services[0]
+            replicas = self.service_replicas.get(f"{config.APP_PREFIX}_{app_name}", {"running": 0, "desired": 0})
+            running, desired = replicas["running"], replicas["desired"]
+            decision = self.autoscaler.decide(group, workload["queued"], workload["executing"], running,
+                                              concurrency=app_concurrency(service),
+                                              min_replicas=app_keep_alive(service)[1],
+                                              max_replicas=service.options["deploy"]["replicas"])
+            replicas_needed = decision.replicas
+
+            logger.debug(f"Queued actions for {group}: {workload['queued']}")
+            logger.debug(f"Executing actions for {group}: {workload['executing']}")
+
+            # Exited replicas hold on to their slots in the service, so they're dropped before starting new replicas
+            if replicas_needed > running and (decision.action == "up" or desired <= running):
+                if desired > running:
+                    await self.update_app(app_name, version, running)
+                await self.update_app(app_name, version, replicas_needed)
+                logger.info(f"Launched {group}")
+            elif running <= replicas_needed < desired:  # retired replicas have exited
+                await self.update_app(app_name, version, replicas_needed)
+
+            # Idle replicas take a retirement once they've been idle for the app's idle timeout, until none are left
+            await self.autoscaler.issue_retirements(app_retirements_key(app_name, version), decision)
+
+    async def check_pending_workflows(self):
+        """
+            Workers only ack a workflow's message once they're done executing it, so the messages of a worker which
+            died are left pending under its name forever, counted as executing. Those messages are claimed and put
+            back in the workflow queue for another worker, along with dropping the streams the dead worker left behind,
+            and the dead worker is dropped from the consumer group.
+        """
+        queue, group = config.REDIS_WORKFLOW_QUEUE, config.REDIS_WORKFLOW_GROUP
+        pending = await self.redis.xpending(queue, group)
+        if pending[0] < 1:
+            return
 
-                logger.info(f"Launched {':'.join([app_name, version])}")
+        containers = await get_containers(self.docker_client, "worker", short_ids=True)
+        for consumer, count in pending[-1]:
+            consumer = consumer.decode()
+            if consumer in containers:
+                continue
 
-            for app_name, workload in workloads.items():
-                logger.debug(f"Queued actions for {app_name}: {workload['queued']}")
-                logger.debug(f"Executing actions for {app_name}: {workload['executing']}")
+            dead_pending = await self.redis.xpending(queue, group, "-", "+", int(count), consumer=consumer)
+            if len(dead_pending) > 0:
+                messages = await self.redis.xclaim(queue, group, "UMPIRE", 0, *[entry[0] for entry in dead_pending])
+                for id_, workflow in messages:
+                    if workflow:
+                        # The streams the dead worker left behind are dropped, and made anew when the workflow is rerun
+                        for execution_id in workflow:
+                            await self.drop_execution_streams(execution_id.decode())
+                            await self.redis.delete(f"{execution_id.decode()}:results")
+                        await self.redis.xadd(queue, workflow)
+                    await xack_del(self.redis, queue, group, id_)
+                logger.info(f"Requeued {len(messages)} workflows claimed by dead worker {consumer}")
+
+            await self.redis.xgroup_delconsumer(queue, group, consumer)
+
+    async def drop_execution_streams(self, execution_id):
+        """
+            Deletes the action streams of an execution, which are indexed under it by its worker, and removes them from
+            their apps' indexes. Returns the apps which had claimed actions from them.
+        """
+        streams = await self.redis.smembers(execution_streams_key(execution_id), encoding="utf-8")
+        apps = set()
+        pipe: aioredis.commands.Pipeline = self.redis.pipeline()
+        for stream in streams:
+            _, app_name, version = stream.split(':')
+            try:
+                executing_apps = (await self.redis.xpending(stream, f"{app_name}:{version}"))[3]
+                apps.update(app.decode() for app, _ in executing_apps or ())
+            except aioredis.ReplyError:
+                pass  # The stream is already gone
+            pipe.srem(app_streams_key(app_name, version), stream)
+            pipe.delete(stream)
+        pipe.delete(execution_streams_key(execution_id))
+        await pipe.execute()
+        return apps
 
     async def check_pending_actions(self):
         self.running_apps = await self.get_running_apps()
-        action_queues = set(await self.redis.keys(pattern=UUID_GLOB + ":*:*", encoding="utf-8"))
+        action_queues = await self.get_action_streams()
         if len(action_queues) > 0:
             for key in action_queues:
                 execution_id, app_name, version = key.split(':')
@@ -412,8 +542,7 @@ class Umpire:
                             await self.redis.xadd(key, {execution_id: action})
 
                             # Clean up workflow-queue
-                            await self.redis.xack(stream=key, group_name=app_group, id=id_)
-                            await xdel(self.redis, stream=key, id_=id_)
+                            await xack_del(self.redis, key, app_group, id_)
 
     async def monitor_queues(self, autoscale_worker, autoscale_app, autoheal_worker, autoheal_apps):
         count = 0
@@ -422,10 +551,16 @@ class Umpire:
             self.service_replicas = {s["Spec"]["Name"]: (await get_replicas(self.docker_client, s["ID"])) for s in
                                      services}
 
+            if autoheal_worker:
+                await self.check_pending_workflows()
+            if autoscale_worker or autoscale_app:
+                await self.autoscaler.observe()
             if autoscale_worker:
                 await self.scale_worker()
             if autoscale_app:
                 await self.scale_app()
+            if autoscale_worker or autoscale_app:
+                await self.autoscaler.publish()
             if autoheal_apps:
                 await self.check_pending_actions()
 
@@ -462,38 +597,29 @@ class Umpire:
             id_ = msg[0][1]
 
             execution_id = msg[0][2][b"execution_id"].decode()
-            workflow = workflow_loads(msg[0][2][b"workflow"])
+            workflow = workflow_loads(msg[0][2][b"workflow"], Workflow)
 
-            executing_workflows = await self.redis.xpending(config.REDIS_WORKFLOW_QUEUE, config.REDIS_WORKFLOW_GROUP)
+            worker_to_abort = await self.get_workflow_consumer(execution_id)
 
-            if executing_workflows[0] < 1:
+            if worker_to_abort is None:
                 status = WorkflowStatusMessage.execution_aborted(execution_id, workflow.id_, workflow.name)
                 await send_status_update(self.session, execution_id, status)
 
             else:
-                # Kill worker
-                worker_to_abort = executing_workflows[3][0][0].decode()
+                # Signal the worker executing this workflow, which aborts whichever of its executions are aborting
                 container = await self.docker_client.containers.get(worker_to_abort)
                 await container.kill(signal="SIGQUIT")
 
-                # Kill apps
-                action_streams = await self.redis.keys(f"{execution_id}:*:*", encoding="utf-8")
-
-                for stream in action_streams:
-                    _, app_name, version = stream.split(':')
-                    app_group = f"{app_name}:{version}"
-                    executing_apps = (await self.redis.xpending(stream, app_group))[3]
-
-                    if executing_apps is None:
-                        break
-
-                    for app, _ in executing_apps:
-                        container = await self.docker_client.containers.get(app.decode())
-                        await container.kill(signal="SIGKILL")
-                    await self.redis.delete(stream)
+                # Signal the apps executing its actions, which cancel only the actions of aborting executions
+                apps_to_abort = await self.drop_execution_streams(execution_id)
+                for app in apps_to_abort:
+                    try:
+                        container = await self.docker_client.containers.get(app)
+                        await container.kill(signal="SIGQUIT")
+                    except DockerError:
+                        logger.exception(f"Could not signal app {app} to abort execution {execution_id}")
                 await self.redis.delete(f"{execution_id}:results")
-            await self.redis.xack(stream=stream, group_name=config.REDIS_WORKFLOW_CONTROL_GROUP, id=id_)
-            await xdel(self.redis, stream=stream, id_=id_)
+            await xack_del(self.redis, stream, config.REDIS_WORKFLOW_CONTROL_GROUP, id_)
 
 
 if __name__ == "__main__":
@@ -1,20 +1,26 @@
 import asyncio
 import logging
+import math
 import sys
 import os
 import signal
-from collections import deque
-from inspect import getcoroutinelocals
+import time
 
 import aiohttp
 import aioredis
 
-from common.message_types import message_dumps, message_loads, NodeStatusMessage, WorkflowStatusMessage, StatusEnum
+from common.compression import compress_payload
+from common.message_types import (message_dumps, message_loads, NodeStatusMessage, WorkflowStatusMessage, StatusEnum,
+                                  elapsed_seconds)
 from common.config import config
-from common.helpers import get_walkoff_auth_header, send_status_update
-from common.redis_helpers import connect_to_redis_pool, xdel, deref_stream_message
-from common.workflow_types import (Node, Action, Condition, Transform, Parameter, Trigger,
-                                   ParameterVariant, Workflow, workflow_dumps, workflow_loads, ConditionException)
+from common.helpers import get_token_manager, StatusBatcher
+from common.redis_helpers import (connect_to_redis_pool, xack_del, deref_stream_message, app_streams_key,
+                                  app_stream_announcements_key, execution_streams_key, execution_plan_key,
+                                  store_result, load_results, result_cache_field, result_cache_key,
+                                  get_result_cache_ttls, get_cached_result, cache_result, take_token,
+                                  record_service_time)
+from common.workflow_types import (Node, Action, Condition, Transform, Reducer, Parameter, Trigger, ParameterVariant,
+                                   Workflow, ExecutionPlan, workflow_dumps, workflow_loads, ConditionException)
 
 logging.basicConfig(level=logging.INFO, format="{asctime} - {name} - {levelname}:{message}", style='{')
 logger = logging.getLogger("WORKER")
@@ -24,14 +30,64 @@ logger = logging.getLogger("WORKER")
 CONTAINER_ID = os.getenv("HOSTNAME")
 
 
+class GlobalsCache:
+    """
+        Caches the globals referenced by actions for the lifetime of the worker process. Only globals which are missing
+        or older than GLOBALS_CACHE_TTL seconds are fetched, and the api_gateway announces updated or deleted globals
+        on a Redis channel so they can be dropped right away.
+    """
+    def __init__(self, session: aiohttp.ClientSession = None, redis: aioredis.Redis = None, ttl=None):
+        self.session = session
+        self.redis = redis
+        self.ttl = ttl if ttl is not None else config.get_int("GLOBALS_CACHE_TTL", 300)
+        self.globals = {}
+        self.expirations = {}
+
+    async def get(self, ids):
+        now = time.monotonic()
+        missing = {id_ for id_ in ids if self.expirations.get(id_, 0) <= now}
+
+        if len(missing) > 0:
+            url = config.API_GATEWAY_URI.rstrip('/') + '/api'
+            headers = await get_token_manager(self.session).get_auth_header()
+            # saving decryption for app-level
+            payload = {'ids': ','.join(missing), 'to_decrypt': 'false'}
+            async with self.session.get(url + "/globals/batch", headers=headers, params=payload) as resp:
+                globals_ = await resp.json(loads=workflow_loads)
+                logger.debug(f"Got globals: {globals_}")
+
+            for global_ in globals_:
+                self.globals[global_.id_] = global_
+                self.expirations[global_.id_] = now + self.ttl
+
+        return {id_: self.globals[id_] for id_ in ids if id_ in self.globals}
+
+    def invalidate(self, id_):
+        self.globals.pop(id_, None)
+        self.expirations.pop(id_, None)
+
+    async def listen(self):
+        """ Drops globals from the cache as the api_gateway announces changes to them """
+        channel, = await self.redis.subscribe(config.REDIS_GLOBALS_CHANNEL)
+        try:
+            async for id_ in channel.iter(encoding="utf-8"):
+                logger.debug(f"Global {id_} changed, removing it from the cache")
+                self.invalidate(id_)
+        finally:
+            await self.redis.unsubscribe(config.REDIS_GLOBALS_CHANNEL)
+
+
 class Worker:
     def __init__(self, workflow: Workflow = None, start_action: str = None, redis: aioredis.Redis = None,
-                 session: aiohttp.ClientSession = None):
+                 session: aiohttp.ClientSession = None, status_batcher: StatusBatcher = None,
+                 globals_cache: GlobalsCache = None):
         self.workflow = workflow
         self.start_action = start_action if start_action is not None else self.workflow.start
         self.results_stream = f"{workflow.execution_id}:results"
-        self.parallel_accumulator = {}
         self.accumulator = {}
+        self.resolved = set()
+        self.live_consumers = {}
+        self.released = set()
         self.parallel_in_process = {}
         self.in_process = {}
         self.redis = redis
@@ -42,15 +98,30 @@ class Worker:
         self.workflow_tasks = set()
         self.execution_task = None
         self.session = session
-        self.token = None
+        self.status_batcher = status_batcher if status_batcher is not None else StatusBatcher(session)
+        self.globals_cache = globals_cache if globals_cache is not None else GlobalsCache(session, redis)
         self.parent_map = {}
-        self.cancelled = []
+        self.cancelled = set()
+        self.node_tasks = {}
+        self.dependents = {}
+        self.pending_parents = {}
+        self.ready_events = {}
+        self.shard_groups = {}
+        self.shard_results = {}
+        self.reductions = {}
+        self.cache_ttls = {}
+        self.cache_misses = {}
+        self.action_starts = {}
+        self.plan = None
 
     @staticmethod
-    async def get_workflow(redis: aioredis.Redis):
+    async def get_workflow(redis: aioredis.Redis, workers: dict = None):
         """
-            Continuously monitors the workflow queue for new work
+            Continuously monitors the workflow queue for new work. Yields each workflow along with the stream and id of
+            its message, which are left pending until the caller is done executing the workflow. Idle workers stay
+            warm, checking every WORKER_TIMEOUT seconds whether the umpire has retired them from the pool.
         """
+        workers = workers if workers is not None else {}
         while True:
             logger.info("Waiting for workflows...")
             if CONTAINER_ID is None:
@@ -65,68 +136,104 @@ class Worker:
                 logger.error("Error reading from workflow queue.")
                 sys.exit(-1)
 
-            if len(message) < 1:  # We've timed out with no work. Guess we'll die now...
-                sys.exit(1)
+            if len(message) < 1:
+                if len(workers) < 1 and await take_token(redis, config.REDIS_WORKER_RETIREMENTS):
+                    logger.info("Retiring idle worker.")
+                    await redis.xgroup_delconsumer(config.REDIS_WORKFLOW_QUEUE, config.REDIS_WORKFLOW_GROUP,
+                                                   CONTAINER_ID)
+                    sys.exit(0)
+                continue
 
             execution_id_workflow, stream, id_ = deref_stream_message(message)
             execution_id, workflow = execution_id_workflow
             try:
-                if not (await redis.sismember(config.REDIS_ABORTING_WORKFLOWS, execution_id)):
-                    await redis.sadd(config.REDIS_EXECUTING_WORKFLOWS, execution_id)
-                    logger.error(f"THE WORKFLOW: {workflow}")
-                    yield workflow_loads(workflow)
+                if await redis.sismember(config.REDIS_ABORTING_WORKFLOWS, execution_id):
+                    await Worker.ack_workflow(redis, stream, id_)
+                    continue
+                workflow = workflow_loads(workflow, Workflow)
+            except Exception:
+                logger.exception(f"Failed to load workflow for execution: {execution_id}")
+                await Worker.ack_workflow(redis, stream, id_)
+                continue
+
+            await redis.sadd(config.REDIS_EXECUTING_WORKFLOWS, execution_id)
+            yield workflow, stream, id_
 
-            finally:  # Clean up workflow-queue
-                await redis.xack(stream=stream, group_name=config.REDIS_WORKFLOW_GROUP, id=id_)
-                await xdel(redis, stream=stream, id_=id_)
+    @staticmethod
+    async def ack_workflow(redis: aioredis.Redis, stream, id_):
+        """ Removes a workflow's message from the workflow queue once it is no longer being worked on """
+        await xack_del(redis, stream, config.REDIS_WORKFLOW_GROUP, id_)
 
     @staticmethod
     async def run():
         async with connect_to_redis_pool(config.REDIS_URI) as redis, \
                 aiohttp.ClientSession(json_serialize=message_dumps) as session:
+            status_batcher = StatusBatcher(session)
+            globals_cache = GlobalsCache(session, redis)
+            asyncio.create_task(globals_cache.listen())
+
+            # Every workflow this process is executing, keyed by execution id, so aborts can be routed to them
+            workers = {}
+            slots = asyncio.Semaphore(config.get_int("WORKER_CONCURRENCY", 1))
 
             # Attach our signal handlers to cleanly close services we've created
             loop = asyncio.get_running_loop()
             loop.add_signal_handler(signal.SIGINT, lambda: asyncio.ensure_future(Worker.shutdown()))
             loop.add_signal_handler(signal.SIGTERM, lambda: asyncio.ensure_future(Worker.shutdown()))
+            loop.add_signal_handler(signal.SIGQUIT, lambda: asyncio.ensure_future(Worker.abort_workers(redis,
+                                                                                                       workers)))
 
-            async for workflow in Worker.get_workflow(redis):
+            await slots.acquire()
+            async for workflow, stream, id_ in Worker.get_workflow(redis, workers):
+                worker = Worker(workflow, redis=redis, session=session, status_batcher=status_batcher,
+                                globals_cache=globals_cache)
+                workers[workflow.execution_id] = worker
+                task = asyncio.create_task(worker.run_workflow())
 
-                # Setup worker and results stream
-                worker = Worker(workflow, redis=redis, session=session)
+                def release(_, execution_id=workflow.execution_id, stream=stream, id_=id_):
+                    workers.pop(execution_id, None)
+                    asyncio.create_task(Worker.ack_workflow(redis, stream, id_))
+                    slots.release()
 
-                # Attach our abort signal handler to a specific instance of the worker
-                loop.add_signal_handler(signal.SIGQUIT, lambda: asyncio.ensure_future(worker.abort()))
+                task.add_done_callback(release)
 
-                await redis.xgroup_create(worker.results_stream, config.REDIS_ACTION_RESULTS_GROUP, mkstream=True)
-                logger.info(f"Starting execution of workflow: {workflow.name}")
-                status = WorkflowStatusMessage.execution_started(worker.workflow.execution_id, worker.workflow.id_,
-                                                                 worker.workflow.name)
+                # Only read another workflow once there's room to execute it
+                await slots.acquire()
 
-                await send_status_update(session, workflow.execution_id, status)
+            await Worker.shutdown()
 
-                try:
-                    worker.execution_task = asyncio.create_task(worker.execute_workflow())
-                    await asyncio.gather(worker.execution_task)
-                except asyncio.CancelledError:
-                    logger.info(f"Aborted execution of workflow: {workflow.name}")
-                    status = WorkflowStatusMessage.execution_aborted(worker.workflow.execution_id,
-                                                                     worker.workflow.id_,
-                                                                     worker.workflow.name)
-                except Exception:
-                    logger.exception(f"Failed execution of workflow: {workflow.name}")
-                    status = WorkflowStatusMessage.execution_completed(worker.workflow.execution_id,
-                                                                       worker.workflow.id_,
-                                                                       worker.workflow.name)
-                else:
-                    logger.info(f"Completed execution of workflow: {workflow.name}")
-                    status = WorkflowStatusMessage.execution_completed(worker.workflow.execution_id,
-                                                                       worker.workflow.id_,
-                                                                       worker.workflow.name)
-                finally:
-                    await send_status_update(session, workflow.execution_id, status)
+    @staticmethod
+    async def abort_workers(redis: aioredis.Redis, workers: dict):
+        """ Aborts each workflow running in this process which has been marked for abortion """
+        aborting = await redis.smembers(config.REDIS_ABORTING_WORKFLOWS, encoding="utf-8")
+        to_abort = [worker for execution_id, worker in list(workers.items()) if execution_id in aborting]
+        await asyncio.gather(*[worker.abort() for worker in to_abort], return_exceptions=True)
+
+    async def run_workflow(self):
+        """ Executes this worker's workflow from start to finish, reporting its status along the way """
+        workflow = self.workflow
+        await self.redis.xgroup_create(self.results_stream, config.REDIS_ACTION_RESULTS_GROUP, mkstream=True)
+        logger.info(f"Starting execution of workflow: {workflow.name}")
+        status = WorkflowStatusMessage.execution_started(workflow.execution_id, workflow.id_, workflow.name)
+        started_at = status.started_at
+        await self.status_batcher.send(workflow.execution_id, status)
 
-            await Worker.shutdown()
+        try:
+            self.execution_task = asyncio.create_task(self.execute_workflow())
+            await asyncio.gather(self.execution_task)
+        except asyncio.CancelledError:
+            logger.info(f"Aborted execution of workflow: {workflow.name}")
+            status = WorkflowStatusMessage.execution_aborted(workflow.execution_id, workflow.id_, workflow.name)
+        except Exception:
+            logger.exception(f"Failed execution of workflow: {workflow.name}")
+            status = WorkflowStatusMessage.execution_completed(workflow.execution_id, workflow.id_, workflow.name)
+        else:
+            logger.info(f"Completed execution of workflow: {workflow.name}")
+            status = WorkflowStatusMessage.execution_completed(workflow.execution_id, workflow.id_, workflow.name)
+        finally:
+            await self.status_batcher.send(workflow.execution_id, status)
+            await self.status_batcher.flush()
+            await record_service_time(self.redis, "worker", elapsed_seconds(started_at, status.completed_at))
 
     @staticmethod
     async def shutdown():
@@ -140,85 +247,173 @@ class Worker:
         logger.info("Successfully shutdown Worker")
 
     async def abort(self):
-        logger.info("Aborting workflow...")
-        [task.cancel() for task in self.scheduling_tasks]
-        self.results_getter_task.cancel()
-        self.execution_task.cancel()
+        logger.info(f"Aborting workflow: {self.workflow.execution_id}")
+        # The workflow may be aborted before its execution has gotten around to starting every task
+        tasks = [task for task in (*self.scheduling_tasks, self.results_getter_task, self.execution_task)
+                 if task is not None]
+        [task.cancel() for task in tasks]
 
         # Try to cancel any outstanding actions
         msgs = [NodeStatusMessage.aborted_from_node(action, action.execution_id) for action in self.in_process.values()]
-        message_tasks = [send_status_update(self.session, self.workflow.execution_id, msg) for msg in msgs]
-        await asyncio.gather(*message_tasks, return_exceptions=True)
+        for msg in msgs:
+            await self.status_batcher.send(self.workflow.execution_id, msg)
+        await self.status_batcher.flush()
 
         logger.info("Canceling outstanding tasks...")
-        await asyncio.gather(*self.scheduling_tasks, *message_tasks, self.results_getter_task, self.execution_task,
-                             return_exceptions=True)
-        logger.info("Successfully aborted workflow!")
+        await asyncio.gather(*tasks, return_exceptions=True)
+        logger.info(f"Successfully aborted workflow: {self.workflow.execution_id}")
+
+    async def cancel_subgraph(self, *nodes):
+        """
+            Cancels the tasks related to the given nodes as well as the tasks of every node which can only be reached
+            through them, using the descendants precomputed in the execution plan. Every node which had yet to run is
+            removed from the worker's internal in_process queue and reported as aborted in a single batch.
+        """
+        to_cancel = []
+        for node in nodes:
+            i = self.plan.index[node.id_]
+            to_cancel.append(node.id_)
+            to_cancel.extend(self.plan.order[j] for j in self.plan.descendants[i])
 
-    async def cancel_helper(self, node, to_cancel):
-        children = set(self.workflow.successors(node))
+        cancelled_tasks = set()
+        statuses = []
+        for node_id in dict.fromkeys(to_cancel):  # branches may share descendants
+            self.cancelled.add(node_id)
+            self.release_inputs(node_id)
+            task = self.node_tasks.get(node_id)
+            if task is None or task.done():
+                continue
 
-        for child in children:
-            if self.parent_map[child.id_] == 1:
-                to_cancel.append(child.id_)
-                self.cancelled.append(node.id_)
-                await self.cancel_helper(child, to_cancel)
+            # Nodes whose final status was already reported, e.g. triggers, leave in_process before their task finishes
+            node = self.in_process.pop(node_id, None)
+            self.resolve_node(node_id, None)
+            if node is not None:
+                statuses.append(NodeStatusMessage.aborted_from_node(node, self.workflow.execution_id))
+            cancelled_tasks.add(task)
+
+        # A node cancelling its own subgraph is cancelled along with it once everything else has been cleaned up
+        current_task = asyncio.current_task()
+        cancel_current = current_task in cancelled_tasks
+        cancelled_tasks.discard(current_task)
+
+        [task.cancel() for task in cancelled_tasks]
+        for status in statuses:
+            await self.status_batcher.send(self.workflow.execution_id, status)
+        await asyncio.gather(*cancelled_tasks, return_exceptions=True)
 
-        return to_cancel
+        if cancel_current:
+            raise asyncio.CancelledError
 
-    async def cancel_subgraph(self, node):
+    def register_dependencies(self, node, parents):
         """
-            Cancels the task related to the current node as well as the tasks related to every child of that node.
-            Also removes them from the worker's internal in_process queue.
+            Records how many parents a node is waiting on and which nodes depend on each parent so that results can
+            wake up their dependents directly instead of every scheduled node polling the accumulator.
         """
-        # dependents = self.workflow.get_dependents(node)
-        cancelled_tasks = set()
+        self.pending_parents[node.id_] = len(parents)
+        self.ready_events[node.id_] = asyncio.Event()
 
-        self.cancelled.append(node.id_)
-        to_cancel = await self.cancel_helper(node, [node.id_])
+        for parent_id in parents:
+            self.dependents.setdefault(parent_id, set()).add(node.id_)
 
-        for task in self.scheduling_tasks:
-            for _, arg in getcoroutinelocals(task._coro).items():
-                if isinstance(arg, Node):
-                    if arg.id_ in to_cancel:
-                        self.in_process.pop(arg.id_)
-                        self.accumulator[arg.id_] = None
-                        self.cancelled.append(arg.id_)
-                        task.cancel()
-                        cancelled_tasks.add(task)
+        if len(parents) < 1:
+            self.ready_events[node.id_].set()
 
-        await asyncio.gather(*cancelled_tasks, return_exceptions=True)
+    def resolve_node(self, node_id, result):
+        """
+            Stores a node's result and notifies its dependents. A node is only ever resolved once, so repeated results
+            for the same node (i.e. a parallel action echoing its aggregate result) just update the accumulator.
+            Results which no node will read are not stored at all.
+        """
+        already_resolved = node_id in self.resolved
+        self.resolved.add(node_id)
+        if self.live_consumers.get(node_id, 1) > 0:
+            self.accumulator[node_id] = result
+
+        if already_resolved:
+            return
+
+        for child_id in self.dependents.get(node_id, ()):
+            self.pending_parents[child_id] -= 1
+            if self.pending_parents[child_id] == 0:
+                self.ready_events[child_id].set()
+
+    def release_inputs(self, node_id):
+        """
+            Marks a node as done with the results it reads, whether it ran or was cancelled. Each result is dropped
+            from the accumulator as soon as the last of its consumers in the execution plan lets go of it.
+        """
+        i = self.plan.index.get(node_id) if self.plan is not None and self.plan.inputs is not None else None
+        if i is None or node_id in self.released:
+            return
+
+        self.released.add(node_id)
+        for j in self.plan.inputs[i]:
+            input_id = self.plan.order[j]
+            self.live_consumers[input_id] -= 1
+            if self.live_consumers[input_id] == 0:
+                self.accumulator.pop(input_id, None)
+
+    def resolve_shard(self, shard_id, result):
+        """ Hands a shard's result to the parallel action it belongs to. Repeated results for a shard are ignored. """
+        group_id = self.shard_groups.pop(shard_id, None)
+        if group_id is not None:
+            self.shard_results[group_id].put_nowait((shard_id, result))
+
+    async def wait_for_parents(self, node):
+        """ Blocks until every parent of the node has a result. Nodes without registered parents are always ready. """
+        event = self.ready_events.get(node.id_)
+        if event is not None:
+            await event.wait()
+
+    async def get_execution_plan(self):
+        """
+            Fetches the plan the api_gateway compiled for this version of the workflow. If it has expired, or the
+            workflow was altered for this execution and has no plan, the plan is compiled here instead.
+        """
+        digest = self.workflow.plan_digest if self.start_action is self.workflow.start else None
+        key = execution_plan_key(self.workflow.id_, digest)
+        if digest is not None:
+            plan = await self.redis.get(key)
+            if plan is not None:
+                try:
+                    return ExecutionPlan.loads(plan)
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    logger.warning(f"Recompiling unreadable execution plan of workflow {self.workflow.id_}")
+
+        plan = ExecutionPlan.compile(self.workflow, self.start_action)
+        if digest is not None:
+            await self.redis.set(key, plan.dumps(), expire=config.get_int("EXECUTION_PLAN_TTL", 86400))
+        return plan
 
     async def execute_workflow(self):
         """
-            Do a simple BFS to visit and schedule each node in the workflow. We assume every node will run and thus
-            preemptively schedule them all. We will clean up any nodes that will not run due to conditions or triggers
+            Schedule each node in the workflow following its compiled execution plan. We assume every node will run
+            and thus preemptively schedule them all. We will clean up any nodes that will not run due to conditions or
+            triggers
         """
-        visited = {self.start_action}
-        queue = deque([self.start_action])
+        if self.plan is None:
+            self.plan = await self.get_execution_plan()
+        if self.plan.consumers is not None:
+            self.live_consumers = {node_id: len(c) for node_id, c in zip(self.plan.order, self.plan.consumers)}
+
+        nodes = [self.workflow.nodes[node_id] for node_id in self.plan.order]
+        self.cache_ttls = await get_result_cache_ttls(self.redis, [node for node in nodes if isinstance(node, Action)])
         self.scheduling_tasks = set()
-        while queue:
-            node = queue.pop()
-            parents = {n.id_: n for n in self.workflow.predecessors(node)} if node is not self.start_action else {}
-            children = {n.id_: n for n in self.workflow.successors(node)}
-
-            for parent_id in parents:
-                if node.id_ not in self.parent_map.keys():
-                    self.parent_map[node.id_] = 1
-                else:
-                    self.parent_map[node.id_] = self.parent_map[node.id_] + 1
+        for i, node in enumerate(nodes):
+            parents = {nodes[j].id_: nodes[j] for j in self.plan.parents[i]}
+            children = {nodes[j].id_: nodes[j] for j in self.plan.children[i]}
+
+            if len(parents) > 0:
+                self.parent_map[node.id_] = len(parents)
 
             self.in_process[node.id_] = node
+            self.register_dependencies(node, parents)
 
             if isinstance(node, Action):
                 node.execution_id = self.workflow.execution_id  # the app needs this as a key for the redis queue
 
-            self.scheduling_tasks.add(asyncio.create_task(self.schedule_node(node, parents, children)))
-
-            for child in sorted(children.values(), reverse=True):
-                if child not in visited:
-                    queue.appendleft(child)
-                    visited.add(child)
+            self.node_tasks[node.id_] = asyncio.create_task(self.schedule_node(node, parents, children))
+            self.scheduling_tasks.add(self.node_tasks[node.id_])
 
         # Launch the results accumulation task and wait for all the results to come in
         self.results_getter_task = asyncio.create_task(self.get_action_results())
@@ -234,16 +429,15 @@ class Worker:
         """
         logger.debug(f"Attempting evaluation of: {condition.label}-{self.workflow.execution_id}")
         try:
-            child_id = condition(parents, children, self.accumulator)
+            parent_results = await load_results(self.redis, {parent_id: self.accumulator[parent_id]
+                                                             for parent_id in parents})
+            child_id = condition(parents, children, parent_results)
             selected_node = children.pop(child_id)
             status = NodeStatusMessage.success_from_node(condition, self.workflow.execution_id, selected_node.name)
             logger.info(f"Condition selected node: {selected_node.label}-{self.workflow.execution_id}")
 
             # We preemptively schedule all branches of execution so we must cancel all "false" branches here
-            #[await self.cancel_subgraph(child) for child in children.values()]
-            for child in children.values():
-                if self.parent_map[child.id_] == 1:
-                    await self.cancel_subgraph(child)
+            await self.cancel_subgraph(*[child for child in children.values() if self.parent_map[child.id_] == 1])
 
         except ConditionException as e:
             logger.exception(f"Worker received error for {condition.name}-{self.workflow.execution_id}")
@@ -253,56 +447,111 @@ class Worker:
             return
 
         # Send the status message through redis to ensure get_action_results completes it correctly
-        await self.redis.xadd(self.results_stream, {status.execution_id: message_dumps(status)})
-
-    async def execute_parallel_action(self, node: Action):
-        schedule_tasks = []
-        actions = set()
-        action_to_parallel_map = {}
-        results = []
-        parallel_parameter = [p for p in node.parameters if p.parallelized]
-        unparallelized = list(set(node.parameters) - set(parallel_parameter))
-
-        for i, value in enumerate(parallel_parameter[0].value):
-            new_value = [value]
-            # params = node.append(array[i])
-            params = []
-            params.extend(unparallelized)
-            params.append(Parameter(parallel_parameter[0].name, value=new_value,
-                                    variant=ParameterVariant.STATIC_VALUE))
-            # params.append([parameter])
-            act = Action(node.name, node.position, node.
-                         app_name, node.app_version, f"{node.name}:shard_{value}",
-                         node.priority, parameters=params, execution_id=node.execution_id)
-            actions.add(act.id_)
-            schedule_tasks.append(asyncio.create_task(self.schedule_node(act, {}, {})))
-            action_to_parallel_map[act.id_] = new_value
-            self.parallel_in_process[act.id_] = act
-
-
-        # self.in_process.pop(node.id_)
-        exceptions = await asyncio.gather(*schedule_tasks, return_exceptions=True)
-
-        while not actions.intersection(set(self.parallel_accumulator.keys())) == actions:
-            await asyncio.sleep(0)
-
-        for a in actions:
-            contents = self.parallel_accumulator[a]
-            for individual in contents:
-                results.append(individual)
-
-        self.accumulator[node.id_] = results
-
-        # self.accumulator[node.id_] = [self.parallel_accumulator[a] for a in actions]
-        status = NodeStatusMessage.success_from_node(node, self.workflow.execution_id, self.accumulator[node.id_])
-
-        await self.redis.xadd(self.results_stream, {status.execution_id: message_dumps(status)})
+        await self.redis.xadd(self.results_stream, {status.execution_id: message_dumps(status, stream=True)})
+
+    async def execute_parallel_action(self, node: Action, parameters):
+        """
+            Splits the parallelized parameter into chunks and runs the action once per chunk. Chunks grow beyond
+            PARALLEL_CHUNK_SIZE elements so that no more than PARALLEL_MAX_SHARDS shards are created, and at most
+            PARALLEL_MAX_IN_FLIGHT shards are dispatched at a time. Each shard's result is collected as it arrives and
+            the results are combined, and folded into any reducers downstream, in the order of the chunks they came
+            from. When reducers are the only nodes which read the action's result, the combined list isn't kept.
+        """
+        chunk_index = {}
+        try:
+            parallel_parameter = [p for p in parameters if p.parallelized]
+            unparallelized = [p for p in parameters if not p.parallelized]
+
+            # Each shard gets its value inline, so a parallelized result passed by reference is fetched here
+            values = await load_results(self.redis, parallel_parameter[0].value)
+
+            max_shards = max(config.get_int("PARALLEL_MAX_SHARDS", 256), 1)
+            max_in_flight = max(config.get_int("PARALLEL_MAX_IN_FLIGHT", 32), 1)
+            chunk_size = max(config.get_int("PARALLEL_CHUNK_SIZE", 1), math.ceil(len(values) / max_shards), 1)
+
+            reducers = [child for child in self.workflow.successors(node) if isinstance(child, Reducer)]
+            consumers = None
+            if self.plan is not None and self.plan.consumers is not None and node.id_ in self.plan.index:
+                consumers = [self.workflow.nodes[self.plan.order[j]]
+                             for j in self.plan.consumers[self.plan.index[node.id_]]]
+            keep_results = not reducers or consumers is None or any(not isinstance(c, Reducer) for c in consumers)
+            self.fold_reductions(reducers)
+
+            completed = self.shard_results[node.id_] = asyncio.Queue()
+            num_chunks = math.ceil(len(values) / chunk_size)
+            arrived = {}
+            results = []
+            folded = 0
+
+            async def collect():
+                nonlocal folded
+                shard_id, result = await completed.get()
+                arrived[chunk_index.pop(shard_id)] = result
+
+                # Only the chunks which finished ahead of an earlier one are buffered
+                while folded in arrived:
+                    contents = arrived.pop(folded)
+                    folded += 1
+                    if contents is None:  # Failed shards have no result to contribute
+                        continue
+                    contents = await load_results(self.redis, contents)
+                    if keep_results:
+                        results.extend(contents)
+                    self.fold_reductions(reducers, contents)
+
+            for i in range(num_chunks):
+                if len(chunk_index) >= max_in_flight:
+                    await collect()
+
+                chunk = values[i * chunk_size:(i + 1) * chunk_size]
+                params = [*unparallelized, Parameter(parallel_parameter[0].name, value=chunk,
+                                                     variant=ParameterVariant.STATIC_VALUE)]
+                act = Action(node.name, node.position, node.app_name, node.app_version, f"{node.name}:shard_{i}",
+                             node.priority, parameters=params, execution_id=node.execution_id)
+                chunk_index[act.id_] = i
+                self.shard_groups[act.id_] = node.id_
+                self.parallel_in_process[act.id_] = act
+                await self.schedule_node(act, {}, {})
+
+            while chunk_index:
+                await collect()
+
+            result = await store_result(self.redis, results) if keep_results else None
+            self.resolve_node(node.id_, result)
+            status = NodeStatusMessage.success_from_node(node, self.workflow.execution_id, result)
+        except Exception as e:
+            logger.exception(f"Worker received error for {node.name}-{self.workflow.execution_id}")
+            status = NodeStatusMessage.failure_from_node(node, self.workflow.execution_id, result=repr(e))
+        finally:
+            # Shards which are still in flight have nowhere left to deliver their results
+            self.shard_results.pop(node.id_, None)
+            for shard_id in chunk_index:
+                self.shard_groups.pop(shard_id, None)
+
+        # Send the status message through redis to ensure get_action_results completes it correctly
+        await self.redis.xadd(self.results_stream, {status.execution_id: message_dumps(status, stream=True)})
+
+    def fold_reductions(self, reducers, items=()):
+        """
+            Folds items into the running state of each reducer. A reducer which fails keeps the exception in place of
+            its state, so that the failure is reported once the reducer itself is scheduled.
+        """
+        for reducer in reducers:
+            state = self.reductions.get(reducer.id_)
+            if isinstance(state, Exception):
+                continue
+            try:
+                state = state if reducer.id_ in self.reductions else reducer.start()
+                self.reductions[reducer.id_] = reducer.update(state, items)
+            except Exception as e:
+                self.reductions[reducer.id_] = e
 
     async def execute_transform(self, transform, parent):
         """ Execute an transform and ship its result """
         logger.debug(f"Attempting evaluation of: {transform.label}-{self.workflow.execution_id}")
         try:
-            result = transform(self.accumulator[parent.id_])  # run transform on parent's result
+            parent_result = await load_results(self.redis, self.accumulator[parent.id_])
+            result = await store_result(self.redis, transform(parent_result))  # run transform on parent's result
             status = NodeStatusMessage.success_from_node(transform, self.workflow.execution_id, result)
             logger.info(f"Transform {transform.label}-succeeded with result: {result}")
 
@@ -312,7 +561,29 @@ class Worker:
             status = NodeStatusMessage.failure_from_node(transform, self.workflow.execution_id, result=repr(e))
 
         # Send the status message through redis to ensure get_action_results completes it correctly
-        await self.redis.xadd(self.results_stream, {status.execution_id: message_dumps(status)})
+        await self.redis.xadd(self.results_stream, {status.execution_id: message_dumps(status, stream=True)})
+
+    async def execute_reducer(self, reducer, parent):
+        """ Finish a reducer fed by a parallelized action, or reduce its parent's whole result, and ship the result """
+        logger.debug(f"Attempting evaluation of: {reducer.label}-{self.workflow.execution_id}")
+        try:
+            if reducer.id_ in self.reductions:
+                state = self.reductions.pop(reducer.id_)
+                if isinstance(state, Exception):
+                    raise state
+                result = reducer.finish(state)
+            else:
+                result = reducer(await load_results(self.redis, self.accumulator[parent.id_]))
+            result = await store_result(self.redis, result)
+            status = NodeStatusMessage.success_from_node(reducer, self.workflow.execution_id, result)
+            logger.info(f"Reducer {reducer.label}-succeeded with result: {result}")
+
+        except Exception as e:
+            logger.exception(f"Worker received error for {reducer.name}-{self.workflow.execution_id}")
+            status = NodeStatusMessage.failure_from_node(reducer, self.workflow.execution_id, result=repr(e))
+
+        # Send the status message through redis to ensure get_action_results completes it correctly
+        await self.redis.xadd(self.results_stream, {status.execution_id: message_dumps(status, stream=True)})
 
     async def execute_trigger(self, trigger, trigger_data):
         """ Execute a trigger and ship the data """
@@ -320,112 +591,185 @@ class Worker:
         try:
             result = trigger(trigger_data)
             tmsg = NodeStatusMessage.success_from_node(trigger, self.workflow.execution_id, result)
-            await send_status_update(self.session, self.workflow.execution_id,
-                                     tmsg)
-            self.accumulator[trigger.id_] = result
+            await self.status_batcher.send(self.workflow.execution_id, tmsg)
+            self.resolve_node(trigger.id_, result)
             self.in_process.pop(trigger.id_)
 
         # TODO: can/should a trigger actually raise any exceptions?
         except Exception as e:
             logger.exception(f"Worker received error for {trigger.name}-{self.workflow.execution_id}")
-            await send_status_update(self.session, self.workflow.execution_id,
-                                     NodeStatusMessage.failure_from_node(trigger, self.workflow.execution_id,
-                                                                         result=repr(e)))
-
-    async def get_globals(self):
-        url = config.API_GATEWAY_URI.rstrip('/') + '/api'
-        headers, self.token = await get_walkoff_auth_header(self.session, self.token)
-        # saving decryption for app-level
-        payload = {'to_decrypt': 'false'}
-        async with self.session.get(url + "/globals", headers=headers, params=payload) as resp:
-            globals_ = await resp.json(loads=workflow_loads)
-            logger.debug(f"Got globals: {globals_}")
-            return {g.id_: g for g in globals_}
+            await self.status_batcher.send(self.workflow.execution_id,
+                                           NodeStatusMessage.failure_from_node(trigger, self.workflow.execution_id,
+                                                                               result=repr(e)))
 
     async def dereference_params(self, action: Action):
-        global_vars = await self.get_globals()
+        """
+            Returns copies of an action's parameters with their values dereferenced. The action's own parameters are
+            left as they are so the workflow doesn't hold on to results after they've been dropped from the accumulator.
+        """
+        global_ids = [param.value for param in action.parameters if param.variant == ParameterVariant.GLOBAL]
+        global_vars = await self.globals_cache.get(global_ids) if len(global_ids) > 0 else {}
 
+        parameters = []
         for param in action.parameters:
+            value = param.value
             if param.variant == ParameterVariant.STATIC_VALUE:
-                continue
+                pass
 
             elif param.variant == ParameterVariant.ACTION_RESULT:
                 if param.value in self.accumulator:
-                    param.value = self.accumulator[param.value]
+                    value = self.accumulator[param.value]
 
             elif param.variant == ParameterVariant.WORKFLOW_VARIABLE:
                 if param.value in self.workflow.workflow_variables:
-                    param.value = self.workflow.workflow_variables[param.value].value
+                    value = self.workflow.workflow_variables[param.value].value
 
             elif param.variant == ParameterVariant.GLOBAL:
                 if param.value in global_vars:
-                    param.value = global_vars[param.value].value
+                    value = global_vars[param.value].value
 
             else:
                 logger.error(f"Unable to dereference parameter:{param} for action:{action}")
-                break
+
+            parameters.append(Parameter(param.name, parallelized=param.parallelized, id_=param.id_, value=value,
+                                        variant=param.variant))
+        return parameters
+
+    def is_cacheable(self, action: Action):
+        """ Returns whether an action's results are cached, as published by the api_gateway for its app """
+        return result_cache_field(action.app_name, action.app_version, action.name) in self.cache_ttls
+
+    async def get_cached_action_result(self, action: Action, parameters):
+        """
+            Completes a cacheable action with its cached result, if the same action has already run with the same
+            dereferenced parameters. Returns whether it was completed. On a miss, the action's result is cached once
+            it arrives.
+        """
+        ttl = self.cache_ttls.get(result_cache_field(action.app_name, action.app_version, action.name))
+        if ttl is None:
+            return False
+
+        key = result_cache_key(action.app_name, action.app_version, action.name, parameters)
+        if key is None:
+            return False
+
+        result = await get_cached_result(self.redis, key)
+        if result is None:
+            self.cache_misses[action.id_] = (key, ttl)
+            return False
+
+        logger.info(f"Found cached result for {action.label}-{self.workflow.execution_id}")
+        await self.status_batcher.send(self.workflow.execution_id,
+                                       NodeStatusMessage.executing_from_node(action, self.workflow.execution_id))
+
+        # Send the status message through redis to ensure get_action_results completes it correctly
+        status = NodeStatusMessage.success_from_node(action, self.workflow.execution_id, result)
+        await self.redis.xadd(self.results_stream, {status.execution_id: message_dumps(status, stream=True)})
+        return True
+
+    async def cache_action_result(self, node_message):
+        """ Caches the result of a cacheable action which missed the cache when it was scheduled """
+        if node_message.node_id in self.cache_misses:
+            key, ttl = self.cache_misses.pop(node_message.node_id)
+            await cache_result(self.redis, key, node_message.result, ttl)
+
+    async def provision_stream(self, stream, app_name, app_version):
+        """
+            Creates an app's action stream and group for this execution and indexes the stream so the app can find it
+            without scanning the keyspace. The stream is announced to the app's replicas, which block on announcements
+            while they have no streams to read, and indexed under the execution too, for the umpire to clean up after
+            it. Streams are remembered once provisioned, so after the first action for an app every dispatch is a
+            single XADD.
+        """
+        group = f"{app_name}:{app_version}"
+        try:
+            await self.redis.xgroup_create(stream, group, mkstream=True)
+        except aioredis.ReplyError as e:
+            if not str(e).startswith("BUSYGROUP"):  # Another action for this app got here first, which is fine
+                logger.debug(f"Issue creating redis stream {e!r}")
+                return
+
+        pipe: aioredis.commands.Pipeline = self.redis.pipeline()
+        pipe.sadd(app_streams_key(app_name, app_version), stream)
+        pipe.sadd(execution_streams_key(self.workflow.execution_id), stream)
+        pipe.xadd(app_stream_announcements_key(app_name, app_version), {"stream": stream},
+                  max_len=config.get_int("APP_STREAM_ANNOUNCEMENTS_LENGTH", 1000), exact_len=False)
+        await pipe.execute()
+
+        # Keep track of these for clean up later
+        self.streams.add(stream)
 
     async def schedule_node(self, node, parents, children):
         """ Waits until all dependencies of an action are met and then schedules the action """
         logger.info(f"Scheduling node {node.id_} ({node.name})...")
 
-        while not all(parent.id_ in self.accumulator for parent in parents.values()):
-            await asyncio.sleep(0)
+        await self.wait_for_parents(node)
 
         logger.info(f"Node {node.id_} ({node.name}) ready to execute.")
 
-        # node has more than one parent, check if both parent nodes have been cancelled
-        if len(parents) > 1:
-            count = 0
-            for parent in parents:
-                if parent in self.cancelled:
-                    count = count + 1
-
-            if count == self.parent_map[node.id_]:
-                await self.cancel_subgraph(node)
+        # node has more than one parent, check if all of the parent nodes have been cancelled
+        if len(parents) > 1 and all(parent in self.cancelled for parent in parents):
+            await self.cancel_subgraph(node)
 
         if isinstance(node, Action):
+            # Parameters are dereferenced once, whether to split a parallel action, to look up a cached result or to
+            # send the action to its app on a miss
+            parameters = None
+            if node.parallelized or self.is_cacheable(node):
+                parameters = await self.dereference_params(node)
+
             if node.parallelized:
-                await self.dereference_params(node)
-                await send_status_update(self.session, self.workflow.execution_id,
-                                         NodeStatusMessage.executing_from_node(node, self.workflow.execution_id))
-                asyncio.create_task(self.execute_parallel_action(node))
+                await self.status_batcher.send(self.workflow.execution_id,
+                                               NodeStatusMessage.executing_from_node(node, self.workflow.execution_id))
+                # The parallel action outlives this task, so it takes its place to be cancelled along with the node
+                self.node_tasks[node.id_] = asyncio.create_task(self.execute_parallel_action(node, parameters))
+                self.scheduling_tasks.add(self.node_tasks[node.id_])
 
-            else:
+            elif parameters is None or not await self.get_cached_action_result(node, parameters):
                 group = f"{node.app_name}:{node.app_version}"
                 stream = f"{node.execution_id}:{group}"
-                try:
-                    # The stream doesn't exist so lets create that and the app group
-                    if len(await self.redis.keys(stream)) < 1:
-                        await self.redis.xgroup_create(stream, group, mkstream=True)
-
-                    # The stream exists but the group does not so lets just make the app group
-                    if len(await self.redis.xinfo_groups(stream)) < 1:
-                        await self.redis.xgroup_create(stream, group)
+                if stream not in self.streams:
+                    await self.provision_stream(stream, node.app_name, node.app_version)
 
-                    # Keep track of these for clean up later
-                    self.streams.add(stream)
+                # Actions with only static parameters were encoded ahead of time when the plan was compiled
+                payload = self.plan.payload(node.id_, node.execution_id) if self.plan is not None else None
+                if payload is not None:
+                    payload = compress_payload(payload)
+                else:
+                    if parameters is None:
+                        parameters = await self.dereference_params(node)
+                    action = Action(node.name, node.position, node.app_name, node.app_version, node.label,
+                                    node.priority, parameters=parameters, id_=node.id_, execution_id=node.execution_id)
+                    payload = workflow_dumps(action, stream=True)
 
-                except aioredis.ReplyError as e:
-                    logger.debug(f"Issue creating redis stream {e!r}")
+                await self.status_batcher.send(self.workflow.execution_id,
+                                               NodeStatusMessage.executing_from_node(node, self.workflow.execution_id))
 
-                await self.dereference_params(node)
-                await send_status_update(self.session, self.workflow.execution_id,
-                                         NodeStatusMessage.executing_from_node(node, self.workflow.execution_id))
-                await self.redis.xadd(stream, {node.execution_id: workflow_dumps(node)})
+                # Count the action's arrival for the umpire's autoscaler in the same round trip
+                pipe: aioredis.commands.Pipeline = self.redis.pipeline()
+                pipe.xadd(stream, {node.execution_id: payload})
+                pipe.hincrby(config.REDIS_AUTOSCALER_ARRIVALS, group, 1)
+                await pipe.execute()
 
         elif isinstance(node, Condition):
-            await send_status_update(self.session, self.workflow.execution_id,
-                                     NodeStatusMessage.executing_from_node(node, self.workflow.execution_id))
+            await self.status_batcher.send(self.workflow.execution_id,
+                                           NodeStatusMessage.executing_from_node(node, self.workflow.execution_id))
             await self.evaluate_condition(node, parents, children)
 
         elif isinstance(node, Transform):
             if len(parents) > 1:
                 logger.error(f"Error scheduling {node.name}: Transforms cannot have more than 1 incoming connection.")
-            await send_status_update(self.session, self.workflow.execution_id,
-                                     NodeStatusMessage.executing_from_node(node, self.workflow.execution_id))
+            await self.status_batcher.send(self.workflow.execution_id,
+                                           NodeStatusMessage.executing_from_node(node, self.workflow.execution_id))
             await self.execute_transform(node, parents.popitem()[1])
 
+        elif isinstance(node, Reducer):
+            if len(parents) > 1:
+                logger.error(f"Error scheduling {node.name}: Reducers cannot have more than 1 incoming connection.")
+            await self.status_batcher.send(self.workflow.execution_id,
+                                           NodeStatusMessage.executing_from_node(node, self.workflow.execution_id))
+            await self.execute_reducer(node, parents.popitem()[1])
+
         elif isinstance(node, Trigger):
             trigger_stream = f"{self.workflow.execution_id}-{node.id_}:triggers"
             msg = None
@@ -440,8 +784,8 @@ class Worker:
                     logger.debug(f"Trigger satisfied in {self.workflow.execution_id} ({self.workflow.name}) at "
                                  f"{node.id_} ({node.name}) with message {msg}")
 
-                    await send_status_update(self.session, self.workflow.execution_id,
-                                             NodeStatusMessage.executing_from_node(node, self.workflow.execution_id))
+                    status = NodeStatusMessage.executing_from_node(node, self.workflow.execution_id)
+                    await self.status_batcher.send(self.workflow.execution_id, status)
 
                     execution_id_trigger_message, stream, id_ = deref_stream_message(msg)
                     execution_id, trigger_message = execution_id_trigger_message
@@ -455,20 +799,96 @@ class Worker:
                     await self.redis.xgroup_create(trigger_stream, config.REDIS_WORKFLOW_TRIGGERS_GROUP,
                                                    mkstream=True, latest_id='0')
 
+        self.release_inputs(node.id_)
+
         # TODO: decide if we want pending action messages and uncomment this line
-        # await send_status_update(self.session, self.workflow.execution_id,
+        # await self.status_batcher.send(self.workflow.execution_id,
         # NodeStatus.pending_from_node(node, workflow.execution_id))
         logger.info(f"Scheduled {node}")
 
+    async def handle_action_result(self, node_message):
+        """ Updates the worker's state with a status message received from an app and forwards it to the api_gateway """
+        # Ensure that the received NodeStatusMessage is for an action we launched
+        if node_message.execution_id == self.workflow.execution_id and node_message.node_id in self.in_process:
+            if node_message.status == StatusEnum.EXECUTING:
+                logger.info(f"App started execution of: {node_message.label}-{node_message.execution_id}")
+
+            elif node_message.status == StatusEnum.SUCCESS:
+                self.resolve_node(node_message.node_id, node_message.result)
+                logger.info(f"Worker received result for: {node_message.label}-{node_message.execution_id}")
+                await self.cache_action_result(node_message)
+
+            elif node_message.status == StatusEnum.FAILURE:
+                self.resolve_node(node_message.node_id, node_message.result)
+                await self.cancel_subgraph(self.workflow.nodes[node_message.node_id])  # kill the children!
+                logger.info(f"Worker received error \"{node_message.result}\" for: {node_message.label}-"
+                            f"{node_message.execution_id}")
+
+            else:
+                logger.error(f"Unknown message status received: {node_message}")
+                node_message = None
+
+            await self.status_batcher.send(self.workflow.execution_id, node_message)
+
+        elif node_message.execution_id == self.workflow.execution_id \
+                and node_message.node_id in self.parallel_in_process:
+            if node_message.status == StatusEnum.EXECUTING:
+                logger.debug(f"App started parallel execution of: {node_message.label}-{node_message.execution_id}")
+
+            elif node_message.status == StatusEnum.SUCCESS:
+                self.resolve_shard(node_message.node_id, node_message.result)
+                logger.debug(f"PARALLEL Worker received result for: {node_message.label}-{node_message.execution_id}")
+                await self.cache_action_result(node_message)
+
+            elif node_message.status == StatusEnum.FAILURE:
+                self.resolve_shard(node_message.node_id, None)
+                logger.debug(f"PARALLEL Worker received error \"{node_message.result}\" for: {node_message.label}-"
+                            f"{node_message.execution_id}")
+
+            else:
+                logger.error(f"Unknown message status received: {node_message}")
+                node_message = None
+
+            node_message.name = node_message.label
+            await self.status_batcher.send(self.workflow.execution_id, node_message)
+        else:
+            logger.error(f"Message received for unknown execution: {node_message}")
+
+        await self.record_action_time(node_message)
+
+        # Clean up our in process queue
+        if node_message.status != StatusEnum.EXECUTING and node_message.node_id in self.parallel_in_process:
+            self.parallel_in_process.pop(node_message.node_id, None)
+        elif node_message.status != StatusEnum.EXECUTING:
+            self.in_process.pop(node_message.node_id, None)
+
+    async def record_action_time(self, node_message):
+        """ Records how long an app took to execute an action, from the timestamps of the action's status messages """
+        if node_message.status == StatusEnum.EXECUTING:
+            self.action_starts[node_message.node_id] = node_message.started_at
+            return
+
+        started_at = self.action_starts.pop(node_message.node_id, None)
+        node = self.in_process.get(node_message.node_id, self.parallel_in_process.get(node_message.node_id))
+        if started_at is None or node_message.completed_at is None or not isinstance(node, Action):
+            return
+
+        await record_service_time(self.redis, f"{node.app_name}:{node.app_version}",
+                                  elapsed_seconds(started_at, node_message.completed_at))
+
     async def get_action_results(self):
-        """ Continuously monitors the results queue until all scheduled actions have been completed """
-        results_stream = f"{self.workflow.execution_id}:results"
+        """
+            Continuously monitors the results queue until all scheduled actions have been completed. Results are read
+            in batches of up to RESULTS_BATCH_SIZE, handled in order, then acknowledged and deleted atomically in a
+            single round trip.
+        """
+        batch_size = config.get_int("RESULTS_BATCH_SIZE", 100)
 
         while len(self.in_process) > 0 or len(self.parallel_in_process) > 0:
             try:
                 with await self.redis as redis:
-                    msg = await redis.xread_group(config.REDIS_ACTION_RESULTS_GROUP, CONTAINER_ID,
-                                                  streams=[self.results_stream], count=1, latest_ids=['>'])
+                    msgs = await redis.xread_group(config.REDIS_ACTION_RESULTS_GROUP, CONTAINER_ID,
+                                                   streams=[self.results_stream], count=batch_size, latest_ids=['>'])
             except aioredis.errors.ReplyError:
                 logger.debug(f"Stream {self.workflow.execution_id} doesn't exist. Attempting to create it...")
                 await self.redis.xgroup_create(self.results_stream, config.REDIS_ACTION_RESULTS_GROUP,
@@ -476,67 +896,28 @@ class Worker:
                 logger.debug(f"Created stream {self.results_stream}.")
                 continue
 
-            # Dereference the redis stream message and load the status message
-            execution_id_node_message, stream, id_ = deref_stream_message(msg)
-            execution_id, node_message = execution_id_node_message
-            node_message = message_loads(node_message)
-
-            # Ensure that the received NodeStatusMessage is for an action we launched
-            if node_message.execution_id == self.workflow.execution_id and node_message.node_id in self.in_process:
-                if node_message.status == StatusEnum.EXECUTING:
-                    logger.info(f"App started execution of: {node_message.label}-{node_message.execution_id}")
-
-                elif node_message.status == StatusEnum.SUCCESS:
-                    self.accumulator[node_message.node_id] = node_message.result
-                    logger.info(f"Worker received result for: {node_message.label}-{node_message.execution_id}")
-
-                elif node_message.status == StatusEnum.FAILURE:
-                    self.accumulator[node_message.node_id] = node_message.result
-                    await self.cancel_subgraph(self.workflow.nodes[node_message.node_id])  # kill the children!
-                    logger.info(f"Worker received error \"{node_message.result}\" for: {node_message.label}-"
-                                f"{node_message.execution_id}")
-
-                else:
-                    logger.error(f"Unknown message status received: {node_message}")
-                    node_message = None
+            handled = []
+            for msg in msgs:
+                # Anything left over once every action is done is cleaned up along with the stream
+                if len(self.in_process) < 1 and len(self.parallel_in_process) < 1:
+                    break
 
-                await send_status_update(self.session, self.workflow.execution_id, node_message)
-
-            elif node_message.execution_id == self.workflow.execution_id and node_message.node_id in self.parallel_in_process:
-                if node_message.status == StatusEnum.EXECUTING:
-                    logger.debug(f"App started parallel execution of: {node_message.label}-{node_message.execution_id}")
-
-                elif node_message.status == StatusEnum.SUCCESS:
-                    self.parallel_accumulator[node_message.node_id] = node_message.result
-                    logger.debug(f"PARALLEL Worker received result for: {node_message.label}-{node_message.execution_id}")
-
-                elif node_message.status == StatusEnum.FAILURE:
-                    # self.parallel_accumulator[node_message.node_id] = node_message.result
-                    self.parallel_accumulator[node_message.node_id] = None
-                    logger.debug(f"PARALLEL Worker received error \"{node_message.result}\" for: {node_message.label}-"
-                                f"{node_message.execution_id}")
-
-                else:
-                    logger.error(f"Unknown message status received: {node_message}")
-                    node_message = None
-
-                node_message.name = node_message.label
-                await send_status_update(self.session, self.workflow.execution_id, node_message)
-            else:
-                logger.error(f"Message received for unknown execution: {node_message}")
+                # Dereference the redis stream message and load the status message
+                execution_id_node_message, stream, id_ = deref_stream_message([msg])
+                execution_id, node_message = execution_id_node_message
+                await self.handle_action_result(message_loads(node_message))
+                handled.append(id_)
 
-            # Clean up the redis stream and our in process queue
-            if node_message.status != StatusEnum.EXECUTING and node_message.node_id in self.parallel_in_process:
-                self.parallel_in_process.pop(node_message.node_id, None)
-            elif node_message.status != StatusEnum.EXECUTING:
-                self.in_process.pop(node_message.node_id, None)
-            await self.redis.xack(stream=stream, group_name=config.REDIS_ACTION_RESULTS_GROUP, id=id_)
-            await xdel(self.redis, stream=stream, id_=id_)
+            await xack_del(self.redis, self.results_stream, config.REDIS_ACTION_RESULTS_GROUP, *handled)
 
         # Remove the finished results stream and group
         await self.redis.delete(self.results_stream)
         pipe: aioredis.commands.Pipeline = self.redis.pipeline()
-        futs = [pipe.delete(stream) for stream in self.streams]
+        for stream in self.streams:
+            _, app_name, version = stream.split(':')
+            pipe.srem(app_streams_key(app_name, version), stream)
+            pipe.delete(stream)
+        pipe.delete(execution_streams_key(self.workflow.execution_id))
         results = await pipe.execute()
         self.streams = set()
 